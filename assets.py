@@ -1,12 +1,439 @@
 from os.path import exists,abspath
 from dateutil.tz import tzlocal
-from datetime import datetime as dt
-import re, io, os, json, base64, logging, logging.handlers, urllib.parse, zipfile, optparse, time
+from datetime import datetime as dt, timezone
+import re, io, os, json, base64, logging, logging.handlers, urllib.parse, zipfile, optparse, time, threading, random, email.utils, collections, math, asyncio, hashlib, queue, zlib, sqlite3, shutil
 import requests         # python -m pip install requests
+import requests.adapters
+import requests.exceptions
 import dateutil.parser as parser
+from concurrent.futures import ThreadPoolExecutor
+
+class rateLimiter():
+    # Token bucket that is shared by all threads and all HTTP verbs.
+    # Tokens are added continuously at requestsPerMinute/60 per second, up to 'burst' tokens. Every request takes
+    # one token. When the bucket is empty, the token is reserved ahead and the caller waits until it has been
+    # refilled, so requests are spread evenly over the minute instead of stalling at a minute boundary.
+    def __init__(self, requestsPerMinute=975, burst=20):
+        if requestsPerMinute <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit: {requestsPerMinute} requests per minute, burst {burst}")
+        self.requestsPerMinute = requestsPerMinute
+        self.rate = requestsPerMinute/60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        # Add the tokens for the time that passed since the last call (lock must be held)
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now-self.updated)*self.rate)
+        self.updated = now
+
+    def reserve(self):
+        # Take one token and return the number of seconds the caller has to wait before it may be used
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens/self.rate
+
+    def acquire(self):
+        # Block until a request may be sent, returns the time waited in seconds
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        # Hold back all requests for the given number of seconds, e.g. after the API returned a 429
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, -seconds*self.rate)
+
+    def available(self):
+        # Number of tokens that can be taken right now without waiting
+        with self.lock:
+            self.refill()
+            return max(self.tokens, 0.0)
+
+class concurrencyController():
+    # AIMD (additive increase, multiplicative decrease) limit on the number of requests in flight.
+    # Every successful request grows the limit by 1/limit, so it grows by one per round trip of all requests in
+    # flight. The limit is halved when the API throttles (429) and reduced when the latency rises well above the
+    # lowest latency seen, both at most once per cooldown period. While the rate limiter has no tokens left, more
+    # concurrency would only queue on the rate limit, so the limit is not increased.
+    def __init__(self, minLimit=4, maxLimit=32, rateLimiter=None, latencyTolerance=2.0, cooldown=2.0):
+        if minLimit < 1 or maxLimit < minLimit:
+            raise ValueError(f"Invalid concurrency limits: min {minLimit}, max {maxLimit}")
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.limit = float(minLimit)
+        self.rateLimiter = rateLimiter
+        self.latencyTolerance = latencyTolerance
+        self.cooldown = cooldown
+        self.inFlight = 0
+        self.latency = None      # smoothed latency (EWMA)
+        self.baseLatency = None  # lowest latency seen
+        self.lastDecrease = 0.0
+        self.condition = threading.Condition()
+        # Called after every release, e.g. to wake the requests of an event loop that wait for a slot
+        self.listeners = []
+
+    def getLimit(self):
+        with self.condition:
+            return int(self.limit)
+
+    def acquire(self):
+        # Block until there is room for another request in flight
+        with self.condition:
+            while self.inFlight >= int(self.limit):
+                self.condition.wait()
+            self.inFlight += 1
+
+    def tryAcquire(self):
+        # Take a slot when there is room, without blocking. Returns False when there is none
+        with self.condition:
+            if self.inFlight >= int(self.limit):
+                return False
+            self.inFlight += 1
+            return True
+
+    def decrease(self, factor, reason):
+        # Multiplicative decrease (lock must be held)
+        now = time.monotonic()
+        if now - self.lastDecrease < self.cooldown:
+            return
+        self.lastDecrease = now
+        self.limit = max(self.minLimit, self.limit*factor)
+        logging.debug(f"Concurrency limit decreased to {int(self.limit)} ({reason})")
+
+    def release(self, latency=None, throttled=False):
+        # Give back the slot of a finished request and adjust the limit with what was observed
+        with self.condition:
+            self.inFlight -= 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.9*self.latency + 0.1*latency
+                self.baseLatency = latency if self.baseLatency is None else min(self.baseLatency, latency)
+            if throttled:
+                self.decrease(0.5, "throttled")
+            elif self.latency is not None and self.latency > self.baseLatency*self.latencyTolerance:
+                self.decrease(0.8, f"latency {self.latency:.2f}s")
+            elif self.rateLimiter is None or self.rateLimiter.available() >= 1:
+                self.limit = min(self.maxLimit, self.limit + 1/self.limit)
+            self.condition.notify_all()
+        for listener in list(self.listeners):
+            listener()
+
+class workPool():
+    # Run-wide pool for the small per-object tasks of a run.
+    # submit() blocks while maxPending tasks are queued or running, so a producer (e.g. an object scan) can't run
+    # far ahead of the workers and the memory use stays bounded. With an event loop (running in another thread)
+    # the tasks are coroutines that run on that loop, otherwise they run in a thread pool.
+    def __init__(self, maxWorkers, maxPending=None, eventLoop=None):
+        self.eventLoop = eventLoop
+        self.executor = None if eventLoop else ThreadPoolExecutor(maxWorkers)
+        self.maxPending = maxPending or maxWorkers*4
+        self.pending = 0
+        self.errors = 0
+        self.condition = threading.Condition()
+
+    def submit(self, function, *args):
+        with self.condition:
+            while self.pending >= self.maxPending:
+                self.condition.wait()
+            self.pending += 1
+        if self.eventLoop:
+            future = asyncio.run_coroutine_threadsafe(function(*args), self.eventLoop)
+        else:
+            future = self.executor.submit(function, *args)
+        future.add_done_callback(self.taskDone)
+        return future
+
+    def taskDone(self, future):
+        if not future.cancelled() and future.exception():
+            logging.error("Task failed", exc_info=future.exception())
+        with self.condition:
+            if not future.cancelled() and future.exception():
+                self.errors += 1
+            self.pending -= 1
+            self.condition.notify_all()
+
+    def join(self):
+        # Wait until all submitted tasks are done
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+
+    def shutdown(self):
+        self.join()
+        if self.executor:
+            self.executor.shutdown()
+
+class jiraDirectory():
+    # All users and groups of the Jira site, fetched once (all pages) and indexed on every key a user or group
+    # attribute value can contain, so every lookup is a dictionary lookup. Shared by all threads, the first
+    # lookup loads the directory while the other threads wait for it.
+    # A value can match different users on different keys, e.g. the display name of one user is the email address
+    # of another. The precedence is accountId, then emailAddress (case insensitive), then displayName. When users
+    # share a display name, the first one returned by Jira is used. Groups are found by name, then by groupId
+    def __init__(self, connection, userPageSize=1000, groupPageSize=50):
+        self.connection = connection
+        self.userPageSize = userPageSize
+        self.groupPageSize = groupPageSize
+        self.users = None
+        self.groups = None
+        self.userIndexes = []
+        self.groupIndexes = []
+        self.lock = threading.Lock()
+
+    def iterPages(self, query, pageSize):
+        # The results of a paged Jira REST API, users/search returns a list and group/bulk a page with 'values'
+        startAt = 0
+        while True:
+            result = self.connection.assetsGet(f"{self.connection.jiraUrl}{query}?startAt={startAt}&maxResults={pageSize}")
+            if result is None:
+                logging.warning(f"jiraDirectory > page {startAt} of {query} could not be fetched")
+                return
+            values = result.get('values', []) if isinstance(result, dict) else result
+            yield from values
+            if not values or (result.get('isLast', True) if isinstance(result, dict) else len(values) < pageSize):
+                return
+            startAt += len(values)
+
+    def loadUsers(self):
+        users = list(self.iterPages('/rest/api/3/users/search', self.userPageSize))
+        accountIds, emailAddresses, displayNames = {}, {}, {}
+        for user in users:
+            if user.get('accountId'):
+                accountIds.setdefault(user['accountId'], user)
+            if user.get('emailAddress'):
+                emailAddresses.setdefault(user['emailAddress'].lower(), user)
+            if user.get('displayName'):
+                displayNames.setdefault(user['displayName'], user)
+        # The indexes are set before the users, a lookup that finds the users also finds the indexes
+        self.userIndexes = [accountIds, emailAddresses, displayNames]
+        self.users = users
+        logging.info(f"jiraDirectory > {len(users)} users loaded")
+
+    def loadGroups(self):
+        groups = list(self.iterPages('/rest/api/3/group/bulk', self.groupPageSize))
+        names, groupIds = {}, {}
+        for group in groups:
+            if group.get('name'):
+                names.setdefault(group['name'], group)
+            if group.get('groupId'):
+                groupIds.setdefault(group['groupId'], group)
+        self.groupIndexes = [names, groupIds]
+        self.groups = groups
+        logging.info(f"jiraDirectory > {len(groups)} groups loaded")
+
+    def getUsers(self, reload=False):
+        with self.lock:
+            if self.users is None or reload:
+                self.loadUsers()
+            return self.users
+
+    def getGroups(self, reload=False):
+        with self.lock:
+            if self.groups is None or reload:
+                self.loadGroups()
+            return self.groups
+
+    def getUser(self, value):
+        # The user with this accountId, email address or display name
+        if self.users is None:
+            self.getUsers()
+        accountIds, emailAddresses, displayNames = self.userIndexes
+        return accountIds.get(value) or emailAddresses.get(str(value).lower()) or displayNames.get(value)
+
+    def getGroup(self, value):
+        # The group with this name or group id
+        if self.groups is None:
+            self.getGroups()
+        names, groupIds = self.groupIndexes
+        return names.get(value) or groupIds.get(value)
+
+class typeRegistry():
+    # The status types or reference types of the site: the global ones and the ones of each object schema (scopes),
+    # each scope fetched with one request, indexed by id and by name. A created type is added to its scope,
+    # a scope is fetched again after a type in it was changed or deleted, or when it is reloaded. Thread safe
+    def __init__(self, connection, configType):
+        self.connection = connection
+        self.configType = configType # 'statustype' or 'referencetype'
+        self.scopes = {}             # {objectSchemaId (None for the global types): [types]}
+        self.byName = {}             # {objectSchemaId: {name: type}}
+        self.byId = {}               # {id: (objectSchemaId, type)}
+        self.lock = threading.RLock()
+
+    def getTypes(self, objectSchemaId=None, reload=False):
+        # The global types, or the types of one object schema
+        with self.lock:
+            if objectSchemaId in self.scopes and not reload:
+                return self.scopes[objectSchemaId]
+            query = f"{self.connection.assetsUrl}/v1/config/{self.configType}"
+            if objectSchemaId:
+                query += f"?objectSchemaId={objectSchemaId}"
+            types = self.connection.assetsGet(query)
+            if types is None:
+                logging.info(f"typeRegistry > {self.configType} of object schema {objectSchemaId} could not be fetched")
+                return []
+            self.invalidate(objectSchemaId)
+            self.scopes[objectSchemaId] = []
+            self.byName[objectSchemaId] = {}
+            for item in types:
+                self.add(item, objectSchemaId)
+            return self.scopes[objectSchemaId]
+
+    def add(self, item, objectSchemaId=None):
+        # A type that was fetched or created, only a scope that was fetched is kept up to date
+        with self.lock:
+            if objectSchemaId not in self.scopes:
+                return
+            self.scopes[objectSchemaId].append(item)
+            self.byName[objectSchemaId].setdefault(item.get('name'), item)
+            self.byId[str(item.get('id'))] = (objectSchemaId, item)
+
+    def invalidate(self, objectSchemaId=None):
+        # The scope is fetched again on its next use
+        with self.lock:
+            for item in self.scopes.pop(objectSchemaId, []):
+                self.byId.pop(str(item.get('id')), None)
+            self.byName.pop(objectSchemaId, None)
+
+    def invalidateId(self, id):
+        # A type was changed or deleted, its scope is fetched again. An unknown type can be in any scope
+        with self.lock:
+            if str(id) in self.byId:
+                self.invalidate(self.byId[str(id)][0])
+            else:
+                for objectSchemaId in list(self.scopes):
+                    self.invalidate(objectSchemaId)
+
+    def getAll(self, reload=False):
+        # The global types and the types of all object schemas
+        allTypes = list(self.getTypes(None, reload))
+        for objectSchema in self.connection.getObjectSchemas() or []:
+            allTypes.extend(self.getTypes(objectSchema['id'], reload))
+        return allTypes
+
+    def getByName(self, name, objectSchemaId=None, reload=False):
+        # With an object schema id, the type of that object schema or a global type. Without, the global type
+        # or the type of the first object schema that has one with this name
+        if reload:
+            self.getAll(reload)
+        objectSchemaIds = [objectSchemaId] if objectSchemaId else [objectSchema['id'] for objectSchema in self.connection.getObjectSchemas() or []]
+        for scope in [None]+objectSchemaIds:
+            self.getTypes(scope)
+            item = self.byName.get(scope, {}).get(name)
+            if item:
+                return item
+        return None
+
+    def getById(self, id):
+        if str(id) not in self.byId:
+            self.getAll()
+        return self.byId.get(str(id), (None, None))[1]
+
+isoDate = re.compile(r"\d{4}-\d{2}-\d{2}$")
+localTimeZone = tzlocal()
+
+def toDate(value):
+    # Value of a Date attribute: YYYY-MM-DD. ISO dates are used as they are, other formats are parsed
+    if isoDate.match(value):
+        return value
+    return parser.parse(value).strftime("%Y-%m-%d")
+
+def toDateTime(value):
+    # Value of a DateTime attribute: ISO 8601 in the local time zone. ISO values are parsed by datetime,
+    # which is much faster than dateutil, other formats by dateutil
+    try:
+        parsed = dt.fromisoformat(value)
+    except ValueError:
+        parsed = parser.parse(value)
+    return parsed.replace(tzinfo=localTimeZone).isoformat(timespec='milliseconds')
+
+def splitValues(value):
+    # The values of an attribute in the object data: a list, or a string with the values split by double pipes ||
+    if isinstance(value, list):
+        return value
+    if str(value) == 'nan':
+        return [""]
+    return value.split("||")
+
+class objectPayloadEncoder():
+    # Makes the payload of a create or update request of one object type from object data ({attribute name: value}).
+    # The attributes are looked up and a converter is chosen for each attribute once, when the encoder is made,
+    # instead of for every value of every object. The payload is a dict, so the values need no JSON escaping
+    def __init__(self, connection, objectTypeId, attributes):
+        self.connection = connection
+        self.objectTypeId = str(objectTypeId)
+        # {attribute name: (attribute id, converter, skip the attribute when a value can't be converted)}
+        self.plan = {}
+        for attribute in attributes or []:
+            if attribute['name'] not in self.plan:
+                self.plan[attribute['name']] = self.compile(attribute)
+        self.referenceNames = [attribute['name'] for attribute in attributes or [] if attribute['type'] == 1]
+
+    def compile(self, attribute):
+        connection = self.connection
+        converter = None
+        if attribute['type'] == 0:
+            # This is the default attribute
+            if attribute['defaultType']['id'] == 4:
+                converter = toDate
+            elif attribute['defaultType']['id'] == 6:
+                converter = toDateTime
+        elif attribute['type'] == 1:
+            # The attribute is a reference, the object key of the referenced object. The keys are resolved by encode
+            converter = lambda value: connection.objectKeys.get(str(value))
+        elif attribute['type'] == 2:
+            # The attribute is a user, the account id of the user
+            converter = lambda value: (connection.getJiraUserAccount(value) or {}).get('accountId')
+        elif attribute['type'] == 4:
+            # The attribute is a group, the id of the group
+            converter = lambda value: (connection.getJiraGroup(value) or {}).get('groupId')
+        elif attribute['type'] == 7:
+            # The attribute is a status, the id of the status type
+            converter = lambda value: (connection.getStatusTypeByName(value) or {}).get('id')
+        # A reference that is not found is left out, for the other types the attribute is left out,
+        # so the current value is not changed
+        return str(attribute.get('id')), attribute['name'], converter, attribute['type'] != 1
+
+    def encode(self, myDict):
+        # The keys of all referenced objects that are not cached yet are looked up at once
+        objectKeys = self.connection.objectKeys
+        missingIds = [objectId for name in self.referenceNames if name in myDict for objectId in splitValues(myDict[name]) if objectId and str(objectId) not in objectKeys]
+        if missingIds:
+            self.connection.resolveObjectKeys(missingIds)
+        attributes = []
+        for key, value in myDict.items():
+            step = self.plan.get(key)
+            if not step:
+                # Attribute could not be found, skip attribute
+                logging.warning("Attribute '"+key+"' could not be found for objectTypeId: "+self.objectTypeId)
+                continue
+            attributeId, name, converter, skipAttribute = step
+            values = []
+            for aggVal in splitValues(value):
+                if converter:
+                    converted = converter(aggVal)
+                    if converted is None:
+                        # We don't want this value or attribute in our payload, because it has no result and we don't want to change the current value
+                        if skipAttribute:
+                            logging.debug(f"constructObjectPayload > skip attribute: {name} for value: {aggVal}")
+                            values = None
+                            break
+                        logging.warning(f"constructObjectPayload > Can't find referenced object {name} for value: {aggVal}")
+                        continue
+                    aggVal = converted
+                values.append({'value': str(aggVal)})
+            if values is not None:
+                attributes.append({'objectTypeAttributeId': attributeId, 'objectAttributeValues': values})
+        return {'objectTypeId': self.objectTypeId, 'attributes': attributes}
 
 class assetsConnect():
-    def __init__(self, jiraUrl, username, apiToken):
+    def __init__(self, jiraUrl, username, apiToken, maxConcurrency=32, minConcurrency=4, connectTimeout=10, readTimeout=60, requestsPerMinute=975, requestBurst=20, maxRetries=5, backoffBase=1, backoffMax=60):
         if not jiraUrl:
             logging.fatal(f"Jira URL was not provided.")
             exit(1)
@@ -21,9 +448,30 @@ class assetsConnect():
         self.apiKey   = base64.b64encode(bytes(username+":"+apiToken, 'utf-8')).decode('ascii')
         self.headers  = {"Authorization": "Basic "+self.apiKey, "Content-Type": "application/json"}
 
-        self.requestNumber = 0
-        self.requestMinute = dt.now().minute
-        self.throttleLimit = 975 # Atlasssian throttle is 1000 requests per minute, but to be on the safe side, reduce it a bit.
+        # One session is shared by all threads, so connections to the Jira site and api.atlassian.com are kept
+        # alive and reused instead of doing a new TCP+TLS handshake for every request.
+        # The pool is blocking and sized to the maximum number of requests in flight.
+        self.timeout = (connectTimeout, readTimeout)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=maxConcurrency, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Atlasssian throttle is 1000 requests per minute, but to be on the safe side, reduce it a bit.
+        self.rateLimiter = rateLimiter(requestsPerMinute, requestBurst)
+
+        # The number of requests in flight adapts to the latency, throttling and the rate limit
+        self.concurrency = concurrencyController(minConcurrency, maxConcurrency, self.rateLimiter)
+
+        # Retry settings, see assetsRequest
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.retryStatuses = [429, 500, 502, 503, 504]
+        self.retryStatusesPost = [429, 503]
+        self.requestStats = {'requests': 0, 'retries': 0, 'failed': 0}
+        self.requestStatsLock = threading.Lock()
         
         # Get workspaceId
         workspaceId = self.getWorkspaceId()
@@ -36,49 +484,138 @@ class assetsConnect():
         self.assetsUrl = 'https://api.atlassian.com/jsm/assets/workspace/'+self.workspaceId
         
         self.objectSchemas = {}
-        self.statusTypes = {}
-        self.globalStatusTypes = {}
-        self.referenceTypes = {}
-        self.globalReferenceTypes = {}
+        # Indexes on the cached object schemas, object types and attributes, for lookups by key and name.
+        # A method that creates or changes metadata invalidates the part of the cache it changed, a list that
+        # was fetched before an invalidation is not cached (metadataVersion)
+        self.objectSchemaIndex = None   # ({objectSchemaKey: object schema}, {name: object schema})
+        self.objectTypeIndex = {}       # {objectSchemaId: ({name: object type}, {(name, parentObjectTypeId): object type})}
+        self.attributeIndex = {}        # {objectTypeId: {name: attribute}}
+        self.metadataVersion = 0
+        self.metadataLock = threading.Lock()
+        # Global and object schema status types and reference types
+        self.statusTypes = typeRegistry(self, 'statustype')
+        self.referenceTypes = typeRegistry(self, 'referencetype')
         self.objectTypes = {}
         self.objectTypeAttributes = {}
-        self.jiraUserAccounts = {}
-        self.jiraGroups = {}
+        # Users and groups for user and group attributes, loaded on first use
+        self.jiraDirectory = jiraDirectory(self)
+        # Object keys of referenced objects by object id, for the reference attributes of object payloads
+        self.objectKeys = {}
+        # {objectTypeId: (attribute index the encoder was made from, objectPayloadEncoder)}
+        self.payloadEncoders = {}
         
     def getWorkspaceId(self):
         logging.debug("getWorkspaceId")
         query = self.jiraUrl+'/rest/servicedeskapi/assets/workspace'
         result = self.assetsGet(query)
         return result['values'][0]['workspaceId'] if result else None
+
+    def close(self):
+        # Close all pooled connections
+        logging.debug("close")
+        self.session.close()
         
     def throttleTest(self):
         # The rest api is throttled for 1000 requests per minute.
-        # So we need to pause when we have more requests then a 1000
-        currentMinute = dt.now().minute
-        if self.requestNumber < self.throttleLimit:
-            if self.requestMinute == currentMinute:
-                self.requestNumber += 1
-                #logging.debug(f'Request number ({self.requestMinute}): {self.requestNumber} ')
-            else:
-                # another minute has passed, so we can eset the throttleNumber
-                self.requestMinute = currentMinute
-                self.requestNumber = 0
-                #loging.debug(f'Reset request number ({self.requestMinute}): {self.requestNumber} ')
-        else:
-            # we have reached the throttle threshold so we have to wait for the next minute
-            logging.warning("Throttling to prevent the requests per minute limit error of the Atlassian REST API. Reduce the number of threads to prevent this.")
-            while self.requestMinute == currentMinute:
-                time.sleep(1)
-                currentMinute = dt.now().minute
-            self.requestNumber = 0
+        # Wait for a token of the rate limiter, this spreads the requests of all threads over the minute
+        waited = self.rateLimiter.acquire()
+        if waited > 1:
+            logging.debug(f"Throttled for {waited:.1f}s to stay below {self.rateLimiter.requestsPerMinute} requests per minute")
         return
-    
+
+    def countRequest(self, key):
+        with self.requestStatsLock:
+            self.requestStats[key] = self.requestStats.get(key, 0) + 1
+
+    def getRequestStats(self):
+        # Number of requests, retries (per reason), requests that failed after all retries and the concurrency limit
+        with self.requestStatsLock:
+            return dict(self.requestStats, concurrency=self.concurrency.getLimit())
+
+    def retryDelay(self, attempt, response=None):
+        # Honor the Retry-After header of a throttled or unavailable response,
+        # otherwise use exponential backoff with full jitter
+        retryAfter = response.headers.get('Retry-After') if response is not None else None
+        if retryAfter:
+            try:
+                delay = float(retryAfter)
+            except ValueError:
+                try:
+                    delay = (email.utils.parsedate_to_datetime(retryAfter) - dt.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = self.backoffBase
+            return min(max(delay, 0), self.backoffMax) + random.uniform(0, self.backoffBase)
+        return random.uniform(0, min(self.backoffMax, self.backoffBase * 2**attempt))
+
+    def assetsRequest(self, method, query, **kwargs):
+        # Send a request. Throttled requests (429), temporary server errors (5xx) and connection errors are retried.
+        # POST is not idempotent, so it is only retried when the server did not process the request.
+        # Returns the response or None when the request failed after all retries.
+        idempotent = method != 'POST'
+        attempt = 0
+        while True:
+            self.concurrency.acquire()
+            self.throttleTest()
+            self.countRequest('requests')
+            response = None
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, query, timeout=self.timeout, **kwargs)
+                reason = str(response.status_code)
+                retryable = response.status_code in self.retryStatuses and (idempotent or response.status_code in self.retryStatusesPost)
+            except requests.exceptions.ConnectTimeout as e:
+                reason = type(e).__name__
+                retryable = True
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                # The response may have been cut off, only an idempotent request can be sent again
+                reason = type(e).__name__
+                retryable = idempotent
+                if not retryable:
+                    logging.error(f"{method} {query} failed: {e}")
+                    self.countRequest('failed')
+                    return None
+            except requests.exceptions.RequestException as e:
+                # E.g. an invalid URL, too many redirects or a body that can't be decoded, sending it again won't help
+                logging.error(f"{method} {query} failed: {e}")
+                self.countRequest('failed')
+                return None
+            finally:
+                # The slot is always given back, a lost slot would block a worker for good
+                if response is not None:
+                    self.concurrency.release(time.monotonic()-started, response.status_code == 429)
+                else:
+                    self.concurrency.release()
+
+            if not retryable:
+                if response.status_code >= 400:
+                    logging.warning(f"{method} {query} returned status {response.status_code}")
+                return response
+            if attempt >= self.maxRetries:
+                logging.error(f"{method} {query} failed after {attempt} retries, last status: {reason}")
+                self.countRequest('failed')
+                return None
+
+            delay = self.retryDelay(attempt, response)
+            if response is not None and response.status_code == 429:
+                # Throttled, hold back the requests of all threads, not only this one
+                self.rateLimiter.pause(delay)
+            attempt += 1
+            self.countRequest('retries')
+            self.countRequest(f'retries_{reason}')
+            logging.warning(f"{method} {query} returned {reason}, retry {attempt}/{self.maxRetries} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def responseJson(self, response):
+        # Decode the JSON body of a response, an empty body returns None
+        if response is None or response.text == '':
+            return None
+        return response.json()
+
     def assetsGet(self, query):
         logging.debug("assetsGet")
         try:
-            self.throttleTest()
-            result = requests.get(query, headers=self.headers)
-            return result.json()
+            result = self.assetsRequest('GET', query)
+            return self.responseJson(result)
         except Exception as e:
             logging.exception(e)
             return None
@@ -87,13 +624,12 @@ class assetsConnect():
         logging.debug("assetsDelete")
         logging.debug(f"  {query}")
         try:
-            self.throttleTest()
             result = None
             if params:
-                result = requests.delete(query, params=params, headers=self.headers)
+                result = self.assetsRequest('DELETE', query, params=params)
             else:
-                result = requests.delete(query, headers=self.headers)
-            return result.json()
+                result = self.assetsRequest('DELETE', query)
+            return self.responseJson(result)
         except Exception as e:
             logging.exception(e)
             return None
@@ -101,15 +637,14 @@ class assetsConnect():
     def assetsPut(self, query, data=None):
         logging.debug("assetsPut")
         try:
-            self.throttleTest()
             if data:
                 logging.debug(f"  {query}")
                 logging.debug(f"  {json.dumps(data)}")
-                result = requests.put(query, json=data, headers=self.headers)
+                result = self.assetsRequest('PUT', query, json=data)
             else:
                 logging.debug(f"  {query}")
-                result = requests.put(query, headers=self.headers)
-            return result.json()
+                result = self.assetsRequest('PUT', query)
+            return self.responseJson(result)
         except Exception as e:
             logging.exception(e)
             return None
@@ -119,66 +654,27 @@ class assetsConnect():
         logging.debug(f"  {query}")
         logging.debug(f"  {json.dumps(data)}")
         try:
-            self.throttleTest()
-            result =  requests.post(query, json=data, headers=self.headers)
-            if result.text != '':
-                return result.json()
-            else: 
-                return None
+            result = self.assetsRequest('POST', query, json=data)
+            return self.responseJson(result)
         except Exception as e:
             logging.exception(e)
             return None
 
     def getAllStatusTypes(self, reload=False):
-        # Get global status types
-        allStatusTypes = self.getGlobalStatusTypes(reload=reload)
-        
-        # Get object schemas
-        objectSchemas = self.getObjectSchemas()
-        for objectSchema in objectSchemas:
-            # Get status type for this object schema
-            statusTypes = self.getStatusTypes(objectSchema['id'],reload=reload)
-            # Extend the list 
-            allStatusTypes.extend(statusTypes)
-        
-        self.statusTypes = allStatusTypes
-        return allStatusTypes
+        # Global status types and the status types of all object schemas
+        return self.statusTypes.getAll(reload)
     
     def getGlobalStatusTypes(self, reload=False):
         logging.debug("getGlobalStatusTypes")
-        if self.globalStatusTypes and not reload:
-            # Return statusTypes when we already got them once
-            logging.debug("getGlobalStatusTypes > return cached status types")
-            return self.globalStatusTypes
-        
-        statusTypes = []
-        # Get global status types
-        statusTypes = self.assetsGet(self.assetsUrl+'/v1/config/statustype')
-        self.globalStatusTypes = statusTypes
-        return statusTypes
+        return self.statusTypes.getTypes(None, reload)
     
-    def getStatusTypeByName(self, name, reload=False):
+    def getStatusTypeByName(self, name, reload=False, objectSchemaId=None):
         logging.debug("getStatusTypeByName name:"+str(name)+", reload:"+(str(reload)))
-        if not self.statusTypes:
-            self.getAllStatusTypes(reload)
-        for statusType in self.statusTypes:
-            if statusType.get('name') == name:
-                return statusType
-        # No status type with that name was found
-        return None
+        return self.statusTypes.getByName(name, objectSchemaId, reload)
 
     def getStatusTypes(self, objectSchemaId, reload=False):
         logging.debug("getStatusType")
-        if self.statusTypes.get(objectSchemaId) and not reload:
-            # Return statusTypes when we already got them once
-            logging.debug("getStatusType > return cached status types")
-            return self.statusTypes.get(objectSchemaId)
-
-        # Get status type of object schema
-        statusTypes = []
-        statusTypes = self.assetsGet(self.assetsUrl+'/v1/config/statustype?objectSchemaId='+objectSchemaId)
-        self.statusTypes[objectSchemaId] = statusTypes  
-        return statusTypes
+        return self.statusTypes.getTypes(objectSchemaId, reload)
     
     def getStatusType(self, id):
         logging.debug("getStatusType id:"+str(id))
@@ -207,6 +703,7 @@ class assetsConnect():
             data['objectSchemaId']=objectSchemaId
         result = self.assetsPost(query, data)
         if result:
+            self.statusTypes.add(result, objectSchemaId)
             return result
         else:
             logging.warning(f"createStatusType returned None for name: {name}")
@@ -229,6 +726,7 @@ class assetsConnect():
         if objectSchemaId:
             data['objectSchemaId']=objectSchemaId # Optional
         result = self.assetsPut(query, data)
+        self.statusTypes.invalidateId(id)
 
         if "id" in result:
             return result["id"]
@@ -239,52 +737,26 @@ class assetsConnect():
     def deleteStatusType(self, id):
         logging.debug("updateStatusType id"+str(id))
         query = self.assetsUrl+'/v1/config/statustype/'+str(id)
-        return self.assetsDelete(query)
+        result = self.assetsDelete(query)
+        self.statusTypes.invalidateId(id)
+        return result
     
     def getAllReferenceTypes(self, reload=False):
-        # Get global reference types
-        allReferenceTypes = self.getGlobalReferenceTypes(reload=reload)
-        
-        # Get object schemas
-        objectSchemas = self.getObjectSchemas()
-        for objectSchema in objectSchemas:
-            # Get reference type for this object schema
-            referenceTypes = self.getReferenceTypes(objectSchema['id'],reload=reload)
-            # Extend the list 
-            allReferenceTypes.extend(referenceTypes)
-        
-        self.referenceTypes = allReferenceTypes
-        return allReferenceTypes
+        # Global reference types and the reference types of all object schemas
+        return self.referenceTypes.getAll(reload)
     
     def getGlobalReferenceTypes(self, reload=False):
         logging.debug("getGlobalReferenceTypes")
-        if self.globalReferenceTypes and not reload:
-            # Return reference types when we already got them once
-            logging.debug("getGlobalReferenceTypes > return cached reference types")
-            return self.globalReferenceTypes
-        
-        referenceTypes = []
-        # Get global reference types
-        referenceTypes = self.assetsGet(self.assetsUrl+'/v1/config/referencetype')
-        self.globalReferenceTypes = referenceTypes
-        return referenceTypes
+        return self.referenceTypes.getTypes(None, reload)
     
-    def getReferenceTypeByName(self, name, reload=False):
+    def getReferenceTypeByName(self, name, reload=False, objectSchemaId=None):
         logging.debug(f'getReferenceTypeByName name: {name}, reload: {reload}')
-        if not self.referenceTypes:
-            self.getAllReferenceTypes(reload)
-        for referenceType in self.referenceTypes:
-            if referenceType.get('name') == name:
-                return referenceType
-        # No reference type with that name was found
-        return None
+        return self.referenceTypes.getByName(name, objectSchemaId, reload)
 
     def getReferenceTypes(self, objectSchemaId, reload=False):
         logging.debug("getReferenceType")
-        # Get reference type of object schema
-        referenceTypes = []
-        referenceTypes = self.assetsGet(self.assetsUrl+'/v1/config/referencetype?objectSchemaId='+objectSchemaId)
-        return referenceTypes
+        # Reference types of the object schema
+        return self.referenceTypes.getTypes(objectSchemaId, reload)
     
     def createReferenceType(self, name, color, desc="", objectSchemaId=None):
         logging.debug(f'createReferenceType name: {name}, description: {desc}, color: {color}, objectSchemaId: {objectSchemaId}')
@@ -299,6 +771,7 @@ class assetsConnect():
         query = f'{self.assetsUrl}/v1/config/referencetype'
         result = self.assetsPost(query, data)
         if result:
+            self.referenceTypes.add(result, objectSchemaId)
             return result
         else:
             logging.warning(f"createReferenceType returned None for name: {name}")
@@ -308,7 +781,9 @@ class assetsConnect():
     def deleteReferenceType(self,referenceTypeId):
         logging.debug(f'deleteReferenceType id: {referenceTypeId}')
         query = f'{self.assetsUrl}/v1/config/referencetype/{referenceTypeId}'
-        return self.assetsDelete(query)
+        result = self.assetsDelete(query)
+        self.referenceTypes.invalidateId(referenceTypeId)
+        return result
     
     def updateReferenceType(self, id, name=None, color=None, desc=None, objectSchemaId=None):
         logging.debug(f'updateReferenceType id:{id}, name:{name}, color:{color}, desc:{desc}, objectSchemaId:{objectSchemaId}')
@@ -329,6 +804,7 @@ class assetsConnect():
         if objectSchemaId:
             data['objectSchemaId']=objectSchemaId # Optional
         result = self.assetsPut(query, data)
+        self.referenceTypes.invalidateId(id)
 
         if  "id" in result:
             return result["id"]
@@ -348,38 +824,131 @@ class assetsConnect():
         
     def getLabelAttribute(self, objectTypeId):
         logging.debug(f"getLabelAttribute objectTypeId: {objectTypeId}")
-        attributes = self.getAttributeList(objectTypeId)
-        for attribute in attributes:
+        attributes = self.getObjectTypeAttributes(objectTypeId)
+        for attribute in attributes or []:
             if attribute.get('label'):
                 return attribute
         logging.warning(f"getLabelAttribute returned None for objectTypeId: {objectTypeId}")
         return None
         
-    def getObjects(self, iql, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1):
+    def getObjects(self, iql, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1, window=None):
         logging.debug("getObjects iql:"+urllib.parse.quote_plus(iql)+", includeExtendedInfo:"+(str(includeExtendedInfo))+", includeAttributes:"+(str(includeAttributes))+", includeAttributesDeep:"+(str(includeAttributesDeep)))
-        
+        objects = []
+        try:
+            for page in self.iterObjectPages(iql, includeExtendedInfo, includeAttributes, includeAttributesDeep, window):
+                objects.extend(page)
+        except RuntimeError as e:
+            # Something went wrong and we did not get back a proper response
+            logging.warning(str(e))
+            return None
+        return objects
+
+    def iterObjects(self, iql, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1):
+        # Generator variant of getObjects, the objects are yielded while the next pages are still being fetched
+        for page in self.iterObjectPages(iql, includeExtendedInfo, includeAttributes, includeAttributesDeep):
+            yield from page
+
+    def iterObjectPages(self, iql, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1, window=None):
+        # Yields the objects of an IQL query page by page, in page order.
+        # Once the first page tells the number of pages, the other pages are fetched concurrently, at most
+        # window (default concurrency.maxLimit) pages ahead of the caller, so the memory use does not grow with the number of pages.
+        # Raises RuntimeError when a page could not be fetched.
+        logging.debug("iterObjectPages iql:"+urllib.parse.quote_plus(iql))
         query = self.assetsUrl+'/v1/iql/objects?includeExtendedInfo='+str(includeExtendedInfo)+'&includeAttributes='+str(includeAttributes)+'&includeAttributesDeep='+str(includeAttributesDeep)+'&iql='+urllib.parse.quote_plus(iql)
         # Get first page of iql query
         responseIql = self.assetsGet(query)
         if not responseIql:
-            # Something went wrong and we did not get back a proper response
-            return None
-            
-        objects = []
-        if (responseIql.get('iqlSearchResult')):
-            # Iql query returned a result
-            objects = responseIql['objectEntries']
-            nextPage = responseIql['pageNumber']+1
-            totalPages = responseIql['pageSize']
-            
-            # Get all other pages of iql query
-            while nextPage <= totalPages:
-                nextResponseIql = self.assetsGet(query+'&page='+str(nextPage))
-                objects.extend(nextResponseIql['objectEntries'])
-                nextPage = nextResponseIql['pageNumber']+1
-    
-        return objects
+            raise RuntimeError(f"getObjects returned None for iql: {iql}")
+        if not responseIql.get('iqlSearchResult'):
+            return
+        # Iql query returned a result
+        yield responseIql['objectEntries']
+        nextPage = responseIql['pageNumber']+1
+        totalPages = iqlPageCount(responseIql)
+        if nextPage > totalPages:
+            return
+
+        # Get all other pages of iql query
+        window = window or self.concurrency.maxLimit
+        pending = collections.deque()
+        with ThreadPoolExecutor(min(window, totalPages-nextPage+1)) as executor:
+            try:
+                while pending or nextPage <= totalPages:
+                    while nextPage <= totalPages and len(pending) < window:
+                        pending.append((nextPage, executor.submit(self.assetsGet, query+'&page='+str(nextPage))))
+                        nextPage += 1
+                    page, future = pending.popleft()
+                    nextResponseIql = future.result()
+                    if not nextResponseIql or 'objectEntries' not in nextResponseIql:
+                        raise RuntimeError(f"getObjects page {page}/{totalPages} returned None for iql: {iql}")
+                    yield nextResponseIql['objectEntries']
+            finally:
+                # The caller stopped early or a page failed, don't fetch the remaining pages
+                for page, future in pending:
+                    future.cancel()
     
+    def getObjectIdRange(self, iql):
+        # Lowest and highest objectId of the objects found by iql, None when it can't be determined
+        ids = []
+        for order in ['asc', 'desc']:
+            query = self.assetsUrl+'/v1/iql/objects?includeAttributes=False&resultPerPage=1&iql='+urllib.parse.quote_plus(f'{iql} order by objectId {order}')
+            result = self.assetsGet(query)
+            if not result or not result.get('objectEntries'):
+                logging.info(f"getObjectIdRange returned None for iql: {iql}")
+                return None
+            ids.append(int(result['objectEntries'][0]['id']))
+        return min(ids), max(ids)
+
+    def getObjectShards(self, iql, objectCount, shardSize):
+        # Split the query into IQL shards on objectId ranges of about shardSize objects each.
+        # The first and last shard are open ended, so the shards cover all objects even when the id range is off.
+        nrOfShards = math.ceil(objectCount/shardSize) if shardSize else 1
+        idRange = self.getObjectIdRange(iql) if nrOfShards > 1 else None
+        if not idRange or idRange[1]-idRange[0] < nrOfShards:
+            return [iql]
+        minId, maxId = idRange
+        bounds = [minId + (maxId-minId+1)*i//nrOfShards for i in range(1, nrOfShards)]
+        shards = [f'{iql} and objectId < {bounds[0]}']
+        for lower, upper in zip(bounds, bounds[1:]):
+            shards.append(f'{iql} and objectId >= {lower} and objectId < {upper}')
+        shards.append(f'{iql} and objectId >= {bounds[-1]}')
+        return shards
+
+    def iterObjectsSharded(self, iql, objectCount, shardSize=5000, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1):
+        # Generator variant of getObjects for large results: the objects are scanned as independent objectId range
+        # shards in parallel, so no shard has to page deep into the result. Every shard is sorted on objectId and
+        # the shards are yielded in range order, so the merged result is always in objectId order.
+        # At most concurrency.maxLimit shards are scanned or waiting for the caller at the same time, so about that
+        # many times shardSize objects are kept in memory. The pages of a shard are fetched with its share of the
+        # concurrency. A result of at most shardSize objects is scanned as a single query.
+        shards = self.getObjectShards(iql, objectCount, shardSize)
+        if len(shards) == 1:
+            yield from self.iterObjects(iql, includeExtendedInfo, includeAttributes, includeAttributesDeep)
+            return
+        logging.info(f"getObjects: {objectCount} objects scanned in {len(shards)} shards for iql: {iql}")
+
+        workers = min(len(shards), self.concurrency.maxLimit)
+        pageWindow = max(1, self.concurrency.maxLimit // workers)
+
+        def scanShard(shard):
+            objects = self.getObjects(shard, includeExtendedInfo, includeAttributes, includeAttributesDeep, pageWindow)
+            if objects is None:
+                raise RuntimeError(f"getObjects returned None for shard: {shard}")
+            return sorted(objects, key=lambda object: int(object['id']))
+
+        remaining = collections.deque(shards)
+        pending = collections.deque()
+        with ThreadPoolExecutor(workers) as executor:
+            try:
+                while pending or remaining:
+                    while remaining and len(pending) < workers:
+                        pending.append(executor.submit(scanShard, remaining.popleft()))
+                    yield from pending.popleft().result()
+            finally:
+                # The caller stopped early or a shard failed, don't scan the remaining shards
+                for future in pending:
+                    future.cancel()
+
     def getObjectsViaNavlist(self, data, includeAttributes=True):
         logging.debug("getObjectsViaNavlist :includeAttributes:"+(str(includeAttributes)))
         
@@ -407,6 +976,21 @@ class assetsConnect():
         return objects
         
 
+    def resolveObjectKeys(self, objectIds, batchSize=50):
+        # The object keys of many objects with a few 'objectId in (...)' queries, cached in objectKeys.
+        # Returns {object id: object key} of the objects that were found
+        objectIds = list(dict.fromkeys(str(objectId) for objectId in objectIds))
+        missingIds = [objectId for objectId in objectIds if objectId not in self.objectKeys]
+        for i in range(0, len(missingIds), batchSize):
+            for object in self.getObjects(f"objectId in ({','.join(missingIds[i:i+batchSize])})", includeAttributes=False) or []:
+                self.objectKeys[str(object['id'])] = object.get('objectKey')
+        return {objectId: self.objectKeys[objectId] for objectId in objectIds if self.objectKeys.get(objectId)}
+
+    def cacheObjectKey(self, object):
+        # Remember the key of an object that was created or fetched
+        if object and object.get('id') and object.get('objectKey'):
+            self.objectKeys[str(object['id'])] = object['objectKey']
+
     def getObject(self, id):
         logging.debug("getObject id:"+str(id))
         query = self.assetsUrl+'/v1/object/'+str(id)
@@ -431,7 +1015,8 @@ class assetsConnect():
         logging.debug("getObjectAttributes id:"+str(id))
         query = self.assetsUrl+'/v1/object/'+str(id)+'/attributes'
         result = self.assetsGet(query)
-        if result:
+        # An empty list is an answer too, None means the request failed
+        if result is not None:
             return result
         else:
             logging.info(f"getObjectAttributes returned None for id: {id}")
@@ -441,7 +1026,8 @@ class assetsConnect():
         logging.debug("getObjectHistory id:"+str(id))
         query = self.assetsUrl+'/v1/object/'+str(id)+'/history'
         result = self.assetsGet(query)
-        if result:
+        # An empty list is an answer too, None means the request failed
+        if result is not None:
             return result
         else:
             logging.info(f"getObjectHistory returned None for id: {id}")
@@ -451,7 +1037,8 @@ class assetsConnect():
         logging.debug("getObjectComment id:"+str(id))
         query = self.assetsUrl+'/v1/comment/object/'+str(id)
         result = self.assetsGet(query)
-        if result:
+        # An empty list is an answer too, None means the request failed
+        if result is not None:
             return result
         else:
             logging.info(f"getObjectComment returned None for id: {id}")
@@ -493,19 +1080,20 @@ class assetsConnect():
             logging.warning("Unknown objecttype name: "+objectTypeName)
             return None
         objectTypeId = objectType.get('id')
-        payload = self.constructObjectPayload(myDict,objectTypeId, objectToUpdate)
-        return self.updateObject(objectToUpdate[0]['id'],json.loads(payload))
+        payload = self.buildObjectPayload(myDict,objectTypeId)
+        return self.updateObject(objectToUpdate[0]['id'],payload)
 
     def updateObjectByObjectTypeId(self, objectId, objectTypeId, myDict):
         logging.debug("updateObjectByObjectTypeId objectId: "+str(objectId)+", objectTypeId:"+str(objectTypeId)+", myDict:"+(str(myDict)))
-        payload = self.constructObjectPayload(myDict,objectTypeId)
-        return self.updateObject(objectId,json.loads(payload))
+        payload = self.buildObjectPayload(myDict,objectTypeId)
+        return self.updateObject(objectId,payload)
 
     def createObject(self, data):
         logging.debug("createObject data:"+str(data))
         query = self.assetsUrl+'/v1/object/create'
         result = self.assetsPost(query, data)
         if result:
+            self.cacheObjectKey(result)
             return result
         else:
             logging.warning("createObject returned None")
@@ -522,13 +1110,13 @@ class assetsConnect():
             logging.warning("Unknown objecttype name: "+objectTypeName)
             return None
         
-        payload = self.constructObjectPayload(myDict,objectType.get('id'))
-        return self.createObject(json.loads(payload))
+        payload = self.buildObjectPayload(myDict,objectType.get('id'))
+        return self.createObject(payload)
 
     def createObjectById(self, myDict, objectTypeId):
         logging.debug("createObjectById myDict:"+str(myDict)+", objectTypeId:"+(str(objectTypeId)))
-        payload = self.constructObjectPayload(myDict,objectTypeId)
-        return self.createObject(json.loads(payload))
+        payload = self.buildObjectPayload(myDict,objectTypeId)
+        return self.createObject(payload)
 
     def getObjectSchemas(self, reload=False):
         logging.debug("getObjectSchemas reload:"+str(reload))
@@ -536,6 +1124,7 @@ class assetsConnect():
             # Return object schema's when we already got them once
             return self.objectSchemas
         
+        version = self.metadataVersion
         isLast = False
         result = []
         startAt = 0
@@ -549,32 +1138,33 @@ class assetsConnect():
             else:
                 isLast = True
 
-        self.objectSchemas = result
-        return self.objectSchemas
+        index = indexMetadata(result, [lambda objectSchema: objectSchema['objectSchemaKey'], lambda objectSchema: objectSchema['name']])
+        with self.metadataLock:
+            if version == self.metadataVersion:
+                self.objectSchemas = result
+                self.objectSchemaIndex = index
+        return result
+
+    def getObjectSchemaIndex(self, reload=False):
+        index = self.objectSchemaIndex
+        if index is None or reload:
+            index = indexMetadata(self.getObjectSchemas(reload), [lambda objectSchema: objectSchema['objectSchemaKey'], lambda objectSchema: objectSchema['name']])
+        return index
+
+    def invalidateObjectSchemas(self):
+        # The object schemas are fetched again on the next lookup
+        with self.metadataLock:
+            self.metadataVersion += 1
+            self.objectSchemas = {}
+            self.objectSchemaIndex = None
 
     def getObjectSchemaByName (self, name, reload=False):
         logging.debug("getObjectSchemaByName name:"+str(name)+", reload:"+(str(reload)))
-        objectSchemas = self.getObjectSchemas(reload)
-        
-        foundObjectSchema = None
-        # Find the object schema with the correct name
-        for objectSchema in objectSchemas:
-            if objectSchema['name'] == name:
-                foundObjectSchema = objectSchema
-                break
-        return foundObjectSchema
+        return self.getObjectSchemaIndex(reload)[1].get(name)
  
     def getObjectSchemaByKey (self, key, reload=False):
         logging.debug("getObjectSchemaByKey key:"+str(key)+", reload:"+(str(reload)))
-        objectSchemas = self.getObjectSchemas(reload)
-        
-        foundObjectSchema = None
-        # Find the object schema with the correct name
-        for objectSchema in objectSchemas:
-            if objectSchema['objectSchemaKey'] == key:
-                foundObjectSchema = objectSchema
-                continue
-        return foundObjectSchema
+        return self.getObjectSchemaIndex(reload)[0].get(key)
 
     def getObjectSchema(self,id):
         logging.debug("getObjectSchema id:"+str(id))
@@ -591,6 +1181,8 @@ class assetsConnect():
         logging.debug("deleteObjectSchema id:"+str(id))
         query = self.assetsUrl+'/v1/objectschema/'+str(id)
         result = self.assetsDelete(query)
+        self.invalidateObjectSchemas()
+        self.invalidateObjectTypes(id)
         if result:
             return result
         else:
@@ -607,6 +1199,7 @@ class assetsConnect():
         if description:
             data['description'] = description
         result = self.assetsPost(query, data)
+        self.invalidateObjectSchemas()
         if result:
             return result
         else:
@@ -617,6 +1210,7 @@ class assetsConnect():
         logging.debug("updateObjectschema id:"+str(id)+", data:"+(str(data)))
         query = self.assetsUrl+'/v1/objectschema/'+str(id)
         result = self.assetsPut(query, data)
+        self.invalidateObjectSchemas()
         if result:
             return result
         else:
@@ -666,43 +1260,51 @@ class assetsConnect():
 
     def getObjectTypes (self, objectSchemaId, includeObjectCounts=False, reload=False):
         logging.debug("getObjectSchemaAttributes objectSchemaId:"+str(objectSchemaId)+", includeObjectCounts:"+(str(includeObjectCounts))+", reload:"+(str(reload)))
-        if self.objectTypes.get(objectSchemaId) and not reload:
-            # Return objectTypes for this object schema when we already got them once
+        cached = self.objectTypes.get(objectSchemaId)
+        if cached and not reload and (not includeObjectCounts or all('objectCount' in objectType for objectType in cached)):
+            # Return objectTypes for this object schema when we already got them once, object types
+            # that were fetched without their object counts are fetched again when the counts are asked for
             logging.debug("getObjectSchemaAttributes > return cached object types")
             return self.objectTypes.get(objectSchemaId)
 
         # Get object types for object schema
+        version = self.metadataVersion
         query = self.assetsUrl+'/v1/objectschema/'+str(objectSchemaId)+'/objecttypes/flat?includeObjectCounts='+str(includeObjectCounts)
         result = self.assetsGet(query)
-        self.objectTypes[objectSchemaId] = result
+        with self.metadataLock:
+            if version == self.metadataVersion and result is not None:
+                self.objectTypes[objectSchemaId] = result
+                self.objectTypeIndex[objectSchemaId] = indexMetadata(result, [lambda objectType: objectType['name'], lambda objectType: (objectType['name'], objectType.get('parentObjectTypeId'))])
         if result:
             return result
         else:
             logging.info(f"getObjectTypes returned None for objectSchemaId {objectSchemaId}")
             return None
 
+    def invalidateObjectTypes(self, objectSchemaId=None):
+        # The object types of the object schema (or all object schemas) are fetched again on the next lookup
+        with self.metadataLock:
+            self.metadataVersion += 1
+            if objectSchemaId is None:
+                self.objectTypes.clear()
+                self.objectTypeIndex.clear()
+            else:
+                self.objectTypes.pop(objectSchemaId, None)
+                self.objectTypeIndex.pop(objectSchemaId, None)
+
     def getObjectTypeByName (self, name, objectSchemaId, parentObjectTypeId = None, reload=False):
         logging.debug("getObjectTypeByName objectSchemaId:"+str(objectSchemaId)+", name:"+(str(name))+", reload:"+(str(reload)))
-        objectTypes = self.getObjectTypes(objectSchemaId, reload)
-        
-        if not objectTypes:
-            return None
+        index = self.objectTypeIndex.get(objectSchemaId)
+        if index is None or reload:
+            objectTypes = self.getObjectTypes(objectSchemaId, reload=reload)
+            index = self.objectTypeIndex.get(objectSchemaId) or indexMetadata(objectTypes, [lambda objectType: objectType['name'], lambda objectType: (objectType['name'], objectType.get('parentObjectTypeId'))])
         
-        # Find the object type with the correct name
-        for objectType in objectTypes:
-            if objectType['name'] == name:
-                ## The object names are equal
-                if parentObjectTypeId:
-                    if objectType['parentObjectTypeId'] == parentObjectTypeId:
-                        # The parent object type ids are equal
-                        # We've found the correct object type
-                        return objectType
-                else:
-                    # This is a root object type, so name is unique
-                    return objectType
-        # No corresponding object type was found
-        logging.info(f"getObjectTypeByName returned None for name {name}")
-        return None
+        # Without a parent object type id, the first object type with the name is returned
+        objectType = index[1].get((name, parentObjectTypeId)) if parentObjectTypeId else index[0].get(name)
+        if not objectType:
+            # No corresponding object type was found
+            logging.info(f"getObjectTypeByName returned None for name {name}")
+        return objectType
  
     def getObjectType(self, id):
         logging.debug("getObjectType id:"+str(id))
@@ -714,7 +1316,6 @@ class assetsConnect():
         result = self.assetsGet(query)
         
         if result:
-            self.objectTypes[result['objectSchemaId']] = result
             return result 
         else:
             logging.info(f"getObjectType returned None for id {id}")
@@ -727,6 +1328,7 @@ class assetsConnect():
             return None
         query = self.assetsUrl+'/v1/objecttype/'+str(id)
         result = self.assetsDelete(query)
+        self.invalidateObjectTypes()
         if result:
             return result
         else:
@@ -740,6 +1342,7 @@ class assetsConnect():
             return None
         query = self.assetsUrl+'/v1/objecttype/create'
         result = self.assetsPost(query, data)
+        self.invalidateObjectTypes(data.get('objectSchemaId'))
         if result:
             return result
         else:
@@ -750,6 +1353,7 @@ class assetsConnect():
         logging.debug("updateObjectType id:"+str(id)+", data:"+(str(data)))
         query = self.assetsUrl+'/v1/objecttype/'+str(id)
         result = self.assetsPut(query, data)
+        self.invalidateObjectTypes()
         if result:
             return result
         else:
@@ -764,25 +1368,39 @@ class assetsConnect():
             # and the attributes should not be reloaded
             return self.objectTypeAttributes.get(id)
 
+        version = self.metadataVersion
         query = self.assetsUrl+'/v1/objecttype/'+str(id)+'/attributes'
         result = self.assetsGet(query)
-        self.objectTypeAttributes[id] = result
+        with self.metadataLock:
+            # A failed request is not cached, so the next lookup tries again
+            if version == self.metadataVersion and result is not None:
+                self.objectTypeAttributes[id] = result
+                self.attributeIndex[id] = indexMetadata(result, [lambda attribute: attribute['name']])[0]
         if result:
             return result
         else:
             logging.info(f"getObjectTypeAttributes returned None for id: {id}")
             return None
 
+    def invalidateAttributes(self, objectTypeId=None):
+        # The attributes of the object type (or all object types) are fetched again on the next lookup
+        with self.metadataLock:
+            self.metadataVersion += 1
+            if objectTypeId is None:
+                self.objectTypeAttributes.clear()
+                self.attributeIndex.clear()
+            else:
+                self.objectTypeAttributes.pop(objectTypeId, None)
+                self.attributeIndex.pop(objectTypeId, None)
+
     def getAttributeByName(self, objectTypeId, name, reload=False):
         logging.debug("getAttributeByName objectTypeId:"+str(objectTypeId)+", name:"+(str(name))+", reload:"+(str(reload)))
-        attributes = self.getObjectTypeAttributes(objectTypeId, reload)
+        index = self.attributeIndex.get(objectTypeId)
+        if index is None or reload:
+            attributes = self.getObjectTypeAttributes(objectTypeId, reload)
+            index = self.attributeIndex.get(objectTypeId) or indexMetadata(attributes, [lambda attribute: attribute['name']])[0]
         
-        foundAttribute = None
-        # Find the attribute  with the correct name
-        for attribute in attributes:
-            if attribute['name'] == name:
-                foundAttribute = attribute
-                break
+        foundAttribute = index.get(name)
         if foundAttribute:
             return foundAttribute
         else:
@@ -797,6 +1415,7 @@ class assetsConnect():
             "position": newPosition
         }
         result = self.assetsPost(query, data)
+        self.invalidateObjectTypes()
         if result:
             return result
         else:
@@ -807,6 +1426,7 @@ class assetsConnect():
         logging.debug("createObjectTypeAttribute objectTypeId:"+str(objectTypeId)+", data:"+(str(data)))
         query = self.assetsUrl+'/v1/objecttypeattribute/'+str(objectTypeId)
         result = self.assetsPost(query,data)
+        self.invalidateAttributes(objectTypeId)
         if result:
             return result
         else:
@@ -817,6 +1437,7 @@ class assetsConnect():
         logging.debug("updateObjectTypeAttribute objectTypeId:"+str(objectTypeId)+", id:"+(str(id))+", data:"+(str(data)))
         query = self.assetsUrl+'/v1/objecttypeattribute/'+str(objectTypeId)+'/'+str(id)
         result = self.assetsPut(query,data)
+        self.invalidateAttributes(objectTypeId)
         if result:
             return result
         else:
@@ -831,6 +1452,7 @@ class assetsConnect():
             "position": position
         }
         result = self.assetsPost(query,data)
+        self.invalidateAttributes(objectTypeId)
         if result:
             return result
         else:
@@ -841,6 +1463,7 @@ class assetsConnect():
         logging.debug("deleteObjectTypeAttribute id:"+str(id))
         query = self.assetsUrl+'/v1/objecttypeattribute/'+str(id)
         result = self.assetsDelete(query)
+        self.invalidateAttributes()
         if result:
             return result
         else:
@@ -861,224 +1484,730 @@ class assetsConnect():
             logging.warning(f"createComment returned None for objectId: {objectId}")
             return None
     
+    def getPayloadEncoder(self, objectTypeId):
+        # The encoder of the object type, made again when the attributes of the object type were invalidated
+        attributeIndex = self.attributeIndex.get(objectTypeId)
+        cached = self.payloadEncoders.get(objectTypeId)
+        if attributeIndex is not None and cached and cached[0] is attributeIndex:
+            return cached[1]
+        attributes = self.getObjectTypeAttributes(objectTypeId)
+        attributeIndex = self.attributeIndex.get(objectTypeId)
+        encoder = objectPayloadEncoder(self, objectTypeId, attributes)
+        if attributeIndex is None:
+            # The attributes could not be fetched, the encoder is only used for this payload and made again for the next one
+            logging.warning(f"getPayloadEncoder > attributes of objectTypeId {objectTypeId} could not be fetched")
+            return encoder
+        self.payloadEncoders[objectTypeId] = (attributeIndex, encoder)
+        return encoder
+
+    def buildObjectPayload(self, myDict, objectTypeId):
+        # Payload of a create or update request, as a dict
+        logging.debug("buildObjectPayload myDict: %s, objectTypeId: %s", myDict, objectTypeId)
+        return self.getPayloadEncoder(objectTypeId).encode(myDict)
+
     def constructObjectPayload(self, myDict, objectTypeId):
-        logging.debug("constructObjectPayload myDict:"+str(myDict)+", objectTypeId:"+(str(objectTypeId)))
-        # Construct attribute payload (main)
-        payload = '{"objectTypeId": "'+str(objectTypeId)+'",'
-        updatedAttributes = '"attributes": ['
-        for key in myDict:
-            value = myDict[key] if str(myDict[key]) != 'nan' else ""
-                        
-            attribute = self.getAttributeByName(objectTypeId, key, True)
-            if not attribute:
-                # Attribute could not be found, skip attribute
-                logging.warning("Attribute '"+key+"' could not be found for objectTypeId: "+str(objectTypeId))
-                continue
-            attributeId = attribute.get('id')
-    
-            # Construct attribute payload (single attribute)
-            updatedAttribute = '{"objectTypeAttributeId": "'+str(attributeId)+'",'
-            
-            # Note aggregated columns can not lead to multiple values 
-            updatedAttributeValues = ''
-            skipAttribute = False
-            skipValue = False
-            valueList = []
-            if isinstance(value, list):
-                valueList = value
-            else:
-                # When the value is split by double pipes || then multiple values should be added
-                valueList = value.split("||")
-            for aggVal in valueList:
-                if attribute['type'] == 0:
-                    # This is the default attribute
-                    if attribute['defaultType']['id'] in [0,9]:
-                        aggVal = aggVal.replace('\\','\\\\')
-                        aggVal = aggVal.replace('\n','\\n')
-                        aggVal = aggVal.replace('\t','\\t')
-                        aggVal = aggVal.replace('"','\\"')
-                    elif attribute['defaultType']['id'] in [4]:
-                        # Date
-                        if re.search("\d+[-/]\d+[-/]\d+", aggVal):
-                            aggVal = parser.parse(aggVal).strftime("%Y-%m-%d")
-                        aggVal = parser.parse(aggVal).strftime("%Y-%m-%d")
-                    elif attribute['defaultType']['id'] in [6]:
-                        # DateTime
-                        aggVal = parser.parse(aggVal).replace(tzinfo=tzlocal()).isoformat(timespec='milliseconds')
-                elif attribute['type'] == 1:
-                    # The attribute is a reference, find the objectKey of the referenced objects
-                    referencedObject = self.getObjects(f"objectId={aggVal}")
-    
-                    if referencedObject:
-                        aggVal = referencedObject[0].get('objectKey')
-                    else:
-                        # We don't want this attribute in our payload, because it has no result and we don't want to change the current value
-                        logging.warning("constructObjectPayload > Can't find referenced object "+attribute['name'] + " for value: "+aggVal)
-                        logging.debug("constructObjectPayload > skip attribute: "+attribute['name'] + " for value: "+aggVal)
-                        skipValue = True
-                
-                elif attribute['type'] == 2:
-                    # The attribute is a user, find the account id and replace it for the display name
-                    account = self.getJiraUserAccount(aggVal)
-                    if account:
-                        aggVal = account.get('accountId')
-                    else:
-                        # We don't want this attribute in our payload, because it has no result and we don't want to change the current value
-                        logging.debug("constructObjectPayload > skip attribute: "+attribute['name'] + " for value: "+aggVal)
-                        skipAttribute = True 
-                    
-                elif attribute['type'] == 4:
-                    # The attribute is a group, find the group id and replace it for the name
-                    group = self.getJiraGroup(aggVal)
-                    if group:
-                        aggVal = group.get('groupId')
-                    else:
-                        # We don't want this attribute in our payload, because it has no result and we don't want to change the current value
-                        logging.debug("constructObjectPayload > skip attribute: "+attribute['name'] + " for value: "+aggVal)
-                        skipAttribute = True 
-
-                elif attribute['type'] == 7:
-                    # The attribute is a status, find the status id and replace it for the name
-                    status = self.getStatusTypeByName(aggVal)
-                    if status:
-                        aggVal = status.get('id')
-                    else:
-                        # We don't want this attribute in our payload, because it has no result and we don't want to change the current value
-                        logging.debug("constructObjectPayload > skip attribute: "+attribute['name'] + " for value: "+aggVal)
-                        skipAttribute = True 
-                    
-                if not skipValue:
-                    updatedAttributeValues = updatedAttributeValues + '{"value": "'+escape(aggVal)+'"}' + ","
-                skipValue = False
-            
-            if skipAttribute:
-                continue # skip this attribute and move on to the next
-            
-            updatedAttributeValues = updatedAttributeValues.rstrip(",") # Remove last comma
-            updatedAttribute = updatedAttribute + '"objectAttributeValues": ['+updatedAttributeValues+']'+"}," # Add values 
-            updatedAttributes = updatedAttributes + updatedAttribute # Add attribute to attribute list
-        
-        updatedAttributes = updatedAttributes.rstrip(",") + "]" # Remove last comma
-        payload = payload + updatedAttributes + "}" # Add all attributes to the Json payload
-        
-        logging.debug("constructObjectPayload return payload:"+str(payload))
-        return payload
+        # Payload of a create or update request, as JSON
+        return json.dumps(self.buildObjectPayload(myDict, objectTypeId))
     
     def getJiraUserAccount(self, value):
         logging.debug("getJiraUserAccount name:"+str(value))
-        jiraUserAccounts = self.getAllJiraUserAccounts(0,10000)
-        for userAccount in jiraUserAccounts:
-            # We don't know if the value is a displayName, emailAddress or accountId
-            # Whatever matches first we will return
-            if userAccount.get('displayName') == value:
-                return userAccount # Match found for displayName
-            if userAccount.get('emailAddress') == value:
-                return userAccount # Match found for emailAddress
-            if userAccount.get('accountId') == value:
-                return userAccount # Match found for accountId
-        
-        logging.info(f"getJiraUserAccount returned None for name: {value}")
-        return None # No match found
+        # We don't know if the value is a displayName, emailAddress or accountId, see jiraDirectory for the precedence
+        userAccount = self.jiraDirectory.getUser(value)
+        if not userAccount:
+            logging.info(f"getJiraUserAccount returned None for name: {value}")
+        return userAccount
     
     def getJiraGroup(self, name):
         logging.debug("getJiraGroup name:"+str(name))
-        jiraGroups = self.getAllJiraUserGroups(0,10000)
-        for group in jiraGroups:
-            if group['name'] == name:
-                return group # Match found
-
-        logging.info(f"getJiraGroup returned None for name: {name}")
-        return None  # No match found
-
-    def getAllJiraUserAccounts(self, startAt=0, maxResults=50, reload=False):
-        logging.debug("getAllJiraUserAccounts startAt:"+str(startAt)+", maxResults:"+(str(maxResults))+", reload:"+(str(reload)))
-        if self.jiraUserAccounts and not reload :
-            logging.debug("getAllJiraUserAccounts > return cached user accounts")
-            return self.jiraUserAccounts
-        
-        # Get all users from the Jira site
-        query = self.jiraUrl+'/rest/api/3/users/search?startAt='+str(startAt)+'&maxResults='+str(maxResults)
-        result = self.assetsGet(query)
-        self.jiraUserAccounts = result
-        if result:
-            return result
-        else:
-            logging.info(f"getAllJiraUserAccounts returned None for startAt: {startAt}")
-            return None
-
-    def getAllJiraUserGroups(self, startAt=0, maxResults=50, reload=False):
-        logging.debug("getAllJiraUserGroups startAt:"+str(startAt)+", maxResults:"+(str(maxResults))+", reload:"+(str(reload)))
-        if self.jiraGroups and not reload :
-            logging.debug("getAllJiraUserGroups > return cached groups")
-            return self.jiraGroups
-        
-        # Get all user groups from the Jira site
-        query = self.jiraUrl+'/rest/api/3/group/bulk?startAt='+str(startAt)+'&maxResults='+str(maxResults)
-        result = self.assetsGet(query)
-        self.jiraGroups = result
-
-        if result:
-            return result['values']
-        else:
-            logging.info(f"getAllJiraUserGroups returned None for startAt: {startAt}")
-            return None
+        group = self.jiraDirectory.getGroup(name)
+        if not group:
+            logging.info(f"getJiraGroup returned None for name: {name}")
+        return group
+
+    def getAllJiraUserAccounts(self, reload=False):
+        # All users of the Jira site, all pages
+        logging.debug("getAllJiraUserAccounts reload:"+(str(reload)))
+        return self.jiraDirectory.getUsers(reload)
+
+    def getAllJiraUserGroups(self, reload=False):
+        # All user groups of the Jira site, all pages
+        logging.debug("getAllJiraUserGroups reload:"+(str(reload)))
+        return self.jiraDirectory.getGroups(reload)
     
     def getObjectData(self, object):
         logging.debug(f"assets > getObjectData > object: {object['name']} [{object['id']}]")
-        objectData = {}
+        # None when the attributes could not be fetched
         objectAttributes = self.getObjectAttributes(object['id'])
-        for attribute in objectAttributes:
+        if objectAttributes is None:
+            return None
+        return objectDataFromAttributes(objectAttributes) or {}
+
+def indexMetadata(items, keyFunctions):
+    # One dictionary per key function, {key: item}. When items share a key, the first one is indexed
+    indexes = tuple({} for keyFunction in keyFunctions)
+    for item in items or []:
+        for index, keyFunction in zip(indexes, keyFunctions):
+            index.setdefault(keyFunction(item), item)
+    return indexes
+
+def iqlPageCount(responseIql):
+    # Number of pages of an IQL result. Despite its name 'pageSize' is the number of pages, but it is calculated
+    # from the number of objects found and the objects per page whenever these are available.
+    total = responseIql.get('totalFilterCount')
+    perPage = responseIql.get('pageObjectSize')
+    if isinstance(total, int) and isinstance(perPage, int) and perPage > 0:
+        return max(1, math.ceil(total/perPage))
+    return responseIql.get('pageSize', 1)
+
+def objectDataFromAttributes(objectAttributes, attributeNames=None):
+    # Turn the attributes of an object into {attribute name: value}, as stored in the backup.
+    # The attributes of /object/{id}/attributes contain the attribute name, the attributes of the objects in an
+    # IQL page only have the objectTypeAttributeId, their names are looked up in attributeNames {id: name}.
+    # Returns None when the attributes are incomplete.
+    objectData = {}
+    for attribute in objectAttributes:
+        if 'objectTypeAttribute' in attribute:
             attributeName = attribute['objectTypeAttribute']['name']
-            attributeValue = []
-            for value in attribute['objectAttributeValues']:
-                logging.debug(f"assets > getObjectData > value: {value}")
-                if value['referencedType']:
-                    refValue = {}
-                    refValue['displayValue'] = value['displayValue']
-                    refValue['searchValue'] = value['searchValue']
-                    attributeValue.append(refValue)
-                else: 
-                    attributeValue.append(value['displayValue'])
-            if len(attributeValue)==1:
-                # If only one value, then return value, otherwise return the list of values
-                # Like: ['value1','value2']
-                attributeValue = attributeValue[0]
-            logging.debug(f"assets > getObjectData > attributeValue: {attributeValue}")
-            objectData[attributeName]=attributeValue
-        
-        return objectData
+        else:
+            attributeName = (attributeNames or {}).get(attribute.get('objectTypeAttributeId'))
+        if attributeName is None or 'objectAttributeValues' not in attribute:
+            return None
+        attributeValue = []
+        for value in attribute['objectAttributeValues']:
+            logging.debug(f"assets > getObjectData > value: {value}")
+            if 'displayValue' not in value:
+                return None
+            if value.get('referencedType'):
+                if 'searchValue' not in value:
+                    return None
+                refValue = {}
+                refValue['displayValue'] = value['displayValue']
+                refValue['searchValue'] = value['searchValue']
+                attributeValue.append(refValue)
+            else: 
+                attributeValue.append(value['displayValue'])
+        if len(attributeValue)==1:
+            # If only one value, then return value, otherwise return the list of values
+            # Like: ['value1','value2']
+            attributeValue = attributeValue[0]
+        logging.debug(f"assets > getObjectData > attributeValue: {attributeValue}")
+        objectData[attributeName]=attributeValue
+    
+    return objectData
+
+def objectDataFromEntry(objectEntry, attributeNames):
+    # Object data of an object from an IQL page (fetched with includeAttributes=True),
+    # returns None when the page data is incomplete and the attributes have to be fetched separately
+    if 'attributes' not in objectEntry:
+        return None
+    return objectDataFromAttributes(objectEntry['attributes'], attributeNames)
 
 
 ############
 # Below are help functions that have nothing to do with Jira Assets
 # If you don't use them in your scripts, you can delete them from this module
 
-# save Json to file
-def saveDataToFile(data, fileName, path):
-    logging.debug("assets > saveDataToFile > Saving: "+path+"/"+fileName+".json")
-    if len(path)>0:
-        # Create dir if needed
-        os.makedirs(path, exist_ok = True)
-    
+def safeFileName(fileName):
     # Replace invalid characters in filename with underscore '_'
+    fileName = str(fileName)
     invalid = '<>:"/\|?* '
     for char in invalid:
         fileName = fileName.replace(char, '_')      
+    return fileName
+
+class contentStore():
+    # Content-addressed store for backups. Every file is saved once as a blob named after the SHA-256 of its content,
+    # a run only writes a manifest with the path and the hash of each of its files. Files that did not change
+    # since a previous run (most objects, history and comments) take no extra disk space.
+    # The paths given to save, load and exists are the normal paths below runsPath: <runsPath>/<run>/<path in run>
+    #   <storePath>/manifests/<run>.json   {path in run: hash}
+    #   <storePath>/blobs/<2 chars>/<hash>.json
+    def __init__(self, storePath, runsPath):
+        self.storePath = abspath(storePath)
+        self.runsPath = abspath(runsPath)
+        self.manifests = {}
+        self.lock = threading.Lock()
+
+    def splitPath(self, path):
+        relativePath = os.path.relpath(abspath(path), self.runsPath).replace(os.sep, '/')
+        run, _, pathInRun = relativePath.partition('/')
+        return run, pathInRun
+
+    def manifestFile(self, run):
+        return f"{self.storePath}/manifests/{run}.json"
+
+    def blobFile(self, hash):
+        return f"{self.storePath}/blobs/{hash[:2]}/{hash}.json"
+
+    def getManifest(self, run):
+        with self.lock:
+            if run not in self.manifests:
+                self.manifests[run] = loadJson(self.manifestFile(run)) if exists(self.manifestFile(run)) else {}
+            return self.manifests[run]
+
+    def save(self, data, path):
+        content = data.encode('UTF-8')
+        hash = hashlib.sha256(content).hexdigest()
+        blobFile = self.blobFile(hash)
+        if not exists(blobFile):
+            # Write to a temporary file first, a blob is either complete or not there
+            os.makedirs(os.path.dirname(blobFile), exist_ok=True)
+            temporaryFile = f"{blobFile}.{threading.get_ident()}.tmp"
+            with open(temporaryFile, "wb") as f:
+                f.write(content)
+            os.replace(temporaryFile, blobFile)
+        run, pathInRun = self.splitPath(path)
+        manifest = self.getManifest(run)
+        with self.lock:
+            manifest[pathInRun] = hash
+        return hash
+
+    def link(self, source, destination):
+        # Add a file of a previous run to this run, without reading or writing the content
+        sourceRun, sourcePath = self.splitPath(source)
+        hash = self.getManifest(sourceRun).get(sourcePath)
+        if not hash:
+            return False
+        run, pathInRun = self.splitPath(destination)
+        manifest = self.getManifest(run)
+        with self.lock:
+            manifest[pathInRun] = hash
+        return True
+
+    def exists(self, path):
+        # True for a file or a folder of a run
+        run, pathInRun = self.splitPath(path)
+        if not exists(self.manifestFile(run)) and run not in self.manifests:
+            return False
+        manifest = self.getManifest(run)
+        if not pathInRun:
+            return True
+        return pathInRun in manifest or any(name.startswith(pathInRun+'/') for name in manifest)
+
+    def load(self, path):
+        run, pathInRun = self.splitPath(path)
+        with io.open(self.blobFile(self.getManifest(run)[pathInRun]), 'r', encoding='UTF-8') as f:
+            return f.read()
+
+    def commit(self, run):
+        # Save the manifest of a run, only runs with a manifest count for the next incremental run and for pruning
+        manifest = self.getManifest(run)
+        with self.lock:
+            saveAsJson(manifest, f"{run}.tmp", self.storePath+"/manifests", indent=None, sortKeys=True)
+        os.replace(self.manifestFile(f"{run}.tmp"), self.manifestFile(run))
+        logging.info(f"Backup run '{run}' saved in content store '{self.storePath}' [{len(manifest)} files, {len(set(manifest.values()))} unique]")
+
+    def getRuns(self):
+        if not os.path.isdir(self.storePath+"/manifests"):
+            return []
+        return sorted(fileName[:-5] for fileName in os.listdir(self.storePath+"/manifests") if fileName.endswith('.json') and not fileName.endswith('.tmp.json'))
+
+    def checkout(self, run, path):
+        # Write all files of a run to a normal backup folder, e.g. for the import
+        for pathInRun, hash in self.getManifest(run).items():
+            fileName = f"{path}/{pathInRun}"
+            os.makedirs(os.path.dirname(fileName), exist_ok=True)
+            with open(self.blobFile(hash), "rb") as source, open(fileName, "wb") as destination:
+                destination.write(source.read())
+        logging.info(f"Backup run '{run}' restored from content store to '{path}'")
+
+    def prune(self, keepDays):
+        # Remove the runs older than keepDays (the newest run is always kept) and all blobs that are no longer
+        # referenced by the manifest of any remaining run
+        runs = self.getRuns()
+        removedRuns = 0
+        for run in runs[:-1]:
+            if time.time() - os.path.getmtime(self.manifestFile(run)) > keepDays*86400:
+                os.remove(self.manifestFile(run))
+                with self.lock:
+                    self.manifests.pop(run, None)
+                removedRuns += 1
+        referenceCount = collections.Counter()
+        for run in self.getRuns():
+            referenceCount.update(loadJson(self.manifestFile(run)).values())
+        removedBlobs = 0
+        for root, dirs, files in os.walk(self.storePath+"/blobs"):
+            for fileName in files:
+                if referenceCount[fileName[:-5]] == 0:
+                    os.remove(os.path.join(root, fileName))
+                    removedBlobs += 1
+        logging.info(f"Content store pruned: {removedRuns} runs older than {keepDays} days and {removedBlobs} unreferenced blobs removed, {len(referenceCount)} blobs in use")
+        return removedRuns, removedBlobs
+
+# Compression codecs for zip archives, zstd needs Python 3.14 or newer
+zipCodecs = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA
+}
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):
+    zipCodecs['zstd'] = zipfile.ZIP_ZSTANDARD
+
+def getZipCodec(codec):
+    if codec not in zipCodecs:
+        logging.warning(f"Compression '{codec}' is not available, using deflate")
+        return zipfile.ZIP_DEFLATED
+    return zipCodecs[codec]
+
+class zipStore():
+    # Writes the files of a backup run straight into a zip archive, instead of a folder that is zipped afterwards.
+    # One writer thread owns the archive, the other threads only hand over the content. The queue is bounded,
+    # so the threads wait when the compression can't keep up.
+    # The paths given to save, load and exists are the normal paths below runsPath: <runsPath>/<run>/<path in run>,
+    # the archive of a run is archiveName with {run} replaced by the name of the run. Files of previous runs are
+    # read from their archive (for incremental backups).
+    def __init__(self, runsPath, archiveName="assets-backup-{run}.zip", codec='deflate', level=None, maxPending=1000):
+        self.runsPath = abspath(runsPath)
+        self.archiveName = archiveName
+        self.compression = getZipCodec(codec)
+        self.level = level
+        self.queue = queue.Queue(maxPending)
+        self.archives = {}
+        self.lock = threading.Lock()
+        self.run = None
+        self.thread = None
+        self.error = None
+        self.manifest = {}
+
+    def splitPath(self, path):
+        relativePath = os.path.relpath(abspath(path), self.runsPath).replace(os.sep, '/')
+        run, _, pathInRun = relativePath.partition('/')
+        return run, pathInRun
+
+    def open(self, run):
+        self.run = run
+        self.archive = zipfile.ZipFile(self.archiveName.format(run=run), 'w', self.compression, compresslevel=self.level)
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+        return self
+
+    def writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error:
+                continue
+            try:
+                data = item[1].encode('UTF-8')
+                self.archive.writestr(item[0], data)
+                self.manifest[item[0]] = {'size': len(data), 'crc': zlib.crc32(data), 'sha256': hashlib.sha256(data).hexdigest()}
+            except Exception as e:
+                # Keep emptying the queue, the error is raised by commit
+                logging.exception(e)
+                self.error = e
+
+    def save(self, data, path):
+        if self.error:
+            raise RuntimeError(f"Writing to the zip archive failed: {self.error}")
+        run, pathInRun = self.splitPath(path)
+        self.queue.put((f"{run}/{pathInRun}", data))
+
+    def getArchive(self, run):
+        # Archive of a previous run opened for reading, with the names of its files and folders
+        with self.lock:
+            if run not in self.archives:
+                fileName = self.archiveName.format(run=run)
+                archive = zipfile.ZipFile(fileName, 'r') if run != self.run and exists(fileName) else None
+                names = set()
+                for name in archive.namelist() if archive else []:
+                    while name and name not in names:
+                        names.add(name)
+                        name = name.rpartition('/')[0]
+                self.archives[run] = (archive, names)
+            return self.archives[run]
+
+    def exists(self, path):
+        # True for a file or a folder of a previous run
+        run, pathInRun = self.splitPath(path)
+        archive, names = self.getArchive(run)
+        return f"{run}/{pathInRun}".rstrip('/') in names
+
+    def load(self, path):
+        run, pathInRun = self.splitPath(path)
+        archive, names = self.getArchive(run)
+        with self.lock:
+            return archive.read(f"{run}/{pathInRun}").decode('UTF-8')
+
+    def link(self, source, destination):
+        # Files can't be shared between zip archives, the file of the previous run is copied
+        if not self.exists(source):
+            return False
+        self.save(self.load(source), destination)
+        return True
+
+    def commit(self, run):
+        # Wait for the writer thread and close the archive
+        self.queue.put(None)
+        self.thread.join()
+        self.archive.close()
+        with self.lock:
+            for archive, names in self.archives.values():
+                if archive:
+                    archive.close()
+            self.archives = {}
+        if self.error:
+            raise RuntimeError(f"Writing to the zip archive failed: {self.error}")
+        saveZipManifest(self.manifest, self.archiveName.format(run=run))
+        logging.info(f"Backup run '{run}' saved in '{self.archiveName.format(run=run)}' [{len(self.manifest)} files]")
+
+class jsonLinesWriter():
+    # Appends JSON documents as lines to one JSON Lines file, e.g. the history of all objects of an object type,
+    # instead of one file per document. Thread safe. With a store (contentStore or zipStore) the lines are
+    # collected and saved as one file when the writer is closed
+    def __init__(self, fileName, path, store=None):
+        self.fileName = f"{path}/{safeFileName(fileName)}.jsonl"
+        self.store = store
+        self.lines = []
+        self.file = None
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, data):
+        line = json.dumps(data, sort_keys=True)+"\n"
+        with self.lock:
+            if self.store:
+                self.lines.append(line)
+            else:
+                if not self.file:
+                    os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+                    self.file = io.open(abspath(self.fileName), "w", encoding='UTF-8')
+                self.file.write(line)
+            self.count += 1
+
+    def flush(self):
+        # Hand the lines written so far to the operating system, e.g. before they are recorded in a checkpoint
+        with self.lock:
+            if self.file:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+            elif self.lines:
+                self.store.save(''.join(self.lines), self.fileName)
+                self.lines = []
+
+def iterJsonLines(fileName, store=None):
+    # The documents of a JSON Lines file, one at a time
+    logging.debug("assets > iterJsonLines > Loading JSON Lines file: "+fileName)
+    if store:
+        lines = store.load(fileName).splitlines()
+    else:
+        lines = io.open(abspath(fileName), 'r', encoding='UTF-8')
+    try:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if not store:
+            lines.close()
+
+def iterJournal(fileName):
+    # The documents of a JSON Lines file that may have been cut off by a crash, with the position after each line.
+    # Reading stops at the first line that is incomplete or not valid JSON
+    if not os.path.exists(fileName):
+        return
+    position = 0
+    with open(abspath(fileName), 'rb') as lines:
+        for line in lines:
+            if not line.endswith(b"\n"):
+                return
+            try:
+                document = json.loads(line)
+            except ValueError:
+                return
+            position += len(line)
+            yield document, position
+
+class journalFile():
+    # Append-only JSON Lines file that survives a crash of the script, e.g. the checkpoints of a backup run.
+    # The entries of an earlier run are read when the journal is opened, a line that was cut off by the crash is
+    # removed. Every entry is flushed to the operating system at once and forced to disk (fsync) every syncEvery
+    # entries and on sync and close, so a crash of the script loses nothing and a crash of the machine at most
+    # the last syncEvery entries. Thread safe
+    def __init__(self, fileName, syncEvery=100):
+        self.fileName = fileName
+        self.syncEvery = syncEvery
+        self.entries = []
+        validLength = 0
+        for entry, validLength in iterJournal(fileName):
+            self.entries.append(entry)
+        self.unsynced = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(abspath(fileName)), exist_ok=True)
+        self.file = io.open(abspath(fileName), "a", encoding='UTF-8')
+        self.file.truncate(validLength)
+
+    def append(self, entry):
+        line = json.dumps(entry, sort_keys=True)+"\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.syncEvery:
+                self.syncLocked()
+
+    def syncLocked(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def sync(self):
+        with self.lock:
+            if self.file and self.unsynced:
+                self.syncLocked()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.syncLocked()
+                self.file.close()
+                self.file = None
+
+    def remove(self):
+        # The work is done, the journal is not needed anymore
+        self.close()
+        os.remove(abspath(self.fileName))
+
+class backupDatabase():
+    # SQLite copy of a backup run with indexes for fast offline lookups and (partial) restores.
+    # It is used as a store: every file of the backup is passed on to the next store (or written to disk as usual)
+    # and its content is added to the tables. The config files are kept as they are in the documents table,
+    # so checkout can write a complete backup folder for the import.
+    # The paths given to save, load and exists are the normal paths below runsPath: <runsPath>/<run>/<path in run>
+    tables = [
+        "CREATE TABLE IF NOT EXISTS documents (path TEXT PRIMARY KEY, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS schemas (id TEXT PRIMARY KEY, objectSchemaKey TEXT, name TEXT, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS objecttypes (id TEXT PRIMARY KEY, objectSchemaKey TEXT, name TEXT, parentObjectTypeId TEXT, fileName TEXT, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS attributes (id TEXT PRIMARY KEY, objectTypeId TEXT, name TEXT, type INTEGER, label INTEGER, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS objects (id TEXT PRIMARY KEY, objectSchemaKey TEXT, objectTypeId TEXT, objectKey TEXT, label TEXT, created TEXT, updated TEXT, meta TEXT, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS attributevalues (objectId TEXT, attributeId TEXT, value TEXT, displayValue TEXT, searchValue TEXT)",
+        "CREATE TABLE IF NOT EXISTS objectreferences (objectId TEXT, attributeId TEXT, referencedObjectId TEXT, referencedObjectKey TEXT)",
+        "CREATE TABLE IF NOT EXISTS history (objectId TEXT, created TEXT, type INTEGER, actor TEXT, affectedAttribute TEXT, oldValue TEXT, newValue TEXT, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS comments (objectId TEXT, created TEXT, actor TEXT, comment TEXT, data TEXT)",
+        "CREATE INDEX IF NOT EXISTS objecttypesName ON objecttypes (name)",
+        "CREATE INDEX IF NOT EXISTS attributesObjectType ON attributes (objectTypeId, name)",
+        "CREATE INDEX IF NOT EXISTS objectsLabel ON objects (label)",
+        "CREATE INDEX IF NOT EXISTS objectsKey ON objects (objectKey)",
+        "CREATE INDEX IF NOT EXISTS objectsObjectType ON objects (objectTypeId)",
+        "CREATE INDEX IF NOT EXISTS attributevaluesObject ON attributevalues (objectId)",
+        "CREATE INDEX IF NOT EXISTS attributevaluesValue ON attributevalues (attributeId, value)",
+        "CREATE INDEX IF NOT EXISTS objectreferencesObject ON objectreferences (objectId)",
+        "CREATE INDEX IF NOT EXISTS objectreferencesReferenced ON objectreferences (referencedObjectId)",
+        "CREATE INDEX IF NOT EXISTS historyObject ON history (objectId, created)",
+        "CREATE INDEX IF NOT EXISTS commentsObject ON comments (objectId, created)"
+    ]
+
+    def __init__(self, databaseFile, runsPath, store=None):
+        self.databaseFile = databaseFile
+        self.runsPath = abspath(runsPath)
+        self.store = store
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(databaseFile, check_same_thread=False)
+        with self.lock:
+            for table in self.tables:
+                self.connection.execute(table)
+
+    def splitPath(self, path):
+        relativePath = os.path.relpath(abspath(path), self.runsPath).replace(os.sep, '/')
+        run, _, pathInRun = relativePath.partition('/')
+        return run, pathInRun
+
+    def save(self, data, path):
+        if self.store:
+            self.store.save(data, path)
+        else:
+            saveFile(data, path)
+        run, pathInRun = self.splitPath(path)
+        self.addFile(pathInRun, data)
+
+    def exists(self, path):
+        return self.store.exists(path) if self.store else exists(path)
+
+    def load(self, path):
+        if self.store:
+            return self.store.load(path)
+        with io.open(abspath(path), 'r', encoding='UTF-8') as f:
+            return f.read()
+
+    def link(self, source, destination):
+        if not self.exists(source):
+            return False
+        if self.store:
+            self.store.link(source, destination)
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            try:
+                os.link(source, destination)
+            except OSError:
+                shutil.copyfile(source, destination)
+        run, pathInRun = self.splitPath(destination)
+        self.addFile(pathInRun, self.load(destination))
+        return True
+
+    def addFile(self, pathInRun, data):
+        # Add the content of a backup file to the tables, based on its place in the backup folder
+        parts = pathInRun.split('/')
+        if len(parts) < 3:
+            rows = {'documents': [(pathInRun, data)]}
+        elif parts[1] == 'config':
+            rows = self.configRows(parts, json.loads(data))
+            rows['documents'] = [(pathInRun, data)]
+        elif parts[1] == 'objectsmeta':
+            rows = self.objectRows(parts[0], json.loads(data))
+        elif parts[1] == 'objects' and len(parts) == 3:
+            rows = {'objectsdata': [(id, json.dumps(objectData)) for id, objectData in json.loads(data).items()]}
+        elif parts[1] == 'objects' and parts[2] in ['history', 'comments']:
+            records = [json.loads(line) for line in data.splitlines() if line.strip()] if parts[3].endswith('.jsonl') else [json.loads(data)]
+            rows = self.historyRows(records) if parts[2] == 'history' else self.commentRows(records)
+        else:
+            rows = {'documents': [(pathInRun, data)]}
+        statements = {
+            'documents': "INSERT OR REPLACE INTO documents VALUES (?,?)",
+            'schemas': "INSERT OR REPLACE INTO schemas VALUES (?,?,?,?)",
+            'objecttypes': "INSERT OR REPLACE INTO objecttypes VALUES (?,?,?,?,?,?)",
+            'attributes': "INSERT OR REPLACE INTO attributes VALUES (?,?,?,?,?,?)",
+            'objects': "INSERT INTO objects (id, objectSchemaKey, objectTypeId, objectKey, label, created, updated, meta) VALUES (?,?,?,?,?,?,?,?) "
+                       "ON CONFLICT(id) DO UPDATE SET objectSchemaKey=excluded.objectSchemaKey, objectTypeId=excluded.objectTypeId, objectKey=excluded.objectKey, "
+                       "label=excluded.label, created=excluded.created, updated=excluded.updated, meta=excluded.meta",
+            'objectsdata': "INSERT INTO objects (id, data) VALUES (?,?) ON CONFLICT(id) DO UPDATE SET data=excluded.data",
+            'attributevalues': "INSERT INTO attributevalues VALUES (?,?,?,?,?)",
+            'objectreferences': "INSERT INTO objectreferences VALUES (?,?,?,?)",
+            'history': "INSERT INTO history VALUES (?,?,?,?,?,?,?,?)",
+            'comments': "INSERT INTO comments VALUES (?,?,?,?,?)"
+        }
+        with self.lock:
+            for table, tableRows in rows.items():
+                self.connection.executemany(statements[table], tableRows)
+
+    def configRows(self, parts, data):
+        if parts[2] == 'objectschema.json':
+            return {'schemas': [(str(data['id']), data.get('objectSchemaKey'), data.get('name'), json.dumps(data))]}
+        if parts[2] == 'objecttypes.json':
+            return {'objecttypes': [(str(objectType['id']), parts[0], objectType.get('name'), objectType.get('parentObjectTypeId'),
+                                     safeFileName(f"{objectType['name']}_{objectType['id']}"), json.dumps(objectType)) for objectType in data]}
+        if parts[2] == 'attributes':
+            # The file name of the attributes ends with the id of the object type
+            objectTypeId = parts[3][:-5].rpartition('_')[2]
+            return {'attributes': [(str(attribute['id']), objectTypeId, attribute.get('name'), attribute.get('type'), int(bool(attribute.get('label'))),
+                                    json.dumps(attribute)) for attribute in data]}
+        return {}
+
+    def objectRows(self, objectSchemaKey, objects):
+        rows = {'objects': [], 'attributevalues': [], 'objectreferences': []}
+        for object in objects:
+            rows['objects'].append((str(object['id']), objectSchemaKey, str(object.get('objectType', {}).get('id')), object.get('objectKey'),
+                                    object.get('label'), object.get('created'), object.get('updated'), json.dumps(object)))
+            for attribute in object.get('attributes', []):
+                for value in attribute.get('objectAttributeValues', []):
+                    rows['attributevalues'].append((str(object['id']), str(attribute['objectTypeAttributeId']), value.get('value'),
+                                                    value.get('displayValue'), value.get('searchValue')))
+                    if value.get('referencedType'):
+                        referencedObject = value.get('referencedObject', {})
+                        referencedObjectId = referencedObject.get('id')
+                        rows['objectreferences'].append((str(object['id']), str(attribute['objectTypeAttributeId']),
+                                                         str(referencedObjectId) if referencedObjectId else None,
+                                                         referencedObject.get('objectKey', value.get('searchValue'))))
+        return rows
+
+    def historyRows(self, records):
+        return {'history': [(str(line['objectId']), line.get('created'), line.get('type'), line.get('actor', {}).get('displayName'),
+                             line.get('affectedAttribute'), line.get('oldValue'), line.get('newValue'), json.dumps(line))
+                            for history in records for line in history]}
+
+    def commentRows(self, records):
+        return {'comments': [(str(comment['objectId']), comment.get('created'), comment.get('actor', {}).get('displayName'),
+                              comment.get('comment'), json.dumps(comment)) for comments in records for comment in comments]}
+
+    def commit(self, run):
+        if self.store:
+            self.store.commit(run)
+        with self.lock:
+            self.connection.commit()
+        logging.info(f"Backup run '{run}' saved in database '{self.databaseFile}'")
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def query(self, sql, parameters=()):
+        # Rows of a query as dicts
+        with self.lock:
+            cursor = self.connection.execute(sql, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def checkout(self, path, objectIds=None):
+        # Write the backup folder from the database, e.g. for the import. With objectIds only these objects and
+        # their history and comments are written, e.g. for a partial restore. They are looked up with the indexes
+        selection = ""
+        if objectIds is not None:
+            with self.lock:
+                self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS checkoutIds (id TEXT PRIMARY KEY)")
+                self.connection.execute("DELETE FROM checkoutIds")
+                self.connection.executemany("INSERT OR IGNORE INTO checkoutIds VALUES (?)", ((str(objectId),) for objectId in objectIds))
+            selection = " AND o.id IN (SELECT id FROM checkoutIds)"
+        for row in self.query("SELECT path, data FROM documents"):
+            saveFile(row['data'], f"{path}/{row['path']}")
+        for objectType in self.query("SELECT id, objectSchemaKey, fileName FROM objecttypes"):
+            objects = self.query(f"SELECT o.id, o.meta, o.data FROM objects o WHERE o.objectTypeId=?{selection} ORDER BY CAST(o.id AS INTEGER)", (objectType['id'],))
+            if not objects:
+                continue
+            folder = f"{path}/{objectType['objectSchemaKey']}"
+            saveAsJson([json.loads(object['meta']) for object in objects if object['meta']], objectType['fileName'], folder+"/objectsmeta")
+            saveAsJson({object['id']: json.loads(object['data']) for object in objects if object['data']}, objectType['fileName'], folder+"/objects")
+            for table in ['history', 'comments']:
+                records = collections.defaultdict(list)
+                for row in self.query(f"SELECT t.objectId, t.data FROM {table} t JOIN objects o ON o.id = t.objectId WHERE o.objectTypeId=?{selection} ORDER BY t.rowid", (objectType['id'],)):
+                    records[row['objectId']].append(json.loads(row['data']))
+                writer = jsonLinesWriter(objectType['fileName'], f"{folder}/objects/{table}")
+                for objectRecords in records.values():
+                    writer.append(objectRecords)
+                writer.close()
+        # A folder with only some of the objects is marked, so a full restore writes it again
+        if objectIds is not None:
+            saveAsJson(sorted(str(objectId) for objectId in objectIds), "partialCheckout", path)
+        elif exists(f"{path}/partialCheckout.json"):
+            os.remove(f"{path}/partialCheckout.json")
+        logging.info(f"Backup restored from database '{self.databaseFile}' to '{path}'" + (f", {len(objectIds)} objects" if objectIds is not None else ""))
+
+def saveFile(data, fileName):
+    # Write text to a file with the given path, the folder is created if needed
+    os.makedirs(os.path.dirname(abspath(fileName)), exist_ok=True)
+    with io.open(abspath(fileName), "w", encoding='UTF-8') as f:
+        f.write(data)
+
+# save Json to file
+def saveDataToFile(data, fileName, path, store=None):
+    logging.debug("assets > saveDataToFile > Saving: "+path+"/"+str(fileName)+".json")
+    if store:
+        # Only the content is saved, the file is added to the manifest of the run
+        store.save(data, f"{path}/{safeFileName(fileName)}.json")
+        return
+    if len(path)>0:
+        # Create dir if needed
+        os.makedirs(path, exist_ok = True)
     
     # write file
-    f = open(abspath(f"{path}/{fileName}.json"), "w")
+    f = open(abspath(f"{path}/{safeFileName(fileName)}.json"), "w")
     f.write(data)
     f.close()
     return 
 
-def saveAsJson(data, fileName, path, indent=2, sortKeys='id'):
-    logging.debug("assets > saveAsJson > Saving JSON file: "+fileName)
+def saveAsJson(data, fileName, path, indent=2, sortKeys='id', store=None):
+    logging.debug("assets > saveAsJson > Saving JSON file: "+str(fileName))
     jsonData = json.dumps(data, indent=indent, sort_keys=sortKeys)
-    return saveDataToFile(jsonData, fileName, path)
+    return saveDataToFile(jsonData, fileName, path, store)
 
-def loadJson(fileName):
+def loadJson(fileName, store=None):
     # Opening JSON file
     logging.debug("assets > loadJson > Loading JSON file: "+fileName)
+    if store:
+        return json.loads(store.load(fileName))
     with io.open(abspath(fileName), 'r', encoding='UTF-8') as f:
         # returns JSON object as a dictionary
         data = json.load(f)
@@ -1088,22 +2217,109 @@ def loadJson(fileName):
     return data
 
 # Zip the files from given directory
-def zipDir(path, zipname):
-    zipFile = zipfile.ZipFile(zipname, 'w', zipfile.ZIP_DEFLATED)
+def zipDir(path, zipname, codec='deflate', level=None, workers=None):
+    # The files are read and hashed in parallel threads (hashlib releases the GIL) and compressed and written
+    # to the archive by zipfile in one thread, in the order of the folder.
+    # A manifest with the size, CRC and SHA-256 of every file is saved next to the zip file, for verifyZip
+    compressType = getZipCodec(codec)
+    workers = workers or os.cpu_count() or 4
+    manifest = {}
+    zipFile = zipfile.ZipFile(zipname, 'w', compressType, compresslevel=level)
     
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            zipFile.write(os.path.join(root, file), 
-                       os.path.relpath(os.path.join(root, file), 
-                                       os.path.join(path, '..')))
+    pending = collections.deque()
+    with ThreadPoolExecutor(workers) as executor:
+        def writeNext():
+            name, future = pending.popleft()
+            size, crc, sha256, data = future.result()
+            zipInfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+            zipInfo.external_attr = 0o600 << 16
+            zipFile.writestr(zipInfo, data, compressType, level)
+            manifest[name] = {'size': size, 'crc': crc, 'sha256': sha256}
+
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                name = os.path.relpath(os.path.join(root, file), os.path.join(path, '..')).replace(os.sep, '/')
+                pending.append((name, executor.submit(readFile, os.path.join(root, file))))
+                # Only a limited number of files are kept in memory
+                if len(pending) >= workers*4:
+                    writeNext()
+        while pending:
+            writeNext()
     zipFile.close()
+    saveZipManifest(manifest, zipname)
+
+def readFile(fileName):
+    # Read one file for zipDir, returns the size, CRC and SHA-256 of the content and the content
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    return len(data), zlib.crc32(data), hashlib.sha256(data).hexdigest(), data
+
+def saveZipManifest(manifest, zipname):
+    # The manifest of zip file.zip is saved as zip file.zip.manifest.json
+    saveAsJson(manifest, os.path.basename(zipname)+".manifest", os.path.dirname(abspath(zipname)), indent=None, sortKeys=True)
+
+def verifyZipMembers(zipname, names, manifest):
+    # Read the given files of a zip file and check their CRC and SHA-256 against the manifest, returns the errors
+    errors = []
+    with zipfile.ZipFile(zipname, 'r') as zipFile:
+        for name in names:
+            try:
+                # Reading the complete file also checks the CRC of the archive itself
+                data = zipFile.read(name)
+            except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                errors.append(f"{name}: {e}")
+                continue
+            expected = manifest.get(name)
+            if expected is None:
+                continue
+            if expected['size'] != len(data) or expected['crc'] != zlib.crc32(data):
+                errors.append(f"{name}: size or CRC differs from the manifest")
+            elif expected['sha256'] != hashlib.sha256(data).hexdigest():
+                errors.append(f"{name}: SHA-256 differs from the manifest")
+    return errors
+
+def verifyZip(zipname, workers=None):
+    # Check all files of a zip file in parallel against its CRCs and, when there is one, the manifest.
+    # Returns the list of errors, an empty list means the zip file is fine
+    workers = workers or os.cpu_count() or 4
+    manifestFile = abspath(zipname)+".manifest.json"
+    manifest = loadJson(manifestFile) if exists(manifestFile) else {}
+    if not manifest:
+        logging.warning(f"No manifest found for '{zipname}', only the CRCs are checked")
+    try:
+        with zipfile.ZipFile(zipname, 'r') as zipFile:
+            names = zipFile.namelist()
+    except (zipfile.BadZipFile, OSError) as e:
+        return [f"{zipname}: {e}"]
+    errors = [f"{name}: missing in the zip file" for name in sorted(set(manifest)-set(names))]
+    chunkSize = max(1, math.ceil(len(names)/(workers*4)))
+    with ThreadPoolExecutor(workers) as executor:
+        for chunkErrors in executor.map(lambda i: verifyZipMembers(zipname, names[i:i+chunkSize], manifest), range(0, len(names), chunkSize)):
+            errors.extend(chunkErrors)
+    logging.info(f"Verified {len(names)} files of '{zipname}': {len(errors)} errors")
+    return errors
 
 # Unzip a zipped file to a given directory
 def unzipFile(zipname, path):
     with zipfile.ZipFile(zipname, 'r') as zip_ref:
         zip_ref.extractall(path)
 
-def getCommandlineOptions():
+def getConnectOptions(options):
+    # Optional connection settings from the config file, with their defaults
+    defaults = {
+        'maxConcurrency': 32,
+        'minConcurrency': 4,
+        'connectTimeout': 10,
+        'readTimeout': 60,
+        'requestsPerMinute': 975,
+        'requestBurst': 20,
+        'maxRetries': 5,
+        'backoffBase': 1,
+        'backoffMax': 60
+    }
+    return {key: options.get(key, default) for key, default in defaults.items()}
+
+def getCommandlineOptions(resumable=False):
     options = []
 
     # Parse commandline options
@@ -1111,7 +2327,13 @@ def getCommandlineOptions():
     parser.add_option("-f",
                     dest = "configFilename",
                     help = "Location of the config file")
+    if resumable:
+        # Only the backup can continue an interrupted run
+        parser.add_option("--resume",
+                        dest = "resume",
+                        help = "Backup folder of an interrupted run to continue")
     options, args = parser.parse_args()
+    resume = options.resume if resumable else None
 
     configFile = abspath((str(options.configFilename)).lstrip())
     if configFile is None: 
@@ -1126,6 +2348,8 @@ def getCommandlineOptions():
         exit(1)
         
     options = loadJson(configFile)
+    if resume:
+        options['resume'] = resume
     
     return options
 
@@ -0,0 +1,290 @@
+from assets import assetsConnect, concurrencyController, objectDataFromAttributes, iqlPageCount
+import json, time, asyncio, logging, urllib.parse, collections
+import aiohttp          # python -m pip install aiohttp
+
+class asyncResponse():
+    # The parts of an aiohttp response that are needed after the connection was released,
+    # named like a requests response so assetsConnect.retryDelay and assetsConnect.responseJson can be reused
+    def __init__(self, status, headers, text):
+        self.status_code = status
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+class assetsAsyncConnect():
+    # asyncio variant of assetsConnect with the same method surface for the per-object calls.
+    # The synchronous connection is used for the workspace, the cached metadata (object types, attributes, users,
+    # status types) and it provides the rate limiter, the retry settings and the request statistics, so a sync and
+    # an async client on the same connection share one rate budget.
+    # The async client has its own AIMD concurrency limit, from the minConcurrency of the connection up to maxInFlight,
+    # as a single event loop can keep far more requests in flight than the threads of the synchronous connection
+    def __init__(self, connect: assetsConnect, maxInFlight=100):
+        self.connect = connect
+        self.jiraUrl = connect.jiraUrl
+        self.assetsUrl = connect.assetsUrl
+        self.maxInFlight = maxInFlight
+        self.concurrency = concurrencyController(min(connect.concurrency.minLimit, maxInFlight), maxInFlight, connect.rateLimiter)
+        self.session = None
+        self.released = None
+        self.listener = None
+
+    async def open(self):
+        logging.debug("assetsAsync > open")
+        connectTimeout, readTimeout = self.connect.timeout
+        # A release of the concurrency controller, in any thread, wakes the requests that wait for a slot
+        self.released = asyncio.Event()
+        eventLoop = asyncio.get_running_loop()
+        self.listener = lambda: eventLoop.call_soon_threadsafe(self.released.set)
+        self.concurrency.listeners.append(self.listener)
+        self.session = aiohttp.ClientSession(
+            headers=self.connect.headers,
+            connector=aiohttp.TCPConnector(limit=self.maxInFlight),
+            timeout=aiohttp.ClientTimeout(sock_connect=connectTimeout, sock_read=readTimeout))
+        return self
+
+    async def close(self):
+        logging.debug("assetsAsync > close")
+        if self.listener in self.concurrency.listeners:
+            self.concurrency.listeners.remove(self.listener)
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def throttleTest(self):
+        # Take a token of the shared rate limiter, without blocking the event loop
+        wait = self.connect.rateLimiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def acquire(self):
+        # A slot of the concurrency controller. Its acquire would block the event loop, so the request waits
+        # for the next release instead
+        while True:
+            self.released.clear()
+            if self.concurrency.tryAcquire():
+                return
+            await self.released.wait()
+
+    async def assetsRequest(self, method, query, **kwargs):
+        # Same retry rules as assetsConnect.assetsRequest
+        idempotent = method != 'POST'
+        attempt = 0
+        while True:
+            await self.acquire()
+            response = None
+            started = time.monotonic()
+            try:
+                await self.throttleTest()
+                self.connect.countRequest('requests')
+                started = time.monotonic()
+                async with self.session.request(method, query, **kwargs) as result:
+                    response = asyncResponse(result.status, result.headers, await result.text())
+                reason = str(response.status_code)
+                retryable = response.status_code in self.connect.retryStatuses and (idempotent or response.status_code in self.connect.retryStatusesPost)
+            except aiohttp.ClientConnectorError as e:
+                # The connection could not be made, so the request was not sent
+                reason = type(e).__name__
+                retryable = True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = type(e).__name__
+                retryable = idempotent
+                if not retryable:
+                    logging.error(f"{method} {query} failed: {reason}")
+                    self.connect.countRequest('failed')
+                    return None
+            finally:
+                # The slot is always given back, with the latency and throttling that were observed
+                if response is not None:
+                    self.concurrency.release(time.monotonic()-started, response.status_code == 429)
+                else:
+                    self.concurrency.release()
+
+            if not retryable:
+                if response.status_code >= 400:
+                    logging.warning(f"{method} {query} returned status {response.status_code}")
+                return response
+            if attempt >= self.connect.maxRetries:
+                logging.error(f"{method} {query} failed after {attempt} retries, last status: {reason}")
+                self.connect.countRequest('failed')
+                return None
+
+            delay = self.connect.retryDelay(attempt, response)
+            if response is not None and response.status_code == 429:
+                self.connect.rateLimiter.pause(delay)
+            attempt += 1
+            self.connect.countRequest('retries')
+            self.connect.countRequest(f'retries_{reason}')
+            logging.warning(f"{method} {query} returned {reason}, retry {attempt}/{self.connect.maxRetries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def assetsGet(self, query):
+        logging.debug("assetsAsync > assetsGet")
+        try:
+            return self.connect.responseJson(await self.assetsRequest('GET', query))
+        except Exception as e:
+            logging.exception(e)
+            return None
+
+    async def assetsDelete(self, query, params=None):
+        logging.debug("assetsAsync > assetsDelete")
+        try:
+            return self.connect.responseJson(await self.assetsRequest('DELETE', query, params=params))
+        except Exception as e:
+            logging.exception(e)
+            return None
+
+    async def assetsPut(self, query, data=None):
+        logging.debug("assetsAsync > assetsPut")
+        try:
+            if data:
+                return self.connect.responseJson(await self.assetsRequest('PUT', query, json=data))
+            return self.connect.responseJson(await self.assetsRequest('PUT', query))
+        except Exception as e:
+            logging.exception(e)
+            return None
+
+    async def assetsPost(self, query, data):
+        logging.debug("assetsAsync > assetsPost")
+        try:
+            return self.connect.responseJson(await self.assetsRequest('POST', query, json=data))
+        except Exception as e:
+            logging.exception(e)
+            return None
+
+    async def getObjects(self, iql, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1):
+        logging.debug("assetsAsync > getObjects iql:"+urllib.parse.quote_plus(iql))
+        objects = []
+        try:
+            async for page in self.iterObjectPages(iql, includeExtendedInfo, includeAttributes, includeAttributesDeep):
+                objects.extend(page)
+        except RuntimeError as e:
+            # Something went wrong and we did not get back a proper response
+            logging.warning(str(e))
+            return None
+        return objects
+
+    async def iterObjectPages(self, iql, includeExtendedInfo=False, includeAttributes=True, includeAttributesDeep=1):
+        # Same as assetsConnect.iterObjectPages, the other pages are fetched as tasks at most maxInFlight pages ahead
+        query = self.assetsUrl+'/v1/iql/objects?includeExtendedInfo='+str(includeExtendedInfo)+'&includeAttributes='+str(includeAttributes)+'&includeAttributesDeep='+str(includeAttributesDeep)+'&iql='+urllib.parse.quote_plus(iql)
+        # Get first page of iql query
+        responseIql = await self.assetsGet(query)
+        if not responseIql:
+            raise RuntimeError(f"getObjects returned None for iql: {iql}")
+        if not responseIql.get('iqlSearchResult'):
+            return
+        yield responseIql['objectEntries']
+        nextPage = responseIql['pageNumber']+1
+        totalPages = iqlPageCount(responseIql)
+
+        pending = collections.deque()
+        try:
+            while pending or nextPage <= totalPages:
+                while nextPage <= totalPages and len(pending) < self.maxInFlight:
+                    pending.append((nextPage, asyncio.ensure_future(self.assetsGet(query+'&page='+str(nextPage)))))
+                    nextPage += 1
+                page, task = pending.popleft()
+                nextResponseIql = await task
+                if not nextResponseIql or 'objectEntries' not in nextResponseIql:
+                    raise RuntimeError(f"getObjects page {page}/{totalPages} returned None for iql: {iql}")
+                yield nextResponseIql['objectEntries']
+        finally:
+            for page, task in pending:
+                task.cancel()
+
+    async def getObject(self, id):
+        result = await self.assetsGet(self.assetsUrl+'/v1/object/'+str(id))
+        if not result:
+            logging.info(f"getObject returned None for id: {id}")
+        return result or None
+
+    async def getObjectAttributes(self, id):
+        result = await self.assetsGet(self.assetsUrl+'/v1/object/'+str(id)+'/attributes')
+        # An empty list is an answer too, None means the request failed
+        if result is None:
+            logging.info(f"getObjectAttributes returned None for id: {id}")
+        return result
+
+    async def getObjectHistory(self, id):
+        result = await self.assetsGet(self.assetsUrl+'/v1/object/'+str(id)+'/history')
+        # An empty list is an answer too, None means the request failed
+        if result is None:
+            logging.info(f"getObjectHistory returned None for id: {id}")
+        return result
+
+    async def getObjectComment(self, id):
+        result = await self.assetsGet(self.assetsUrl+'/v1/comment/object/'+str(id))
+        # An empty list is an answer too, None means the request failed
+        if result is None:
+            logging.info(f"getObjectComment returned None for id: {id}")
+        return result
+
+    async def getObjectData(self, object):
+        logging.debug(f"assetsAsync > getObjectData > object: {object['name']} [{object['id']}]")
+        # None when the attributes could not be fetched
+        objectAttributes = await self.getObjectAttributes(object['id'])
+        if objectAttributes is None:
+            return None
+        return objectDataFromAttributes(objectAttributes) or {}
+
+    async def getLabelAttribute(self, objectTypeId):
+        # The attributes come from the cache of the synchronous connection, the first call per object type runs in a thread
+        attributes = await asyncio.to_thread(self.connect.getObjectTypeAttributes, objectTypeId)
+        for attribute in attributes or []:
+            if attribute.get('label'):
+                return attribute
+        logging.warning(f"getLabelAttribute returned None for objectTypeId: {objectTypeId}")
+        return None
+
+    async def buildObjectPayload(self, myDict, objectTypeId):
+        # Payload construction uses the metadata caches of the synchronous connection, run it in a thread
+        return await asyncio.to_thread(self.connect.buildObjectPayload, myDict, objectTypeId)
+
+    async def constructObjectPayload(self, myDict, objectTypeId):
+        return json.dumps(await self.buildObjectPayload(myDict, objectTypeId))
+
+    async def createObject(self, data):
+        result = await self.assetsPost(self.assetsUrl+'/v1/object/create', data)
+        if not result:
+            logging.warning("createObject returned None")
+        # The key is used for references to the object, see buildObjectPayload
+        self.connect.cacheObjectKey(result)
+        return result or None
+
+    async def createObjectById(self, myDict, objectTypeId):
+        payload = await self.buildObjectPayload(myDict, objectTypeId)
+        return await self.createObject(payload)
+
+    async def updateObject(self, objectId, data):
+        result = await self.assetsPut(self.assetsUrl+'/v1/object/'+str(objectId), data)
+        if not result:
+            logging.warning(f"updateObject returned None for objectId: {objectId}")
+        return result or None
+
+    async def updateObjectByObjectTypeId(self, objectId, objectTypeId, myDict):
+        payload = await self.buildObjectPayload(myDict, objectTypeId)
+        return await self.updateObject(objectId, payload)
+
+    async def deleteObject(self, id):
+        result = await self.assetsDelete(self.assetsUrl+'/v1/object/'+str(id))
+        if not result:
+            logging.warning(f"deleteObject returned None for id: {id}")
+        return result or None
+
+    async def createComment(self, comment, objectId, roleId=0):
+        data = {
+            'role': roleId,
+            'objectId': objectId,
+            'comment': comment
+        }
+        result = await self.assetsPost(self.assetsUrl+'/v1/comment/create', data)
+        if not result:
+            logging.warning(f"createComment returned None for objectId: {objectId}")
+        return result or None
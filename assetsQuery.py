@@ -0,0 +1,331 @@
+from datetime import datetime as dt, timezone
+import re, os, io, json, logging, sqlite3, zipfile, collections
+
+# Offline evaluation of a subset of IQL over a backup folder, zip file or SQLite database, without any requests to the site.
+# Supported:
+#   Name = "Laptop 1", Name == "Laptop 1" (case sensitive), Name != "x", Price > 100, Created >= "2022-01-01"
+#   Name in ("a", "b"), Name not in ("a", "b"), Name like lap, Owner is empty, Owner is not empty
+#   objectType = Laptops, objectTypeId = 12, objectSchemaKey = ASSETS, label = "Laptop 1", Key = ASSETS-12, objectId > 100
+#   Owner = "ASSETS-5" (key or label of the referenced object), Owner.Department.Name = Sales (reference traversal)
+#   and, or, not, brackets and "order by <attribute> [asc|desc]"
+# Attribute names and values can be quoted with double quotes, the names are case insensitive
+
+tokenPattern = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d+)?(?![^\s=!<>(),".]))
+      | (?P<operator>==|!=|<=|>=|=|<|>)
+      | (?P<punctuation>[(),.])
+      | (?P<word>[^\s=!<>(),".]+)
+    )''', re.VERBOSE)
+
+keywords = ['and', 'or', 'not', 'in', 'like', 'is', 'empty', 'order', 'by', 'asc', 'desc']
+
+def tokenize(iql):
+    tokens = []
+    position = 0
+    iql = iql.rstrip()
+    while position < len(iql):
+        match = tokenPattern.match(iql, position)
+        if not match:
+            raise ValueError(f"Unexpected character in IQL at position {position}: {iql[position:position+20]}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'word' and value.lower() in keywords:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+class iqlParser():
+    # Recursive descent parser, the result is a tree of tuples:
+    #   ('and', left, right), ('or', left, right), ('not', expression), ('compare', [attribute, ...], operator, value)
+    def __init__(self, iql):
+        self.tokens = tokenize(iql)
+        self.position = 0
+
+    def peek(self, kind=None, value=None):
+        if self.position >= len(self.tokens):
+            return None
+        token = self.tokens[self.position]
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            return None
+        return token
+
+    def take(self, kind=None, value=None):
+        token = self.peek(kind, value)
+        if not token:
+            found = self.tokens[self.position][1] if self.position < len(self.tokens) else 'end of query'
+            raise ValueError(f"Expected {value or kind} in IQL, found '{found}'")
+        self.position += 1
+        return token
+
+    def parse(self):
+        expression = self.parseOr() if not self.peek('keyword', 'order') else None
+        orderBy = None
+        if self.peek('keyword', 'order'):
+            self.take('keyword', 'order')
+            self.take('keyword', 'by')
+            orderBy = [self.parseAttribute()[0], False]
+            if self.peek('keyword', 'desc') or self.peek('keyword', 'asc'):
+                orderBy[1] = self.take()[1] == 'desc'
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.position][1]}' in IQL")
+        return expression, orderBy
+
+    def parseOr(self):
+        expression = self.parseAnd()
+        while self.peek('keyword', 'or'):
+            self.take()
+            expression = ('or', expression, self.parseAnd())
+        return expression
+
+    def parseAnd(self):
+        expression = self.parseNot()
+        while self.peek('keyword', 'and'):
+            self.take()
+            expression = ('and', expression, self.parseNot())
+        return expression
+
+    def parseNot(self):
+        if self.peek('keyword', 'not'):
+            self.take()
+            return ('not', self.parseNot())
+        if self.peek('punctuation', '('):
+            self.take()
+            expression = self.parseOr()
+            self.take('punctuation', ')')
+            return expression
+        return self.parseCompare()
+
+    def parseAttribute(self):
+        path = [self.parseValue()]
+        while self.peek('punctuation', '.'):
+            self.take()
+            path.append(self.parseValue())
+        return path
+
+    def parseValue(self):
+        token = self.peek()
+        if not token or token[0] not in ['string', 'number', 'word']:
+            raise ValueError(f"Expected a name or value in IQL, found '{token[1] if token else 'end of query'}'")
+        self.position += 1
+        return token[1]
+
+    def parseCompare(self):
+        path = self.parseAttribute()
+        if self.peek('operator'):
+            return ('compare', path, self.take()[1], self.parseValue())
+        if self.peek('keyword', 'like'):
+            self.take()
+            return ('compare', path, 'like', self.parseValue())
+        if self.peek('keyword', 'is'):
+            self.take()
+            negate = bool(self.peek('keyword', 'not')) and self.take()
+            self.take('keyword', 'empty')
+            return ('compare', path, 'is not empty' if negate else 'is empty', None)
+        negate = bool(self.peek('keyword', 'not')) and self.take()
+        self.take('keyword', 'in')
+        self.take('punctuation', '(')
+        values = [self.parseValue()]
+        while self.peek('punctuation', ','):
+            self.take()
+            values.append(self.parseValue())
+        self.take('punctuation', ')')
+        return ('compare', path, 'not in' if negate else 'in', values)
+
+def comparable(value):
+    # Numbers and ISO dates are compared as numbers and dates, everything else as lower case text
+    if isinstance(value, bool):
+        return ('text', str(value).lower())
+    if isinstance(value, (int, float)):
+        return ('number', value)
+    text = str(value)
+    try:
+        return ('number', float(text))
+    except ValueError:
+        pass
+    try:
+        date = dt.fromisoformat(text.replace('Z', '+00:00'))
+        return ('date', date if date.tzinfo else date.replace(tzinfo=timezone.utc))
+    except ValueError:
+        return ('text', text.lower())
+
+class backupReader():
+    # The files of a backup folder or zip file
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path) if os.path.isfile(path) else None
+
+    def listFiles(self):
+        if self.archive:
+            return self.archive.namelist()
+        return [os.path.relpath(os.path.join(root, file), self.path).replace(os.sep, '/') for root, dirs, files in os.walk(self.path) for file in files]
+
+    def loadJson(self, fileName):
+        if self.archive:
+            return json.loads(self.archive.read(fileName))
+        with io.open(os.path.join(self.path, fileName), 'r', encoding='UTF-8') as f:
+            return json.load(f)
+
+class backupQuery():
+    # In-memory indexes over objectsmeta/*.json and objects/*.json of a backup (all object schemas in it),
+    # or over the objects table of the SQLite database of a backup:
+    #   values[attribute][objectId] = [values]   attribute names in lower case, also for objectType, label, key, ...
+    #   equals[attribute][value] = {objectIds}   hash index for =, == and in
+    #   references[attribute][key] = {objectIds} the objects that reference the object with this key
+    def __init__(self, path):
+        self.objects = {}
+        self.objectsData = {}
+        self.objectIdsByKey = {}
+        self.referencedKeys = collections.defaultdict(set)
+        self.values = collections.defaultdict(dict)
+        self.equals = collections.defaultdict(lambda: collections.defaultdict(set))
+        self.references = collections.defaultdict(lambda: collections.defaultdict(set))
+        if path.endswith('.sqlite') and os.path.isfile(path):
+            self.loadDatabase(path)
+            logging.info(f"Backup '{path}' indexed: {len(self.objects)} objects")
+            return
+        reader = backupReader(path)
+        for fileName in reader.listFiles():
+            parts = fileName.split('/')
+            if len(parts) >= 2 and parts[-2] == 'objectsmeta' and fileName.endswith('.json'):
+                objectSchemaKey = parts[-3] if len(parts) >= 3 else ''
+                for object in reader.loadJson(fileName):
+                    self.addObject(object, objectSchemaKey)
+            elif len(parts) >= 2 and parts[-2] == 'objects' and fileName.endswith('.json'):
+                for objectId, objectData in reader.loadJson(fileName).items():
+                    self.addObjectData(str(objectId), objectData)
+        logging.info(f"Backup '{path}' indexed: {len(self.objects)} objects")
+
+    def loadDatabase(self, path):
+        # The objects and their data are read from the objects table, no files are needed
+        connection = sqlite3.connect(path)
+        try:
+            for objectId, objectSchemaKey, meta, data in connection.execute("SELECT id, objectSchemaKey, meta, data FROM objects"):
+                if meta:
+                    self.addObject(json.loads(meta), objectSchemaKey or '')
+                if data:
+                    self.addObjectData(str(objectId), json.loads(data))
+        finally:
+            connection.close()
+
+    def addValue(self, objectId, attribute, value):
+        attribute = attribute.lower()
+        self.values[attribute].setdefault(objectId, []).append(value)
+        self.equals[attribute][str(value).lower()].add(objectId)
+
+    def addObject(self, object, objectSchemaKey):
+        objectId = str(object['id'])
+        self.objects[objectId] = object
+        self.objectIdsByKey[object.get('objectKey')] = objectId
+        self.addValue(objectId, 'objectId', int(objectId))
+        self.addValue(objectId, 'objectSchemaKey', objectSchemaKey)
+        for attribute, value in [('objectType', object.get('objectType', {}).get('name')), ('objectTypeId', object.get('objectType', {}).get('id')),
+                                 ('label', object.get('label')), ('objectKey', object.get('objectKey')), ('Key', object.get('objectKey')),
+                                 ('Created', object.get('created')), ('Updated', object.get('updated'))]:
+            if value is not None:
+                self.addValue(objectId, attribute, value)
+
+    def addObjectData(self, objectId, objectData):
+        self.objectsData[objectId] = objectData
+        for attribute, values in objectData.items():
+            for value in values if isinstance(values, list) else [values]:
+                if isinstance(value, dict):
+                    # A reference: matches on the label and the key of the referenced object
+                    self.addValue(objectId, attribute, value.get('displayValue'))
+                    if value.get('searchValue') and value.get('searchValue') != value.get('displayValue'):
+                        self.equals[attribute.lower()][str(value.get('searchValue')).lower()].add(objectId)
+                    self.references[attribute.lower()][value.get('searchValue')].add(objectId)
+                    self.referencedKeys[objectId].add(value.get('searchValue'))
+                elif value is not None:
+                    self.addValue(objectId, attribute, value)
+
+    def getObjects(self, iql):
+        # The objects (as returned by IQL on the site) that match the IQL query
+        expression, orderBy = iqlParser(iql).parse()
+        objectIds = self.evaluate(expression) if expression else set(self.objects)
+        if orderBy:
+            attribute, descending = orderBy
+            values = self.values.get(attribute.lower(), {})
+            # Objects without a value come last
+            ordered = sorted((id for id in objectIds if id in values), key=lambda id: comparable(values[id][0]), reverse=descending)
+            ordered += sorted((id for id in objectIds if id not in values), key=int)
+        else:
+            ordered = sorted(objectIds, key=int)
+        return [self.objects.get(id, {'id': id}) for id in ordered]
+
+    def getObjectData(self, objectId):
+        return self.objectsData.get(str(objectId))
+
+    def getObjectSchemaKey(self, objectId):
+        return self.values['objectschemakey'].get(str(objectId), [None])[0]
+
+    def getReferencedObjects(self, objectIds):
+        # The objects that are referenced by the given objects, directly or through other referenced objects
+        found = set()
+        pending = list(objectIds)
+        while pending:
+            for key in self.referencedKeys.get(pending.pop(), []):
+                referencedId = self.objectIdsByKey.get(key)
+                if referencedId and referencedId not in found and referencedId not in objectIds:
+                    found.add(referencedId)
+                    pending.append(referencedId)
+        return found
+
+    def evaluate(self, expression):
+        kind = expression[0]
+        if kind == 'and':
+            return self.evaluate(expression[1]) & self.evaluate(expression[2])
+        if kind == 'or':
+            return self.evaluate(expression[1]) | self.evaluate(expression[2])
+        if kind == 'not':
+            return self.allObjects() - self.evaluate(expression[1])
+        path, operator, value = expression[1:]
+        objectIds = self.compare(path[-1].lower(), operator, value)
+        # Reference traversal: Owner.Department.Name = x, from the last reference back to the first
+        for attribute in reversed(path[:-1]):
+            keys = [self.objects[id].get('objectKey') for id in objectIds if id in self.objects]
+            references = self.references.get(attribute.lower(), {})
+            objectIds = set().union(*[references.get(key, set()) for key in keys])
+        return objectIds
+
+    def allObjects(self):
+        return set(self.objects) | set(self.objectsData)
+
+    def compare(self, attribute, operator, value):
+        equals = self.equals.get(attribute, {})
+        values = self.values.get(attribute, {})
+        if operator == '=':
+            return set(equals.get(str(value).lower(), set()))
+        if operator == '==':
+            return {id for id in equals.get(str(value).lower(), set()) if any(str(v) == str(value) for v in values.get(id, []))}
+        if operator == '!=':
+            return self.allObjects() - equals.get(str(value).lower(), set())
+        if operator in ['in', 'not in']:
+            objectIds = set().union(*[equals.get(str(v).lower(), set()) for v in value])
+            return objectIds if operator == 'in' else self.allObjects() - objectIds
+        if operator == 'like':
+            return {id for id, objectValues in values.items() if any(str(value).lower() in str(v).lower() for v in objectValues)}
+        if operator == 'is empty':
+            return self.allObjects() - set(values)
+        if operator == 'is not empty':
+            return set(values)
+        # Ranges, only values of the same kind (number, date or text) are compared
+        kind, limit = comparable(value)
+        matches = {
+            '<': lambda v: v < limit,
+            '>': lambda v: v > limit,
+            '<=': lambda v: v <= limit,
+            '>=': lambda v: v >= limit
+        }[operator]
+        objectIds = set()
+        for id, objectValues in values.items():
+            for objectValue in objectValues:
+                valueKind, comparableValue = comparable(objectValue)
+                if valueKind == kind and matches(comparableValue):
+                    objectIds.add(id)
+                    break
+        return objectIds
@@ -1,179 +1,508 @@
 from assets import assetsConnect
-import os, time, assets, logging, logging.handlers
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
+import os, time, math, shutil, assets, asyncio, logging, logging.handlers, threading
+from datetime import datetime as dt, timezone
 
 # Script settings 
-maxThreads = 10
-
 logFileKeep = 10 # Number of days to keep the logfiles, before being rotated
 logFile = os.path.dirname(os.path.abspath(__file__))+"/backup.log"
 
-# Debug level
-fileFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
-handler = logging.handlers.TimedRotatingFileHandler(logFile, when="midnight", backupCount=logFileKeep)
-handler.setFormatter(fileFormatter)
-fileLogger = logging.getLogger()
-fileLogger.addHandler(handler)
-fileLogger.setLevel(logging.INFO)
-
-# define a Handler which writes INFO messages or higher to the sys.stderr
-consoleLogger = logging.StreamHandler()
-consoleLogger.setLevel(logging.INFO)
-consoleFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
-# tell the handler to use this format
-consoleLogger.setFormatter(consoleFormatter)
-# add the handler to the root logger
-logging.getLogger().addHandler(consoleLogger)
-logging.info("-----------Start of Run-----------")    
-
-def getObjectData(object):
-    objectData = myAssets.getObjectData(object)
-    return object['id'], objectData
-
-def getObjectHistory(object):
-    objectHistory = myAssets.getObjectHistory(object['id'])
-    return objectHistory
-
-def getObjectComment(object):
-    objectComment = myAssets.getObjectComment(object['id'])
-    return objectComment
-
-try:
-    timeString = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
-
-    # Load config settings
-    options = assets.getCommandlineOptions()
-
-    # Connect to assets
-    myAssets = assetsConnect(options.get('siteName'), options.get('username'), options.get('apiToken'))
-
-    # get the object schema keys we want to backup
-    objectSchemaKeys = options.get('objectSchemaKeys')
-    objectSchemas =[]
-
-    if not objectSchemaKeys:
-        # If no object schema keys are specified, backup everything
-        objectSchemas = myAssets.getObjectSchemas()
-    else:
-        for objectSchemaKey in objectSchemaKeys:
-            objectSchema = myAssets.getObjectSchemaByKey(objectSchemaKey)
-            if not objectSchema:
-                logging.info(f"WARNING: Could not find object schema for key: '{objectSchemaKey}'")
+myAssets = None
+myAsyncAssets = None
+eventLoop = None
+pool = None
+store = None
+packedHistory = True
+checkpoint = None
+finishedObjectTypes = set()
+finishedObjects = {}
+
+class objectTypeBackup():
+    # Keeps track of the backup of the objects of one object type.
+    # The object data of all objects is saved in one file, as soon as the scan and all object tasks are done.
+    def __init__(self, objectType, backupLocation):
+        self.objectType = objectType
+        self.backupLocation = backupLocation
+        self.fileName = f"{objectType['name']}_{objectType['id']}"
+        self.objectsData = {}
+        self.pending = 1 # The scan of the objects
+        self.failed = 0
+        self.lock = threading.Lock()
+        # The history and comments of all objects are appended to one file per object type
+        self.writers = {folder: assets.jsonLinesWriter(self.fileName, backupLocation+"/objects/"+folder, store) for folder in ['history', 'comments']} if packedHistory else {}
+        # Objects that were backed up before the run was interrupted, by object id
+        self.finished = finishedObjects.get(objectType['id'], {})
+        if self.finished:
+            self.restoreRecords()
+
+    def restoreRecords(self):
+        # Keep the history and comments of the finished objects from the files of the interrupted run,
+        # the lines of the other objects are written again by their tasks
+        for writer in self.writers.values():
+            recordLists = [records for records, position in assets.iterJournal(writer.fileName) if str(records[0]['objectId']) in self.finished]
+            for records in recordLists:
+                writer.append(records)
+            if not recordLists and os.path.exists(writer.fileName):
+                os.remove(writer.fileName)
+
+    def start(self):
+        with self.lock:
+            self.pending += 1
+
+    def keep(self, objectId, objectData):
+        # Object data taken from the previous backup
+        with self.lock:
+            self.objectsData[objectId] = objectData
+
+    def saveRecords(self, folder, records):
+        # The history or comments of one object
+        if packedHistory:
+            self.writers[folder].append(records)
+        else:
+            assets.saveAsJson(records, records[0]['objectId'], self.backupLocation+"/objects/"+folder, store=store)
+
+    def done(self, objectId=None, objectData=None, completed=True):
+        if objectId and completed and checkpoint:
+            # The history and comments of the object are written, so it can be skipped when the run is resumed
+            for writer in self.writers.values():
+                writer.flush()
+            checkpoint.append({'objectTypeId': self.objectType['id'], 'objectId': objectId, 'data': objectData})
+        with self.lock:
+            if objectId:
+                self.objectsData[objectId] = objectData
+            if not completed:
+                self.failed += 1
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            for writer in self.writers.values():
+                writer.close()
+            assets.saveAsJson(self.objectsData, self.fileName, self.backupLocation+"/objects", store=store)
+            logging.info(f"- '{self.objectType['name']}': data, history and comments of {len(self.objectsData)} objects saved")
+            if checkpoint and not self.failed:
+                checkpoint.append({'objectTypeId': self.objectType['id'], 'done': True})
+                checkpoint.sync()
+
+def backupObject(object, objectData, typeBackup):
+    # All requests for one object: the data (only when the IQL page data was incomplete), history and comments
+    completed = False
+    try:
+        if objectData is None:
+            objectData = myAssets.getObjectData(object)
+        objectHistory = myAssets.getObjectHistory(object['id'])
+        if objectHistory:
+            typeBackup.saveRecords('history', objectHistory)
+        objectComment = myAssets.getObjectComment(object['id'])
+        if objectComment:
+            typeBackup.saveRecords('comments', objectComment)
+        # A request that failed after its retries returns None, the object is not checkpointed and is backed up again on --resume
+        completed = objectData is not None and objectHistory is not None and objectComment is not None
+    finally:
+        typeBackup.done(object['id'], objectData or {}, completed)
+
+async def backupObjectAsync(object, objectData, typeBackup):
+    # Async mode variant of backupObject, the history and comments are fetched at the same time
+    completed = False
+    try:
+        if objectData is None:
+            objectData = await myAsyncAssets.getObjectData(object)
+        objectHistory, objectComment = await asyncio.gather(myAsyncAssets.getObjectHistory(object['id']), myAsyncAssets.getObjectComment(object['id']))
+        if objectHistory:
+            typeBackup.saveRecords('history', objectHistory)
+        if objectComment:
+            typeBackup.saveRecords('comments', objectComment)
+        completed = objectData is not None and objectHistory is not None and objectComment is not None
+    finally:
+        # Writing the checkpoint (with fsync) and the files of the object type would block the requests on the event loop
+        await asyncio.to_thread(typeBackup.done, object['id'], objectData or {}, completed)
+
+def scanObjectType(objectType, attributeList, backupLocation):
+    # Scan the objects of an object type and submit a task per object to the run-wide pool as soon as it is found.
+    # The data is taken from the attributes in the IQL pages, only objects of which the page data is incomplete
+    # are fetched one by one
+    typeBackup = objectTypeBackup(objectType, backupLocation)
+    attributeNames = {attribute['id']: attribute['name'] for attribute in attributeList or []}
+    objects = []
+    scanned = False
+    try:
+        # Large object types are scanned in parallel shards of shardSize objects
+        for object in myAssets.iterObjectsSharded("objectTypeId="+objectType['id'], objectType.get('objectCount', 0), shardSize):
+            objects.append(object)
+            if object['id'] in typeBackup.finished:
+                # Backed up before the run was interrupted
+                typeBackup.keep(object['id'], typeBackup.finished[object['id']])
                 continue
+            typeBackup.start()
+            pool.submit(backupObjectAsync if asyncMode else backupObject, object, assets.objectDataFromEntry(object, attributeNames), typeBackup)
+        assets.saveAsJson(objects,typeBackup.fileName, backupLocation+"/objectsmeta", store=store)
+        logging.info(f"- '{objectType['name']}': {len(objects)} objects found")
+        scanned = True
+    finally:
+        typeBackup.done(completed=scanned)
+
+def backupExists(path):
+    # A file or folder of a backup, in the content store or on disk
+    return store.exists(path) if store else os.path.exists(path)
+
+def linkOrCopy(source, destination):
+    # Unchanged files of the previous backup are hard linked when possible, so they take no extra disk space
+    if store:
+        store.link(source, destination)
+        return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def scanObjectTypeIncremental(objectType, attributeList, backupLocation, previousLocation, sinceMinutes):
+    # Incremental variant of scanObjectType. Only the objects that were created or updated since the previous run
+    # are fetched with IQL on 'updated' and get a task. The data, history and comments of all other objects are
+    # taken from the previous backup, deleted objects are found by comparing the object ids.
+    # The result is a complete backup, just like a full run.
+    typeBackup = objectTypeBackup(objectType, backupLocation)
+    fileName = assets.safeFileName(typeBackup.fileName)
+    previousObjects = {object['id']: object for object in assets.loadJson(f"{previousLocation}/objectsmeta/{fileName}.json", store) or []}
+    previousData = assets.loadJson(f"{previousLocation}/objects/{fileName}.json", store) or {}
+    attributeNames = {attribute['id']: attribute['name'] for attribute in attributeList or []}
+    # History and comments of the previous backup that were packed per object type, by object id
+    previousRecords = {}
+    for folder in ['history', 'comments']:
+        packedFile = f"{previousLocation}/objects/{folder}/{fileName}.jsonl"
+        if backupExists(packedFile):
+            previousRecords[folder] = {str(records[0]['objectId']): records for records in assets.iterJsonLines(packedFile, store)}
+    iql = "objectTypeId="+objectType['id']
+    scanned = False
+    try:
+        changedObjects = {object['id']: object for object in myAssets.iterObjects(f"{iql} and updated >= now(-{sinceMinutes}m)")}
+        # Only the ids are needed of the current objects
+        currentIds = [object['id'] for object in myAssets.iterObjectsSharded(iql, objectType.get('objectCount', 0), shardSize, includeAttributes=False)]
+
+        # Objects that are not in the previous backup, but were not updated either (e.g. moved to this object type)
+        missingIds = [id for id in currentIds if id not in changedObjects and id not in previousObjects]
+        for i in range(0, len(missingIds), 50):
+            for object in myAssets.getObjects(f"{iql} and objectId in ({','.join(missingIds[i:i+50])})") or []:
+                changedObjects[object['id']] = object
+
+        objects = []
+        for id in currentIds:
+            if id in changedObjects and id in typeBackup.finished:
+                # Backed up before the run was interrupted
+                object = changedObjects[id]
+                typeBackup.keep(id, typeBackup.finished[id])
+            elif id in changedObjects:
+                object = changedObjects[id]
+                typeBackup.start()
+                pool.submit(backupObjectAsync if asyncMode else backupObject, object, assets.objectDataFromEntry(object, attributeNames), typeBackup)
+            elif id in previousObjects:
+                object = previousObjects[id]
+                typeBackup.keep(id, previousData.get(id, {}))
+                for folder in ['history', 'comments']:
+                    previousFile = f"{previousLocation}/objects/{folder}/{assets.safeFileName(id)}.json"
+                    if folder in previousRecords:
+                        if id in previousRecords[folder]:
+                            typeBackup.saveRecords(folder, previousRecords[folder][id])
+                    elif backupExists(previousFile):
+                        if packedHistory:
+                            typeBackup.saveRecords(folder, assets.loadJson(previousFile, store))
+                        else:
+                            linkOrCopy(previousFile, f"{backupLocation}/objects/{folder}/{assets.safeFileName(id)}.json")
             else:
-                objectSchemas.append(objectSchema)
-    if len(objectSchemas) == 0:
-        logging.info(f"ERROR: No (valid) object schema's found to backup")
-        exit(1)
-    backupLocationPrefix = os.path.dirname(os.path.realpath(__file__))+"/"+timeString
-
-    # Backup object schema's
-    assets.saveAsJson(objectSchemas,"objectschemas", backupLocationPrefix+"/config")
-
-    logging.info("Start backup of:")
-    for objectSchema in objectSchemas: 
-        logging.info(f"   {objectSchema['name']} [{objectSchema['objectSchemaKey']}]")
-        backupLocation = backupLocationPrefix+"/"+objectSchema['objectSchemaKey']
+                logging.warning(f"- '{objectType['name']}': object {id} could not be fetched")
+                continue
+            objects.append(object)
+        assets.saveAsJson(objects,typeBackup.fileName, backupLocation+"/objectsmeta", store=store)
+        deleted = len(set(previousObjects)-set(currentIds))
+        logging.info(f"- '{objectType['name']}': {len(objects)} objects found, {len(changedObjects)} changed or new, {deleted} deleted")
+        scanned = True
+    finally:
+        typeBackup.done(completed=scanned)
+
+def loadBackupState():
+    # The last successful run per object schema: {objectSchemaKey: {lastRun, lastFullRun, folder}}
+    if os.path.exists(stateFile):
+        return assets.loadJson(stateFile)
+    return {}
+
+def getPreviousBackup(objectSchemaKey):
+    # Folder of the previous backup of the object schema and the minutes since that run started,
+    # or None when this object schema needs a full backup
+    state = backupState.get(objectSchemaKey)
+    if not incremental or not state:
+        return None
+    lastRun = dt.fromisoformat(state['lastRun'])
+    lastFullRun = dt.fromisoformat(state['lastFullRun'])
+    previousLocation = f"{state['folder']}/{objectSchemaKey}"
+    if (runStarted-lastFullRun).days >= fullBackupDays or not backupExists(previousLocation):
+        return None
+    # Some margin for clock differences and objects that were updated while the previous run was scanning
+    return previousLocation, math.ceil((runStarted-lastRun).total_seconds()/60) + 10
+
+def updateBackupState(objectSchemas, previousBackups, backupLocation, failed):
+    # A run with failed tasks or requests may have saved objects without their data, history or comments.
+    # An incremental run would carry those forward, so the next run of these object schemas is a full backup
+    for objectSchema in objectSchemas:
+        if failed:
+            backupState.pop(objectSchema['objectSchemaKey'], None)
+            continue
+        state = backupState.get(objectSchema['objectSchemaKey'], {})
+        backupState[objectSchema['objectSchemaKey']] = {
+            'lastRun': runStarted.isoformat(),
+            'lastFullRun': state['lastFullRun'] if objectSchema['objectSchemaKey'] in previousBackups else runStarted.isoformat(),
+            'folder': backupLocation
+        }
+    assets.saveAsJson(backupState, "backupState", os.path.dirname(stateFile))
+
+def loadCheckpoints(checkpointFile):
+    # The checkpoint journal of the run: when the run was started, the finished object types and the finished
+    # objects of the other object types. A new run starts the journal
+    global runStarted
+    journal = assets.journalFile(checkpointFile)
+    for entry in journal.entries:
+        if 'runStarted' in entry:
+            runStarted = dt.fromisoformat(entry['runStarted'])
+        elif entry.get('done'):
+            finishedObjectTypes.add(entry['objectTypeId'])
+        else:
+            finishedObjects.setdefault(entry['objectTypeId'], {})[entry['objectId']] = entry['data']
+    if not journal.entries:
+        journal.append({'run': timeString, 'runStarted': runStarted.isoformat()})
+    for objectTypeId in finishedObjectTypes:
+        finishedObjects.pop(objectTypeId, None)
+    return journal
+
+def estimateRequests(objectCount):
+    # Requests needed for the objects of an object type: the IQL pages (25 objects per page) plus
+    # history and comments per object
+    return math.ceil(objectCount/25) + 2*objectCount
+
+def logEstimatedMakespan(objectTypesToScan, requestsPerMinute):
+    # The run is bound by the rate limit, so the makespan can't be shorter than all requests at the full rate
+    totalRequests = sum(estimateRequests(objectType.get('objectCount', 0)) for objectType, attributeList, backupLocation, previousBackup in objectTypesToScan)
+    logging.info(f"Estimated {totalRequests} requests for the objects of {len(objectTypesToScan)} object types, this takes at least {totalRequests/requestsPerMinute:.1f} minutes at {requestsPerMinute} requests per minute")
+    for objectType, attributeList, backupLocation, previousBackup in objectTypesToScan[:5]:
+        logging.info(f"   {objectType['name']} [{objectType.get('objectCount', 0)} objects, {estimateRequests(objectType.get('objectCount', 0))} requests]")
+
+if __name__ == "__main__":
+    # Debug level
+    fileFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+    handler = logging.handlers.TimedRotatingFileHandler(logFile, when="midnight", backupCount=logFileKeep)
+    handler.setFormatter(fileFormatter)
+    fileLogger = logging.getLogger()
+    fileLogger.addHandler(handler)
+    fileLogger.setLevel(logging.INFO)
+
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    consoleLogger = logging.StreamHandler()
+    consoleLogger.setLevel(logging.INFO)
+    consoleFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+    # tell the handler to use this format
+    consoleLogger.setFormatter(consoleFormatter)
+    # add the handler to the root logger
+    logging.getLogger().addHandler(consoleLogger)
+    logging.info("-----------Start of Run-----------")    
+
+    try:
+        timeString = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+        runStarted = dt.now(timezone.utc)
+        stateFile = os.path.dirname(os.path.abspath(__file__))+"/backupState.json"
+
+        # Load config settings
+        options = assets.getCommandlineOptions(resumable=True)
+        resume = options.get('resume')
+        if resume:
+            # Continue an interrupted run in its own backup folder
+            timeString = os.path.basename(os.path.normpath(resume))
+        checkpointFile = os.path.dirname(os.path.realpath(__file__))+f"/assets-backup-{timeString}.checkpoint.jsonl"
+        # Checked before the stores are opened, opening the zip file or database of the run would overwrite it
+        if resume and (options.get('contentStore') or options.get('streamZip') or options.get('sqlite') or not os.path.exists(checkpointFile)):
+            logging.error(f"ERROR: No checkpoints found for '{resume}', only a run that writes a backup folder can be resumed")
+            exit(1)
+
+        # Connect to assets
+        # The number of requests in flight adapts itself between minConcurrency and maxConcurrency
+        myAssets = assetsConnect(options.get('siteName'), options.get('username'), options.get('apiToken'), **assets.getConnectOptions(options))
+
+        asyncMode = options.get('asyncMode') if 'asyncMode' in options else False
+        shardSize = options.get('shardSize') if 'shardSize' in options else 5000
+        incremental = options.get('incremental') if 'incremental' in options else False
+        fullBackupDays = options.get('fullBackupDays') if 'fullBackupDays' in options else 7
+        backupState = loadBackupState()
+        compression = options.get('compression') if 'compression' in options else 'deflate'
+        compressionLevel = options.get('compressionLevel')
+        # History and comments packed in one JSON Lines file per object type, or the old layout with one file per object
+        packedHistory = options.get('historyLayout', 'packed') != 'files'
+        if options.get('contentStore'):
+            # Save the files of the backup once in a content-addressed store, instead of a folder and a zip file per run
+            store = contentStore = assets.contentStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), options.get('contentStore')), os.path.dirname(os.path.realpath(__file__)))
+        elif options.get('streamZip'):
+            # Write the files of the backup straight into the zip file, without a backup folder on disk
+            store = assets.zipStore(os.path.dirname(os.path.realpath(__file__)), "assets-backup-{run}.zip", compression, compressionLevel).open(timeString)
+        if options.get('sqlite'):
+            # Also save the backup in an SQLite database, for offline lookups and restores
+            store = assets.backupDatabase(f"assets-backup-{timeString}.sqlite", os.path.dirname(os.path.realpath(__file__)), store)
+        if not store:
+            # Finished object types and objects are recorded in a checkpoint journal, so an interrupted run can be resumed
+            checkpoint = loadCheckpoints(checkpointFile)
+            if resume:
+                logging.info(f"Resume the run of {timeString}: {len(finishedObjectTypes)} object types and {sum(len(objects) for objects in finishedObjects.values())} objects of the other object types were finished")
+        if asyncMode:
+            # The object tasks run on one event loop with many requests in flight, in a thread of its own
+            from assetsAsync import assetsAsyncConnect
+            asyncConcurrency = options.get('asyncConcurrency', 100)
+            eventLoop = asyncio.new_event_loop()
+            threading.Thread(target=eventLoop.run_forever, daemon=True).start()
+            myAsyncAssets = asyncio.run_coroutine_threadsafe(assetsAsyncConnect(myAssets, asyncConcurrency).open(), eventLoop).result()
+            pool = assets.workPool(asyncConcurrency, asyncConcurrency*2, eventLoop)
+        else:
+            # One pool for the tasks of all objects of all object types and object schemas
+            pool = assets.workPool(myAssets.concurrency.maxLimit)
+
+        # get the object schema keys we want to backup
+        objectSchemaKeys = options.get('objectSchemaKeys')
+        objectSchemas =[]
+
+        if not objectSchemaKeys:
+            # If no object schema keys are specified, backup everything
+            objectSchemas = myAssets.getObjectSchemas()
+        else:
+            for objectSchemaKey in objectSchemaKeys:
+                objectSchema = myAssets.getObjectSchemaByKey(objectSchemaKey)
+                if not objectSchema:
+                    logging.info(f"WARNING: Could not find object schema for key: '{objectSchemaKey}'")
+                    continue
+                else:
+                    objectSchemas.append(objectSchema)
+        if len(objectSchemas) == 0:
+            logging.info(f"ERROR: No (valid) object schema's found to backup")
+            exit(1)
+        backupLocationPrefix = os.path.dirname(os.path.realpath(__file__))+"/"+timeString
+
+        # Backup object schema's
+        assets.saveAsJson(objectSchemas,"objectschemas", backupLocationPrefix+"/config", store=store)
+
+        objectTypesToScan = []
+        previousBackups = {}
+        logging.info("Start backup of:")
+        for objectSchema in objectSchemas: 
+            logging.info(f"   {objectSchema['name']} [{objectSchema['objectSchemaKey']}]")
+            backupLocation = backupLocationPrefix+"/"+objectSchema['objectSchemaKey']
+            previousBackup = getPreviousBackup(objectSchema['objectSchemaKey'])
+            if previousBackup:
+                logging.info(f"   incremental, changes since {previousBackup[1]} minutes ago on top of {previousBackup[0]}")
+                previousBackups[objectSchema['objectSchemaKey']] = previousBackup
         
-        # Backup meta data
-        # - object schema
-        assets.saveAsJson(objectSchema,"objectschema", backupLocation+"/config")
-        logging.info("   - objectschema")
+            # Backup meta data
+            # - object schema
+            assets.saveAsJson(objectSchema,"objectschema", backupLocation+"/config", store=store)
+            logging.info("   - objectschema")
         
-        # - object schema properties
-        objectSchemaProperties = myAssets.getObjectSchemaProperties(objectSchema['id'])
-        assets.saveAsJson(objectSchemaProperties,"objectschema_properties", backupLocation+"/config")
-        logging.info("   - object schema properties")
+            # - object schema properties
+            objectSchemaProperties = myAssets.getObjectSchemaProperties(objectSchema['id'])
+            assets.saveAsJson(objectSchemaProperties,"objectschema_properties", backupLocation+"/config", store=store)
+            logging.info("   - object schema properties")
         
-        # - global reference types
-        referenceTypes = myAssets.getGlobalReferenceTypes()
-        assets.saveAsJson(referenceTypes,"global_referencetypes", backupLocation+"/config")
-        logging.info("   - global referencetypes")
-
-        # - global status types
-        statusTypes = myAssets.getGlobalStatusTypes()
-        assets.saveAsJson(statusTypes,"global_statustypes", backupLocation+"/config")
-        logging.info("   - global statustypes")
-
-        # Backup schema
-        # - schema reference types
-        objectSchemaReferenceTypes = myAssets.getReferenceTypes(objectSchema['id'])
-        assets.saveAsJson(objectSchemaReferenceTypes,"referencetypes", backupLocation+"/config")
-        logging.info("   - schema referencetypes")
-
-        # - schema status types
-        objectSchemaStatusTypes = myAssets.getStatusTypes(objectSchema['id'])
-        assets.saveAsJson(objectSchemaStatusTypes,"statustypes", backupLocation+"/config")
-        logging.info("   - schema statustypes")
-
-        # - object types
-        allObjectTypes = myAssets.getObjectTypes(objectSchema['id'])
-        assets.saveAsJson(allObjectTypes,"objecttypes", backupLocation+"/config")
-        nrOfObjectTypes = len(allObjectTypes)
-        logging.info(f"   - objecttypes [{nrOfObjectTypes}]")
-
-        # - attributes
-        i = 0
-        for objectType in allObjectTypes:
-            i += 1
-            logging.info(f"- '{objectType['name']}' [{i}/{nrOfObjectTypes}]:")
-            attributeList = myAssets.getAttributeList(objectType['id'])
-            assets.saveAsJson(attributeList,f"{objectType['name']}_{objectType['id']}", backupLocation+"/config/attributes")
-            logging.info(f"     - attributes [{len(attributeList)}]")
-            
-            # - objects
-            objects = myAssets.getObjects("objectTypeId="+objectType['id'])
-            assets.saveAsJson(objects,f"{objectType['name']}_{objectType['id']}", backupLocation+"/objectsmeta")
-            logging.info(f"     - object types [{len(objects)}]")
-
-            # - object data
-            objectsData = {}
-            # start the thread pool
-            with ThreadPoolExecutor(maxThreads) as executor:
-                # submit tasks and collect futures
-                futures = [executor.submit(getObjectData,object) for object in objects]
-                # process task results as they are available
-                for future in as_completed(futures):
-                    # retrieve the result
-                    objectId, objectData = future.result()
-                    objectsData[objectId] = objectData
-            assets.saveAsJson(objectsData,f"{objectType['name']}_{objectType['id']}", backupLocation+"/objects")
-            logging.info(f"        - data")
-            
-            # - object history
-            with ThreadPoolExecutor(maxThreads) as executor:
-                # submit tasks and collect futures
-                futures = [executor.submit(getObjectHistory,object) for object in objects]
-                # process task results as they are available
-                for future in as_completed(futures):
-                    # retrieve the result
-                    objectHistory = future.result()
-                    if objectHistory:
-                        assets.saveAsJson(objectHistory,objectHistory[0]['objectId'], backupLocation+"/objects/history")
-            logging.info(f"        - history")
-                
-            # - object history
-            with ThreadPoolExecutor(maxThreads) as executor:
-                # submit tasks and collect futures
-                futures = [executor.submit(getObjectComment,object) for object in objects]
-                # process task results as they are available
-                for future in as_completed(futures):
-                    # retrieve the result
-                    objectComment = future.result()
-                    if objectComment:
-                        assets.saveAsJson(objectComment,objectComment[0]['objectId'], backupLocation+"/objects/comments")
-            logging.info(f"        - comments")
+            # - global reference types
+            referenceTypes = myAssets.getGlobalReferenceTypes()
+            assets.saveAsJson(referenceTypes,"global_referencetypes", backupLocation+"/config", store=store)
+            logging.info("   - global referencetypes")
+
+            # - global status types
+            statusTypes = myAssets.getGlobalStatusTypes()
+            assets.saveAsJson(statusTypes,"global_statustypes", backupLocation+"/config", store=store)
+            logging.info("   - global statustypes")
+
+            # Backup schema
+            # - schema reference types
+            objectSchemaReferenceTypes = myAssets.getReferenceTypes(objectSchema['id'])
+            assets.saveAsJson(objectSchemaReferenceTypes,"referencetypes", backupLocation+"/config", store=store)
+            logging.info("   - schema referencetypes")
+
+            # - schema status types
+            objectSchemaStatusTypes = myAssets.getStatusTypes(objectSchema['id'])
+            assets.saveAsJson(objectSchemaStatusTypes,"statustypes", backupLocation+"/config", store=store)
+            logging.info("   - schema statustypes")
+
+            # - object types
+            allObjectTypes = myAssets.getObjectTypes(objectSchema['id'], includeObjectCounts=True)
+            assets.saveAsJson(allObjectTypes,"objecttypes", backupLocation+"/config", store=store)
+            nrOfObjectTypes = len(allObjectTypes)
+            logging.info(f"   - objecttypes [{nrOfObjectTypes}]")
+
+            # - attributes
+            i = 0
+            for objectType in allObjectTypes:
+                i += 1
+                logging.info(f"- '{objectType['name']}' [{i}/{nrOfObjectTypes}]:")
+                attributeList = myAssets.getAttributeList(objectType['id'])
+                assets.saveAsJson(attributeList,f"{objectType['name']}_{objectType['id']}", backupLocation+"/config/attributes", store=store)
+                logging.info(f"     - attributes [{len(attributeList)}]")
+                objectTypesToScan.append([objectType, attributeList, backupLocation, previousBackups.get(objectSchema['objectSchemaKey'])])
+
+        # - objects
+        # The object types of all object schemas are scanned largest first (longest processing time first), so the
+        # largest object types don't end up as a single long tail at the end of the run. The object tasks of all
+        # object types go into the same pool, so the scan of the next object type starts while the objects of the
+        # previous one are still being backed up
+        objectTypesToScan.sort(key=lambda item: item[0].get('objectCount', 0), reverse=True)
+        # Object types that were finished before the run was interrupted are not scanned again
+        objectTypesToScan = [item for item in objectTypesToScan if item[0]['id'] not in finishedObjectTypes]
+        logEstimatedMakespan(objectTypesToScan, myAssets.rateLimiter.requestsPerMinute)
+        for objectType, attributeList, backupLocation, previousBackup in objectTypesToScan:
+            previousLocation = previousBackup[0] if previousBackup else None
+            if previousLocation and backupExists(f"{previousLocation}/objectsmeta/{assets.safeFileName(objectType['name']+'_'+objectType['id'])}.json"):
+                scanObjectTypeIncremental(objectType, attributeList, backupLocation, previousLocation, previousBackup[1])
+            else:
+                scanObjectType(objectType, attributeList, backupLocation)
+
+        # Wait for the object tasks
+        pool.shutdown()
+        if pool.errors:
+            logging.warning(f"{pool.errors} object tasks failed, see the log for details")
+
+        if store:
+            store.commit(timeString)
+            if options.get('sqlite'):
+                store.close()
+
+        # Remember this run, the next incremental run continues from here
+        failedRequests = myAssets.getRequestStats()['failed']
+        if pool.errors or failedRequests:
+            logging.warning(f"{pool.errors} object tasks and {failedRequests} requests failed, the next run is a full backup")
+        updateBackupState(objectSchemas, previousBackups, backupLocationPrefix, pool.errors or failedRequests)
     
-    # Zip the backup
-    assets.zipDir(backupLocationPrefix, f"assets-backup-{timeString}.zip")
-except KeyboardInterrupt:
-    # handle Ctrl-C
-    logging.warn("Cancelled by user")
-except Exception as ex:
-    # handle unexpected script errors
-    logging.exception("Unhandled error\n{}".format(ex))
-    raise
-finally:
-    logging.info("------------End of Run------------")
-    logging.shutdown()
\ No newline at end of file
+        if options.get('contentStore'):
+            # Runs older than keepDays are removed, the content they share with the remaining runs is kept
+            contentStore.prune(options.get('keepDays') if 'keepDays' in options else 90)
+        elif not options.get('streamZip'):
+            # Zip the backup
+            assets.zipDir(backupLocationPrefix, f"assets-backup-{timeString}.zip", compression, compressionLevel)
+
+        if options.get('verifyZip') and not options.get('contentStore'):
+            # Read the zip file back and check it against its manifest
+            if assets.verifyZip(f"assets-backup-{timeString}.zip"):
+                logging.error(f"The zip file 'assets-backup-{timeString}.zip' is not correct, see the errors above")
+
+        if checkpoint:
+            if pool.errors or failedRequests:
+                # The failed objects are backed up again when the run is resumed
+                logging.warning(f"Run 'python backupAssets.py -f <config> --resume {timeString}' to retry the failed object tasks and requests")
+            else:
+                checkpoint.remove()
+    except KeyboardInterrupt:
+        # handle Ctrl-C
+        logging.warn("Cancelled by user")
+    except Exception as ex:
+        # handle unexpected script errors
+        logging.exception("Unhandled error\n{}".format(ex))
+        raise
+    finally:
+        if checkpoint:
+            checkpoint.sync()
+        if myAsyncAssets:
+            asyncio.run_coroutine_threadsafe(myAsyncAssets.close(), eventLoop).result()
+            eventLoop.call_soon_threadsafe(eventLoop.stop)
+        if myAssets:
+            logging.info(f"Requests: {myAssets.getRequestStats()}")
+            myAssets.close()
+        logging.info("------------End of Run------------")
+        logging.shutdown()
\ No newline at end of file
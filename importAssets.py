@@ -1,33 +1,23 @@
 from turtle import position
 from assets import assetsConnect
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import os, logging, logging.handlers, re, assets
+from assetsQuery import backupQuery
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import os, logging, logging.handlers, re, assets, asyncio, zipfile
 from os.path import isdir
 
 # Script settings 
-maxThreads = 8
 logFileKeep = 10 # Number of days to keep the logfiles, before being rotated
 logFile = os.path.dirname(os.path.abspath(__file__))+"/import.log"
 
-# Debug level
-fileFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
-handler = logging.handlers.TimedRotatingFileHandler(logFile, when="midnight", backupCount=logFileKeep)
-handler.setFormatter(fileFormatter)
-fileLogger = logging.getLogger()
-fileLogger.addHandler(handler)
-fileLogger.setLevel(logging.DEBUG)
-
-# define a Handler which writes INFO messages or higher to the sys.stderr
-consoleLogger = logging.StreamHandler()
-consoleLogger.setLevel(logging.INFO)
-consoleFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
-# tell the handler to use this format
-consoleLogger.setFormatter(consoleFormatter)
-# add the handler to the root logger
-logging.getLogger().addHandler(consoleLogger)
-logging.info("-----------Start of Run-----------")    
+myAssets = None
+myAsyncAssets = None
+asyncMode = False
+folder = None
 
 objectIdTranslate = {}
+# Objects created by this or an earlier run in the same site and object schemas, from the journal: {old object id: {'id', 'objectType', 'objectKey'}}
+createdObjects = {}
+createdObjectsJournal = None
 
 def getObjectSchemaIdTranslation(importObjectSchemaInfo, folder):
     objectSchemas = assets.loadJson(f"{folder}/config/objectschemas.json")
@@ -44,14 +34,14 @@ def getObjectSchemaIdTranslation(importObjectSchemaInfo, folder):
                 translation[objectSchema['id']]=newObjectSchema['id']
     return translation
 
-def updateObjectByObjectTypeId(updateObjectId, updateObjectTypeId, objectData):
+def translateReferences(updateObjectId, updateObjectTypeId, objectData):
     # Now we have to manipulate the objectData that was loaded from the backup
     # Because references to other objects might have changed
     # Luckily we have stored the old object keys (~id's)
     # And we have the objectTranslation
     
     # Find all reference attribute names
-    attributesList = myAssets.getAttributeList(updateObjectTypeId)
+    attributesList = myAssets.getObjectTypeAttributes(updateObjectTypeId) or []
     referenceAttributeNames = []
     for attribute in attributesList:
         if attribute['type'] == 1:
@@ -81,21 +71,79 @@ def updateObjectByObjectTypeId(updateObjectId, updateObjectTypeId, objectData):
             newObjectData[key] = allrefValues
         else:
             newObjectData[key] = objectData[key]
+    return newObjectData
+
+def getReferencedObjectIds(objectData):
+    # The new ids of the objects that are referenced in the object data of the backup
+    for value in objectData.values():
+        for refValue in value if isinstance(value, list) else [value]:
+            if isinstance(refValue, dict) and 'searchValue' in refValue:
+                translatedObjectId = objectIdTranslate.get(refValue['searchValue'].split("-",1)[1])
+                if translatedObjectId:
+                    yield translatedObjectId
 
+def updateObjectByObjectTypeId(updateObjectId, updateObjectTypeId, objectData):
+    newObjectData = translateReferences(updateObjectId, updateObjectTypeId, objectData)
     updatedObject = myAssets.updateObjectByObjectTypeId(updateObjectId, updateObjectTypeId, newObjectData)
     if not updatedObject:
         logging.warning(f"Failed: updateObjectByObjectTypeId > Object id:{updateObjectId} - Object Type id: {updateObjectTypeId}")
     return updatedObject
 
+async def updateObjectByObjectTypeIdAsync(updateObjectId, updateObjectTypeId, objectData):
+    newObjectData = await asyncio.to_thread(translateReferences, updateObjectId, updateObjectTypeId, objectData)
+    updatedObject = await myAsyncAssets.updateObjectByObjectTypeId(updateObjectId, updateObjectTypeId, newObjectData)
+    if not updatedObject:
+        logging.warning(f"Failed: updateObjectByObjectTypeId > Object id:{updateObjectId} - Object Type id: {updateObjectTypeId}")
+    return updatedObject
+
+def journalTarget(objectSchemaInfo):
+    # The site and object schema the objects are created in, journal entries of another target are not used
+    return {'site': myAssets.workspaceId, 'oldObjectSchemaKey': objectSchemaInfo['oldObjectSchemaKey'], 'objectSchemaKey': objectSchemaInfo['newObjectSchemaKey']}
+
+def loadCreatedObjects(folder, objectSchemasInfo):
+    # Every created object is added to the journal at once, so the objects created by a run that was
+    # killed are known as well. The objects created in the same site and object schemas are replayed here
+    # and not looked up again
+    journal = assets.journalFile(folder+"/createdObjects.jsonl")
+    targets = [journalTarget(objectSchemaInfo) for objectSchemaInfo in objectSchemasInfo]
+    otherTarget = 0
+    for entry in journal.entries:
+        if {key: entry.get(key) for key in ['site', 'oldObjectSchemaKey', 'objectSchemaKey']} not in targets:
+            otherTarget += 1
+            continue
+        objectIdTranslate[entry['oldObjectId']] = entry['objectId']
+        createdObjects[entry['oldObjectId']] = {'id': entry['objectId'], 'objectType': {'id': entry['objectTypeId']}, 'objectKey': entry.get('objectKey')}
+        myAssets.cacheObjectKey(createdObjects[entry['oldObjectId']])
+    if createdObjects:
+        logging.info(f"{len(createdObjects)} objects created by an earlier run")
+    if otherTarget:
+        logging.info(f"{otherTarget} objects of the journal were created in another site or object schema, these are not used")
+    return journal
+
+def journalCreatedObject(oldObject, newObject, newObjectTypeId, objectSchemaInfo):
+    # Record an object that was created, unless it was taken from the journal
+    if createdObjects.get(oldObject['id']) is not newObject:
+        createdObjectsJournal.append({'oldObjectId': oldObject['id'], 'objectId': newObject['id'], 'objectTypeId': newObjectTypeId, 'objectKey': newObject.get('objectKey'), **journalTarget(objectSchemaInfo)})
+
+def isCreatedObject(newObjectTypeId, object):
+    # Created by an earlier run as an object of the same object type
+    createdObject = createdObjects.get(object['id'])
+    return createdObject is not None and str(createdObject['objectType']['id']) == str(newObjectTypeId)
+
 def createObject(newObjectTypeId, object):
     newObject = None
+    if isCreatedObject(newObjectTypeId, object):
+        # Created by an earlier run, the journal is trusted so no request is needed
+        return [object, createdObjects[object['id']]]
     if object['id'] in objectIdTranslate:
-        iql = f'objectId="{objectIdTranslate[object["id"]]}"'
+        # Only an object of the object type it is created as, not one created in another object schema
+        iql = f'objectTypeId={newObjectTypeId} and objectId="{objectIdTranslate[object["id"]]}"'
         findObject = myAssets.getObjects(iql)
-        if len(findObject)==1:
+        if findObject and len(findObject)==1:
             # When object was found
             logging.info(f"Existing object: {object['name']} [{object['objectType']['name']}]")
             newObject=findObject[0]
+            myAssets.cacheObjectKey(newObject)
     if not newObject:
         # Find the attribute which is used for the Label of the object
         labelAttribute = myAssets.getLabelAttribute(newObjectTypeId)
@@ -107,6 +155,31 @@ def createObject(newObjectTypeId, object):
         newObject = myAssets.createObjectById(data, newObjectTypeId)
     return [object, newObject]
 
+async def createObjectAsync(newObjectTypeId, object):
+    newObject = None
+    if isCreatedObject(newObjectTypeId, object):
+        # Created by an earlier run, the journal is trusted so no request is needed
+        return [object, createdObjects[object['id']]]
+    if object['id'] in objectIdTranslate:
+        # Only an object of the object type it is created as, not one created in another object schema
+        iql = f'objectTypeId={newObjectTypeId} and objectId="{objectIdTranslate[object["id"]]}"'
+        findObject = await myAsyncAssets.getObjects(iql)
+        if findObject and len(findObject)==1:
+            # When object was found
+            logging.info(f"Existing object: {object['name']} [{object['objectType']['name']}]")
+            newObject=findObject[0]
+            myAssets.cacheObjectKey(newObject)
+    if not newObject:
+        # Find the attribute which is used for the Label of the object
+        labelAttribute = await myAsyncAssets.getLabelAttribute(newObjectTypeId)
+        logging.info(f"Creating object: {object['label']} [{object['objectType']['name']}]")
+
+        data = {
+            labelAttribute['name']: object['label']
+        }
+        newObject = await myAsyncAssets.createObjectById(data, newObjectTypeId)
+    return [object, newObject]
+
 def createObjectAttribute(newObjectType, attribute, objectSchemaIdTranslate):
     # Check if attribute already exists
     newAttribute = myAssets.getAttributeByName(newObjectType['id'], attribute['name'])
@@ -144,7 +217,7 @@ def createObjectAttribute(newObjectType, attribute, objectSchemaIdTranslate):
                 
             if referenceObjectType:
                 data['typeValue'] = referenceObjectType['id']
-            referenceType = myAssets.getReferenceTypeByName(attribute['referenceType']['name'])
+            referenceType = myAssets.getReferenceTypeByName(attribute['referenceType']['name'], objectSchemaId=newObjectType.get('objectSchemaId'))
             if referenceType:
                 data['additionalValue'] = referenceType['id']
 
@@ -267,14 +340,27 @@ def updateAttributeType(newObjectType, attribute, attributeIdTranslate):
     
     return updatedObjectTypeAttribute
 
-def addComment(filename, translate):
-    if not filename.endswith('.json'):
-        # This is not a JSON file, skip it
-        return
-    jsonfile = filename.replace(" ", '_')      
-    comments  = assets.loadJson(jsonfile)
+def iterBackupRecords(folder, objectIds=None):
+    # The history or comments of all objects in a backup folder (or only of objectIds), one list per object. They are packed
+    # in one JSON Lines file per object type (.jsonl) or, in backups of older versions, saved in one file per object (.json)
+    for filename in os.listdir(folder):
+        if filename.endswith('.jsonl'):
+            records = assets.iterJsonLines(f"{folder}/{filename}")
+        elif filename.endswith('.json'):
+            if objectIds is not None and filename[:-5] not in objectIds:
+                continue
+            records = [assets.loadJson(f"{folder}/{filename}")]
+        else:
+            continue
+        for objectRecords in records:
+            if objectIds is None or str(objectRecords[0]['objectId']) in objectIds:
+                yield objectRecords
+
+def getComments(comments, translate):
+    # Returns the comments of an object as a list of [comment, new object id]
     objectId = translate.get(comments[0]['objectId']) # All comments in the list belong to the same object
     logging.info(f"   Comments for {comments[0]['objectId']}")
+    commentsData = []
     # Iterate over comment list
     for comment in comments:
         # Decompose created > created date and created time        
@@ -282,17 +368,23 @@ def addComment(filename, translate):
         commentCreatedTime = re.search('.*?T(.*?)\..*', comment['created']).group(1)
         
         commentData = "<p><strong>Comment by: "+comment['actor']['displayName']+" on "+commentCreatedDate+" at "+commentCreatedTime+"</strong></p><p>"+comment['comment']+"</p>"
+        commentsData.append([commentData, objectId])
+    return commentsData
 
+def addComment(comments, translate):
+    for commentData, objectId in getComments(comments, translate):
         # Create the comment
         myAssets.createComment(commentData, objectId)
     return
 
-def addHistoryasComment(filename, translate):
-    if not filename.endswith('.json'):
-        # This is not a JSON file, skip it
-        return
-    jsonfile = filename.replace(" ", '_')      
-    history = assets.loadJson(jsonfile)
+async def addCommentAsync(comments, translate):
+    # The comments of one object are created in order
+    for commentData, objectId in getComments(comments, translate):
+        await myAsyncAssets.createComment(commentData, objectId)
+    return
+
+def getHistoryComment(history, translate):
+    # Returns the history of an object as [comment, new object id]
     objectId = translate.get(history[0]['objectId']) # All history in the list belong to the same object
 
     # The history can not be recreated, we can only add the old history as a comment
@@ -341,11 +433,57 @@ def addHistoryasComment(filename, translate):
         else:
             objectToPrint.append("")
         comment+=("%-25s %-20s %-35s %-20s %-18s %s\n" % (objectToPrint[0], objectToPrint[1], objectToPrint[2], objectToPrint[3], objectToPrint[4], objectToPrint[5]))
-    # Create the history comment
     logging.info(f"   History comment for {objectId}")
-    myAssets.createComment(f"<pre>{comment}</pre>", objectId)
+    return [f"<pre>{comment}</pre>", objectId]
+
+def addHistoryasComment(history, translate):
+    historyComment = getHistoryComment(history, translate)
+    if historyComment:
+        # Create the history comment
+        myAssets.createComment(*historyComment)
     return
 
+async def addHistoryasCommentAsync(history, translate):
+    historyComment = getHistoryComment(history, translate)
+    if historyComment:
+        await myAsyncAssets.createComment(*historyComment)
+    return
+
+def runTasks(function, asyncFunction, argsList):
+    # Run function for all arguments in the thread pool, or asyncFunction on the event loop in async mode.
+    # Yields the results as they are available. argsList may be a generator, it is read while the tasks run,
+    # so only a limited number of tasks is waiting at any time
+    if asyncMode:
+        maxPending = myAsyncAssets.maxInFlight*2
+        async def runWindow(pending, argsIterator):
+            for args in argsIterator:
+                pending.add(asyncio.ensure_future(asyncFunction(*args)))
+                if len(pending) >= maxPending:
+                    break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED) if pending else (set(), set())
+            return done, pending
+        argsIterator = iter(argsList)
+        pending = set()
+        while True:
+            done, pending = eventLoop.run_until_complete(runWindow(pending, argsIterator))
+            if not done and not pending:
+                return
+            for task in done:
+                yield task.result()
+    # start the thread pool
+    with ThreadPoolExecutor(myAssets.concurrency.maxLimit) as executor:
+        maxPending = myAssets.concurrency.maxLimit*4
+        futures = set()
+        for args in argsList:
+            futures.add(executor.submit(function, *args))
+            if len(futures) >= maxPending:
+                # process task results as they are available
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(futures):
+            yield future.result()
+
 def orderObjectTypes(objectTypes):
     # order object types so we can create them
     # It is not possible to create two object types with the same name on the same level
@@ -376,224 +514,329 @@ def orderObjectTypes(objectTypes):
             orderedObjectTypes.append(ot)
     return orderedObjectTypes
 
+def getRestoreSelection(query, restoreFilter):
+    # The ids of the objects in the backup that match the restore filter (any of the object ids, object types,
+    # labels or the IQL query) and of the objects they reference, directly or indirectly
+    selected = {str(objectId) for objectId in restoreFilter.get('objectIds', []) if str(objectId) in query.objects}
+    for objectType in restoreFilter.get('objectTypes', []):
+        selected |= query.compare('objecttype', '=', objectType)
+    for label in restoreFilter.get('labels', []):
+        selected |= query.compare('label', '=', label)
+    if restoreFilter.get('iql'):
+        selected |= {object['id'] for object in query.getObjects(restoreFilter['iql'])}
+    referenced = query.getReferencedObjects(selected) if restoreFilter.get('includeReferences', True) else set()
+    return selected, referenced
+
+def resolveExistingObjects(objectIds, query):
+    # Objects that still exist on the site with the same key are used instead of creating them again,
+    # returns the ids of the objects that were not found
+    keys = {query.objects[objectId].get('objectKey'): objectId for objectId in objectIds}
+    found = set()
+    keyList = list(keys)
+    for i in range(0, len(keyList), 50):
+        iql = 'Key in ('+','.join(f'"{key}"' for key in keyList[i:i+50])+')'
+        for object in myAssets.getObjects(iql, includeAttributes=False) or []:
+            if object.get('objectKey') in keys:
+                objectIdTranslate[keys[object['objectKey']]] = object['id']
+                myAssets.cacheObjectKey(object)
+                found.add(keys[object['objectKey']])
+    return set(objectIds) - found
+
 def getOldObjectTypeId(dict, newObjectTypeId):
     for name, age in dict.iteritems():
         if age == newObjectTypeId:
             return name
-try:
-    # Load config settings
-    options = assets.getCommandlineOptions()
+if __name__ == "__main__":
+    # Debug level
+    fileFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+    handler = logging.handlers.TimedRotatingFileHandler(logFile, when="midnight", backupCount=logFileKeep)
+    handler.setFormatter(fileFormatter)
+    fileLogger = logging.getLogger()
+    fileLogger.addHandler(handler)
+    fileLogger.setLevel(logging.DEBUG)
+
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    consoleLogger = logging.StreamHandler()
+    consoleLogger.setLevel(logging.INFO)
+    consoleFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+    # tell the handler to use this format
+    consoleLogger.setFormatter(consoleFormatter)
+    # add the handler to the root logger
+    logging.getLogger().addHandler(consoleLogger)
+    logging.info("-----------Start of Run-----------")    
+
+    try:
+        # Load config settings
+        options = assets.getCommandlineOptions()
     
-    processObjects = options.get('processObjects') if 'processObjects' in options else True
-    processComments = options.get('processComments') if 'processComments' in options else True
-    processHistory = options.get('processHistory') if 'processHistory' in options else True
-    setAttributeRestrictions = options.get('setAttributeRestrictions') if 'setAttributeRestrictions' in options else True
-
-    # Connect to assets
-    myAssets = assetsConnect(options.get('siteName'), options.get('username'), options.get('apiToken'))
-
-    # get the object schemas info we want to import
-    objectSchemasInfoToImport = options.get('objectSchemas')
-
-    for objectSchemaInfo in objectSchemasInfoToImport:
-        folder = os.path.normpath(os.path.abspath(options.get('folder')))
-        if not isdir(folder):
-            logging.fatal(f"Path to data dir '{folder}' does not exists.")
-            exit(1)
+        processObjects = options.get('processObjects') if 'processObjects' in options else True
+        processComments = options.get('processComments') if 'processComments' in options else True
+        processHistory = options.get('processHistory') if 'processHistory' in options else True
+        setAttributeRestrictions = options.get('setAttributeRestrictions') if 'setAttributeRestrictions' in options else True
+        asyncMode = options.get('asyncMode') if 'asyncMode' in options else False
+        # Only restore the objects that match the filter and the objects they need
+        restoreFilter = options.get('restoreFilter')
+        restoreQuery = None
+        missingObjectIds = None
+
+        # Connect to assets
+        # The number of requests in flight adapts itself between minConcurrency and maxConcurrency
+        myAssets = assetsConnect(options.get('siteName'), options.get('username'), options.get('apiToken'), **assets.getConnectOptions(options))
+
+        if asyncMode:
+            # Objects, comments and history are restored from one event loop with many requests in flight
+            from assetsAsync import assetsAsyncConnect
+            eventLoop = asyncio.new_event_loop()
+            myAsyncAssets = eventLoop.run_until_complete(assetsAsyncConnect(myAssets, options.get('asyncConcurrency', 100)).open())
+
+        # get the object schemas info we want to import
+        objectSchemasInfoToImport = options.get('objectSchemas')
+
+        for objectSchemaInfo in objectSchemasInfoToImport:
+            folder = os.path.normpath(os.path.abspath(options.get('folder')))
+            if folder.endswith('.zip') and os.path.isfile(folder):
+                # A zipped backup is extracted next to the zip file, once
+                zipFolder = os.path.dirname(folder)+"/"+zipfile.ZipFile(folder).namelist()[0].split('/')[0]
+                if not isdir(zipFolder):
+                    assets.unzipFile(folder, os.path.dirname(folder))
+                folder = zipFolder
+            if options.get('contentStore') and not isdir(folder):
+                # Restore the backup run with the name of the folder from the content store of the backup
+                assets.contentStore(options.get('contentStore'), os.path.dirname(folder)).checkout(os.path.basename(folder), folder)
+            if options.get('database') and not restoreQuery and (restoreFilter or not isdir(folder) or os.path.exists(folder+"/partialCheckout.json")):
+                # Write the backup folder from the SQLite database of the backup. With a restore filter the objects are
+                # selected on the objects table and only the selected objects are written, again on every run
+                checkoutObjectIds = None
+                if restoreFilter:
+                    restoreQuery = backupQuery(options.get('database'))
+                    selectedObjectIds, referencedObjectIds = getRestoreSelection(restoreQuery, restoreFilter)
+                    logging.info(f"Restore filter: {len(selectedObjectIds)} objects selected, {len(referencedObjectIds)} referenced objects")
+                    checkoutObjectIds = selectedObjectIds | referencedObjectIds
+                database = assets.backupDatabase(options.get('database'), os.path.dirname(folder))
+                database.checkout(folder, checkoutObjectIds)
+                database.close()
+            if not isdir(folder):
+                logging.fatal(f"Path to data dir '{folder}' does not exists.")
+                exit(1)
         
-        if os.path.exists(folder+"/createdObjects.json"):
-            # If a run was already done, reload already created objects
-            objectIdTranslate = assets.loadJson(folder+"/createdObjects.json")
-
-        importDataPath = f"{folder}/{objectSchemaInfo['oldObjectSchemaKey']}"
-
-        # Import meta data
-        # - create global reference types
-        referenceTypes = assets.loadJson(importDataPath+'/config/global_referencetypes.json')
-        for referenceType in referenceTypes:
-            if not myAssets.getReferenceTypeByName(referenceType['name']):
-                # The reference type does not exists  
-                logging.info(f"Create global reference type '{referenceType['name']}'")
-                myAssets.createReferenceType(referenceType['name'], referenceType['color'], referenceType['description'])
-
-        # - create global status types
-        statusTypeIdTranslate={}
-        statusTypes = assets.loadJson(importDataPath+'/config/global_statustypes.json')
-        for statusType in statusTypes:
-            newStatusType = myAssets.getStatusTypeByName(statusType['name'])
-            if not newStatusType:
-                # The status type does not exists
-                logging.info(f"Create global status type '{statusType['name']}'")
-                newStatusType = myAssets.createStatusType(statusType['name'], statusType['category'], statusType['description'])
-                if newStatusType:
+            if not createdObjectsJournal:
+                if os.path.exists(folder+"/createdObjects.json"):
+                    # If a run was already done, reload already created objects
+                    objectIdTranslate.update(assets.loadJson(folder+"/createdObjects.json"))
+                createdObjectsJournal = loadCreatedObjects(folder, objectSchemasInfoToImport)
+
+            importDataPath = f"{folder}/{objectSchemaInfo['oldObjectSchemaKey']}"
+
+            restoreObjectIds = None
+            restoreObjectTypeIds = None
+            restoreRecordObjectIds = None
+            if restoreFilter:
+                if not restoreQuery:
+                    restoreQuery = backupQuery(folder)
+                    selectedObjectIds, referencedObjectIds = getRestoreSelection(restoreQuery, restoreFilter)
+                    logging.info(f"Restore filter: {len(selectedObjectIds)} objects selected, {len(referencedObjectIds)} referenced objects")
+                if missingObjectIds is None:
+                    # Referenced objects of object schemas that are not imported must exist on the site already,
+                    # they are looked up once for all imported object schemas
+                    importedKeys = [info['oldObjectSchemaKey'] for info in objectSchemasInfoToImport]
+                    missingObjectIds = resolveExistingObjects([id for id in referencedObjectIds if restoreQuery.getObjectSchemaKey(id) not in importedKeys], restoreQuery)
+                    for objectId in missingObjectIds:
+                        logging.warning(f"Referenced object {restoreQuery.objects[objectId].get('objectKey')} is not in an imported object schema and does not exist")
+                objectsOfSchema = {id for id in selectedObjectIds | referencedObjectIds if restoreQuery.getObjectSchemaKey(id) == objectSchemaInfo['oldObjectSchemaKey']}
+                restoreObjectIds = objectsOfSchema & selectedObjectIds
+                referencedOfSchema = objectsOfSchema - selectedObjectIds
+                if objectSchemaInfo['oldObjectSchemaKey'] == objectSchemaInfo['newObjectSchemaKey']:
+                    # Restore into the same object schema: selected objects that still exist are updated,
+                    # referenced objects that still exist are left alone
+                    createdObjectIds = resolveExistingObjects(restoreObjectIds, restoreQuery)
+                    referencedOfSchema = resolveExistingObjects(referencedOfSchema, restoreQuery)
+                else:
+                    createdObjectIds = set(restoreObjectIds)
+                restoreObjectIds |= referencedOfSchema
+                # Comments and history are only added to the objects that are created again
+                restoreRecordObjectIds = createdObjectIds | referencedOfSchema
+                restoreObjectTypeIds = {restoreQuery.objects[id]['objectType']['id'] for id in restoreObjectIds}
+                logging.info(f"Restore {len(restoreObjectIds)} objects of {len(restoreObjectTypeIds)} object types in object schema {objectSchemaInfo['oldObjectSchemaKey']}")
+
+            # Import meta data
+            # - create global reference types
+            referenceTypes = assets.loadJson(importDataPath+'/config/global_referencetypes.json')
+            for referenceType in referenceTypes:
+                if not myAssets.getReferenceTypeByName(referenceType['name']):
+                    # The reference type does not exists  
+                    logging.info(f"Create global reference type '{referenceType['name']}'")
+                    myAssets.createReferenceType(referenceType['name'], referenceType['color'], referenceType['description'])
+
+            # - create global status types
+            statusTypeIdTranslate={}
+            statusTypes = assets.loadJson(importDataPath+'/config/global_statustypes.json')
+            for statusType in statusTypes:
+                newStatusType = myAssets.getStatusTypeByName(statusType['name'])
+                if not newStatusType:
+                    # The status type does not exists
+                    logging.info(f"Create global status type '{statusType['name']}'")
+                    newStatusType = myAssets.createStatusType(statusType['name'], statusType['category'], statusType['description'])
+                    if newStatusType:
+                        statusTypeIdTranslate[statusType['id']]=newStatusType['id']
+                else:
+                    logging.info(f"Found existing global status type '{statusType['name']}'")
                     statusTypeIdTranslate[statusType['id']]=newStatusType['id']
-            else:
-                logging.info(f"Found existing global status type '{statusType['name']}'")
-                statusTypeIdTranslate[statusType['id']]=newStatusType['id']
             
-        # Load object schema
-        objectSchema = assets.loadJson(importDataPath+'/config/objectschema.json')
-
-        # Create schema
-        newObjectSchema = myAssets.getObjectSchemaByKey(objectSchemaInfo['newObjectSchemaKey'])
-        if not newObjectSchema:
-            logging.info(f"Create object schema '{objectSchemaInfo['newObjectSchemaName']}'")
-            description = objectSchema['description'] if objectSchema.get('description') else ""
-            newObjectSchema = myAssets.createObjectSchema(objectSchemaInfo['newObjectSchemaName'], objectSchemaInfo['newObjectSchemaKey'], description)
-
-        # Load object schemas translation for referenced objects
-        objectSchemaIdTranslate = getObjectSchemaIdTranslation(objectSchemaInfo, folder)
-
-        # Load object schema properties
-        objectSchemaProperties = assets.loadJson(importDataPath+'/config/objectschema_properties.json')
-        if objectSchemaProperties:
-            logging.info(f"Set object schema properties")
-            myAssets.updateObjectSchemaProperties(newObjectSchema['id'], objectSchemaProperties['allowOtherObjectSchema'],objectSchemaProperties['createObjectsCustomField'],objectSchemaProperties['quickCreateObjects'],objectSchemaProperties['serviceDescCustomersEnabled'],objectSchemaProperties['validateQuickCreate'])
-
-        # - create schema reference types
-        referenceTypes = assets.loadJson(importDataPath+'/config/referencetypes.json')
-        for referenceType in referenceTypes:
-            referenceTypesOfObjectSchema = myAssets.getReferenceTypes(newObjectSchema['id'])
-            createReference = True
-            for referenceTypeOfObjectSchema in referenceTypesOfObjectSchema:    
-                if referenceTypeOfObjectSchema == referenceType['name']:
-                    createReference = False
-                    continue
-            if createReference:
-                # No reference type exists for this object schema
-                description = referenceType.get('description') if referenceType.get('description') else ""
-                logging.info(f"Create reference type '{referenceType['name']}'")
-                myAssets.createReferenceType(referenceType['name'], referenceType['color'], description, newObjectSchema['id'])
-        # Reload all known reference types
-        referenceTypes = myAssets.getAllReferenceTypes(True)        
+            # Load object schema
+            objectSchema = assets.loadJson(importDataPath+'/config/objectschema.json')
+
+            # Create schema
+            newObjectSchema = myAssets.getObjectSchemaByKey(objectSchemaInfo['newObjectSchemaKey'])
+            if not newObjectSchema:
+                logging.info(f"Create object schema '{objectSchemaInfo['newObjectSchemaName']}'")
+                description = objectSchema['description'] if objectSchema.get('description') else ""
+                newObjectSchema = myAssets.createObjectSchema(objectSchemaInfo['newObjectSchemaName'], objectSchemaInfo['newObjectSchemaKey'], description)
+
+            # Load object schemas translation for referenced objects
+            objectSchemaIdTranslate = getObjectSchemaIdTranslation(objectSchemaInfo, folder)
+
+            # Load object schema properties
+            objectSchemaProperties = assets.loadJson(importDataPath+'/config/objectschema_properties.json')
+            if objectSchemaProperties:
+                logging.info(f"Set object schema properties")
+                myAssets.updateObjectSchemaProperties(newObjectSchema['id'], objectSchemaProperties['allowOtherObjectSchema'],objectSchemaProperties['createObjectsCustomField'],objectSchemaProperties['quickCreateObjects'],objectSchemaProperties['serviceDescCustomersEnabled'],objectSchemaProperties['validateQuickCreate'])
+
+            # - create schema reference types
+            referenceTypes = assets.loadJson(importDataPath+'/config/referencetypes.json')
+            referenceTypeNamesOfObjectSchema = [referenceTypeOfObjectSchema.get('name') for referenceTypeOfObjectSchema in myAssets.getReferenceTypes(newObjectSchema['id'])]
+            for referenceType in referenceTypes:
+                if referenceType['name'] not in referenceTypeNamesOfObjectSchema:
+                    # No reference type exists for this object schema
+                    description = referenceType.get('description') if referenceType.get('description') else ""
+                    logging.info(f"Create reference type '{referenceType['name']}'")
+                    myAssets.createReferenceType(referenceType['name'], referenceType['color'], description, newObjectSchema['id'])
         
-        # - create schema status types
-        statusTypes = assets.loadJson(importDataPath+'/config/statustypes.json')
-        for statusType in statusTypes:
-            newStatusType = myAssets.getStatusTypeByName(statusType['name'])
-            if not newStatusType:
-                # The status type does not exists  
-                logging.info(f"Create status type '{statusType['name']}'")
-                newStatusType = myAssets.createStatusType(statusType['name'], statusType['category'], statusType['description'], newObjectSchema['id'])
-            statusTypeIdTranslate[statusType['id']]=newStatusType['id']
-        # Reload    
-        # - create schema object types
-        # Load  the list and order them by level
-        objectTypes = orderObjectTypes(assets.loadJson(importDataPath+'/config/objecttypes.json'))
-        objectTypeIdTranslate={}
-        newObjectTypes={}
-
-        for objectType in objectTypes:
-            # Check if object type exists
-            parentOTid = None
-            if objectType.get('parentObjectTypeId'):
-                # Root objectypes have no parent object id
-                parentOTid = objectTypeIdTranslate.get(objectType.get('parentObjectTypeId'))
-            newObjectType = myAssets.getObjectTypeByName(objectType['name'], newObjectSchema['id'], parentOTid, True)
-            if not newObjectType:
-                data = {
-                    'objectSchemaId': newObjectSchema['id'],
-                    'name': objectType['name'],
-                    'iconId': objectType['icon']['id']            
-                }
-                if objectType.get('description'):
-                    data['description'] = objectType['description']
-                if objectType.get('inherited'):
-                    data['inherited'] = objectType['inherited']
-                if objectType.get('abstractObjectType'):
-                    data['abstractObjectType'] = objectType['abstractObjectType']
+            # - create schema status types
+            statusTypes = assets.loadJson(importDataPath+'/config/statustypes.json')
+            for statusType in statusTypes:
+                # A status type of this object schema or a global one
+                newStatusType = myAssets.getStatusTypeByName(statusType['name'], objectSchemaId=newObjectSchema['id'])
+                if not newStatusType:
+                    # The status type does not exists  
+                    logging.info(f"Create status type '{statusType['name']}'")
+                    newStatusType = myAssets.createStatusType(statusType['name'], statusType['category'], statusType['description'], newObjectSchema['id'])
+                statusTypeIdTranslate[statusType['id']]=newStatusType['id']
+            # Reload    
+            # - create schema object types
+            # Load  the list and order them by level
+            objectTypes = orderObjectTypes(assets.loadJson(importDataPath+'/config/objecttypes.json'))
+            objectTypeIdTranslate={}
+            newObjectTypes={}
+
+            for objectType in objectTypes:
+                # Check if object type exists
+                parentOTid = None
                 if objectType.get('parentObjectTypeId'):
-                    if not objectType['parentObjectTypeId']=='0':
-                        data['parentObjectTypeId'] = objectTypeIdTranslate[objectType['parentObjectTypeId']]
+                    # Root objectypes have no parent object id
+                    parentOTid = objectTypeIdTranslate.get(objectType.get('parentObjectTypeId'))
+                newObjectType = myAssets.getObjectTypeByName(objectType['name'], newObjectSchema['id'], parentOTid, True)
+                if not newObjectType:
+                    data = {
+                        'objectSchemaId': newObjectSchema['id'],
+                        'name': objectType['name'],
+                        'iconId': objectType['icon']['id']            
+                    }
+                    if objectType.get('description'):
+                        data['description'] = objectType['description']
+                    if objectType.get('inherited'):
+                        data['inherited'] = objectType['inherited']
+                    if objectType.get('abstractObjectType'):
+                        data['abstractObjectType'] = objectType['abstractObjectType']
+                    if objectType.get('parentObjectTypeId'):
+                        if not objectType['parentObjectTypeId']=='0':
+                            data['parentObjectTypeId'] = objectTypeIdTranslate[objectType['parentObjectTypeId']]
                 
-                # Create the object type
-                logging.info(f"Create object type '{objectType['name']}'")
-                newObjectType = myAssets.createObjectType(data)
+                    # Create the object type
+                    logging.info(f"Create object type '{objectType['name']}'")
+                    newObjectType = myAssets.createObjectType(data)
                 
-            # Add objecttype id to translation dict
-            objectTypeIdTranslate[objectType['id']]=newObjectType['id']
-            newObjectTypes[newObjectType['id']]=newObjectType
+                # Add objecttype id to translation dict
+                objectTypeIdTranslate[objectType['id']]=newObjectType['id']
+                newObjectTypes[newObjectType['id']]=newObjectType
             
-        for objectType in objectTypes:
-            # Reposition of object type
-            if objectType.get('parentObjectTypeId'):
-                myAssets.changeObjectTypePosition(objectTypeIdTranslate.get((objectType['id'])), objectTypeIdTranslate.get((objectType['parentObjectTypeId'])), objectType['position'])
-
-        newObjectTypes = myAssets.getObjectTypes(newObjectSchema['id'], False, True)
-        newObjectTypes.sort(key=lambda x: x['id']) # Sort the object types list
-        attributeIdTranslate={}
+            for objectType in objectTypes:
+                # Reposition of object type
+                if objectType.get('parentObjectTypeId'):
+                    myAssets.changeObjectTypePosition(objectTypeIdTranslate.get((objectType['id'])), objectTypeIdTranslate.get((objectType['parentObjectTypeId'])), objectType['position'])
+
+            # The object types were fetched again after they were created and moved
+            newObjectTypes = list(myAssets.getObjectTypes(newObjectSchema['id']) or [])
+            newObjectTypes.sort(key=lambda x: x['id']) # Sort the object types list
+            attributeIdTranslate={}
         
-        for newObjectType in newObjectTypes:
-            # Create attributes for object type
-            oldOjbectTypeId = ''
-            for oldId, newId in objectTypeIdTranslate.items():
-                if newId == newObjectType['id']:
-                    oldOjbectTypeId = oldId
-                    break
-            fn = f"{newObjectType['name']}_{oldOjbectTypeId}"
-            fn = fn.replace("/","_") # if a slash '/' is in the name turn it into a underscore '_'
-            fn = fn.replace("\\","_") # if a backslash '\' is in the name turn it into a underscore '_'
-            jsonfile = f"config/attributes/{fn}.json"
-            jsonfile = jsonfile.replace(" ", '_')      
-            jsonfile = f"{importDataPath}/{jsonfile}"
-
-            if not os.path.exists(jsonfile):
-                # Catch upstream logic bug where author makes assumptions of what was exported. TODO: For RCI when we have time.
-                logging.warning(f"BUG Missing attribute type in backup: name={newObjectType['name']}, "
-                                f"id={oldOjbectTypeId} (expected file to exist: {jsonfile}). Skipping")
-                continue
+            for newObjectType in newObjectTypes:
+                # Create attributes for object type
+                oldOjbectTypeId = ''
+                for oldId, newId in objectTypeIdTranslate.items():
+                    if newId == newObjectType['id']:
+                        oldOjbectTypeId = oldId
+                        break
+                if restoreObjectTypeIds is not None and oldOjbectTypeId not in restoreObjectTypeIds:
+                    # No objects of this object type are restored
+                    continue
+                fn = f"{newObjectType['name']}_{oldOjbectTypeId}"
+                fn = fn.replace("/","_") # if a slash '/' is in the name turn it into a underscore '_'
+                fn = fn.replace("\\","_") # if a backslash '\' is in the name turn it into a underscore '_'
+                jsonfile = f"config/attributes/{fn}.json"
+                jsonfile = jsonfile.replace(" ", '_')      
+                jsonfile = f"{importDataPath}/{jsonfile}"
+
+                if not os.path.exists(jsonfile):
+                    # Catch upstream logic bug where author makes assumptions of what was exported. TODO: For RCI when we have time.
+                    logging.warning(f"BUG Missing attribute type in backup: name={newObjectType['name']}, "
+                                    f"id={oldOjbectTypeId} (expected file to exist: {jsonfile}). Skipping")
+                    continue
 
-            attributes = assets.loadJson(jsonfile)
-            newAttributes=[]
+                attributes = assets.loadJson(jsonfile)
+                newAttributes=[]
 
-            # Not threaded for debugging
-            # for attribute in attributes:
-            #     attribute, newAttribute = createObjectAttribute(newObjectType, attribute, objectSchemaIdTranslate)
+                # Not threaded for debugging
+                # for attribute in attributes:
+                #     attribute, newAttribute = createObjectAttribute(newObjectType, attribute, objectSchemaIdTranslate)
                 
-            #     if newAttribute:
-            #         attributeIdTranslate[attribute['id']]=newAttribute['id']
-            #         newAttributes.append(newAttribute)
-
-            # start the thread pool
-            with ThreadPoolExecutor(maxThreads) as executor:
-                # submit tasks and collect futures
-                futures = [executor.submit(createObjectAttribute, newObjectType, attribute, objectSchemaIdTranslate) for attribute in attributes]
-                # process task results as they are available
-                for future in as_completed(futures):
-                    # retrieve the result
-                    if future:
-                        attribute, newAttribute = future.result()
-                        if newAttribute:
-                            attributeIdTranslate[attribute['id']]=newAttribute['id']
-                            newAttributes.append(newAttribute)
+                #     if newAttribute:
+                #         attributeIdTranslate[attribute['id']]=newAttribute['id']
+                #         newAttributes.append(newAttribute)
+
+                # start the thread pool
+                with ThreadPoolExecutor(myAssets.concurrency.maxLimit) as executor:
+                    # submit tasks and collect futures
+                    futures = [executor.submit(createObjectAttribute, newObjectType, attribute, objectSchemaIdTranslate) for attribute in attributes]
+                    # process task results as they are available
+                    for future in as_completed(futures):
+                        # retrieve the result
+                        if future:
+                            attribute, newAttribute = future.result()
+                            if newAttribute:
+                                attributeIdTranslate[attribute['id']]=newAttribute['id']
+                                newAttributes.append(newAttribute)
                           
-            # set the correct position of the attribute
-            newAttributesList = sorted(newAttributes, key=lambda d: (d['position'] * -1)) 
-            for attribute in newAttributesList:
-                logging.info(f"  Attribute {attribute['name']} set to position {attribute['position']} for {newObjectType['name']}")    
-                myAssets.moveObjectTypeAttribute(newObjectType['id'], attribute['id'], attribute['position'])
-            logging.info(f"Attributes ordered for {newObjectType['name']}")
-
-        # - create objects without attributes (only labels)
-        # This is done to be able to refer to objects in attributes.
-        newObjects = {}
-        if processObjects:
-            for filename in os.listdir(f'{importDataPath}/objectsmeta'):
-                if filename.endswith('.json'):
-                    jsonfile = f'{importDataPath}/objectsmeta/{filename}'
-                    jsonfile = jsonfile.replace(" ", '_')      
-                    objects = assets.loadJson(jsonfile)
-
-                    # start the thread pool
-                    with ThreadPoolExecutor(maxThreads) as executor:
-                        # submit tasks and collect futures
-                        futures = [executor.submit(createObject, objectTypeIdTranslate.get(object['objectType']['id']), object) for object in objects]
+                # set the correct position of the attribute
+                newAttributesList = sorted(newAttributes, key=lambda d: (d['position'] * -1)) 
+                for attribute in newAttributesList:
+                    logging.info(f"  Attribute {attribute['name']} set to position {attribute['position']} for {newObjectType['name']}")    
+                    myAssets.moveObjectTypeAttribute(newObjectType['id'], attribute['id'], attribute['position'])
+                logging.info(f"Attributes ordered for {newObjectType['name']}")
+
+            # - create objects without attributes (only labels)
+            # This is done to be able to refer to objects in attributes.
+            newObjects = {}
+            if processObjects:
+                for filename in os.listdir(f'{importDataPath}/objectsmeta'):
+                    if filename.endswith('.json'):
+                        jsonfile = f'{importDataPath}/objectsmeta/{filename}'
+                        jsonfile = jsonfile.replace(" ", '_')      
+                        objects = assets.loadJson(jsonfile)
+                        if restoreObjectIds is not None:
+                            objects = [object for object in objects if object['id'] in restoreObjectIds]
+
                         # process task results as they are available
-                        for future in as_completed(futures):
-                            # retrieve the result
-                            # if not future:
-                            #     a = future.result()
-                            oldObject, newObject = future.result()
+                        for oldObject, newObject in runTasks(createObject, createObjectAsync, [(objectTypeIdTranslate.get(object['objectType']['id']), object) for object in objects]):
                             if newObject:
                                 if 'errorMessages' in newObject:
                                     logging.warning(f"Object '{oldObject.get('label')}'of type '{oldObject['objectType']['name']}' could not be created")
@@ -601,20 +844,21 @@ try:
                                     continue
                                 objectIdTranslate[oldObject['id']]=newObject['id']
                                 newObjects[newObject['id']]=newObject
+                                journalCreatedObject(oldObject, newObject, objectTypeIdTranslate.get(oldObject['objectType']['id']), objectSchemaInfo)
 
-            # - Update the object with attribute values            
-            for filename in os.listdir(f'{importDataPath}/objects'):
-                if filename.endswith('.json'):
-                    jsonfile = f'{importDataPath}/objects/{filename}'
-                    jsonfile = jsonfile.replace(" ", '_')      
-                    objects = assets.loadJson(jsonfile)
+                # - Update the object with attribute values            
+                for filename in os.listdir(f'{importDataPath}/objects'):
+                    if filename.endswith('.json'):
+                        jsonfile = f'{importDataPath}/objects/{filename}'
+                        jsonfile = jsonfile.replace(" ", '_')      
+                        objects = assets.loadJson(jsonfile)
 
-                    # start the thread pool
-                    with ThreadPoolExecutor(maxThreads) as executor:
                         # Verify original author's precondition assumptions, and allow other restore steps to
                         # continue if those are invalid, so as to not get a complete recovery failure.
-                        futures = []
+                        updates = []
                         for objectId, obj in objects.items():
+                            if restoreObjectIds is not None and objectId not in restoreObjectIds:
+                                continue
                             if objectId not in objectIdTranslate:
                                 logging.warning(f'BUG Missing objectId={objectId} in objectIdTranslate')
                                 continue
@@ -635,82 +879,83 @@ try:
                                 continue
 
                             newObjectId = newObject['objectType']['id']
-                            futures.append(executor.submit(updateObjectByObjectTypeId, translatedId, newObjectId, obj))
+                            updates.append((translatedId, newObjectId, obj))
                         # END author assumption validation
 
-                        # Update the object
-                        # submit tasks and collect futures
-                        #futures = [executor.submit(updateObjectByObjectTypeId, objectIdTranslate[objectId], newObjects[objectIdTranslate[objectId]]['objectType']['id'], objects[objectId]) for objectId in objects]
+                        # The keys of the referenced objects that were not created by this run are looked up at once
+                        myAssets.resolveObjectKeys(objectId for update in updates for objectId in getReferencedObjectIds(update[2]))
 
-                        # process task results as they are available
-                        for future in as_completed(futures):
-                            
-                            # retrieve the result
-                            newObject = future.result()
+                        # Update the objects and process task results as they are available
+                        for newObject in runTasks(updateObjectByObjectTypeId, updateObjectByObjectTypeIdAsync, updates):
                             if newObject:
                                 if newObject.get('id'):
                                     newObjects[newObject['id']]=newObject
                                     logging.info(f"Updated: {newObject['name']}")
 
-            # - add comments to objects
-            if processComments:
-                logging.info("Start restoring comments")
-                if isdir(f'{importDataPath}/objects/comments'):
-                    with ThreadPoolExecutor(maxThreads) as executor:
-                        futures = [executor.submit(addComment, f'{importDataPath}/objects/comments/{filename}', objectIdTranslate) for filename in os.listdir(f'{importDataPath}/objects/comments')]
-                        # process task results as they are available
-                        for future in as_completed(futures):
-                            commentResponse = future.result()
-                    logging.info(f"Comments created")
-
-            # - add history to objects
-            if processHistory:
-                logging.info("Start restoring history")
-                if isdir(f'{importDataPath}/objects/history'):
-                    with ThreadPoolExecutor(maxThreads) as executor:
-                        futures = [executor.submit(addHistoryasComment, f'{importDataPath}/objects/history/{filename}', objectIdTranslate) for filename in os.listdir(f'{importDataPath}/objects/history')]
-                        # process task results as they are available
-                        for future in as_completed(futures):
-                            historyResponse = future.result()
-                    logging.info(f"History comments created")
+                # - add comments to objects
+                if processComments:
+                    logging.info("Start restoring comments")
+                    if isdir(f'{importDataPath}/objects/comments'):
+                        for commentResponse in runTasks(addComment, addCommentAsync, ((comments, objectIdTranslate) for comments in iterBackupRecords(f'{importDataPath}/objects/comments', restoreRecordObjectIds))):
+                            pass
+                        logging.info(f"Comments created")
+
+                # - add history to objects
+                if processHistory:
+                    logging.info("Start restoring history")
+                    if isdir(f'{importDataPath}/objects/history'):
+                        for historyResponse in runTasks(addHistoryasComment, addHistoryasCommentAsync, ((history, objectIdTranslate) for history in iterBackupRecords(f'{importDataPath}/objects/history', restoreRecordObjectIds))):
+                            pass
+                        logging.info(f"History comments created")
                 
-            # - add restrictions to attributes
-            if setAttributeRestrictions:
-                for newObjectType in newObjectTypes:
-                    oldOjbectTypeId = ''
-                    for oldId, newId in objectTypeIdTranslate.items():
-                        if newId == newObjectType['id']:
-                            oldOjbectTypeId = oldId
-                            break
-                    # Create attributes for object type
-                    fn = f"{newObjectType['name']}_{oldOjbectTypeId}"
-                    fn = fn.replace("/","_") # if a slash '/' is in the name turn it into a underscore '_'
-                    fn = fn.replace("\\","_") # if a backslash '\' is in the name turn it into a underscore '_'
-                    jsonfile = f"{importDataPath}/config/attributes/{fn}.json"
-                    jsonfile = jsonfile.replace(" ", '_')      
+                # - add restrictions to attributes
+                if setAttributeRestrictions:
+                    for newObjectType in newObjectTypes:
+                        oldOjbectTypeId = ''
+                        for oldId, newId in objectTypeIdTranslate.items():
+                            if newId == newObjectType['id']:
+                                oldOjbectTypeId = oldId
+                                break
+                        # Create attributes for object type
+                        if restoreObjectTypeIds is not None and oldOjbectTypeId not in restoreObjectTypeIds:
+                            continue
+                        fn = f"{newObjectType['name']}_{oldOjbectTypeId}"
+                        fn = fn.replace("/","_") # if a slash '/' is in the name turn it into a underscore '_'
+                        fn = fn.replace("\\","_") # if a backslash '\' is in the name turn it into a underscore '_'
+                        jsonfile = f"{importDataPath}/config/attributes/{fn}.json"
+                        jsonfile = jsonfile.replace(" ", '_')      
                 
-                    if not os.path.exists(jsonfile):
-                        # Catch upstream logic bug where author makes assumptions of what was exported. TODO: For RCI when we have time.
-                        logging.warning(f"BUG Missing attribute restriction in backup: name={newObjectType['name']}, "
-                                        f"id={oldOjbectTypeId} (expected file to exist: {jsonfile}). Skipping")
-                        continue
-
-                    attributes = assets.loadJson(jsonfile)
-                    with ThreadPoolExecutor(maxThreads) as executor:
-                        futures = [executor.submit(updateAttributeType, newObjectType, attribute, attributeIdTranslate) for attribute in attributes]
-                        # process task results as they are available
-                        for future in as_completed(futures):
-                            updatedAttribute = future.result()
-                            logging.info(f"Attribute {updatedAttribute.get('name')} updated")
-
-except KeyboardInterrupt:
-    # handle Ctrl-C
-    logging.warn("Cancelled by user")
-except Exception as ex:
-    # handle unexpected script errors
-    logging.exception("Unhandled error\n{}".format(ex))
-    raise
-finally:
-    assets.saveAsJson(objectIdTranslate, "createdObjects",folder)
-    logging.info("------------End of Run------------")
-    logging.shutdown()
\ No newline at end of file
+                        if not os.path.exists(jsonfile):
+                            # Catch upstream logic bug where author makes assumptions of what was exported. TODO: For RCI when we have time.
+                            logging.warning(f"BUG Missing attribute restriction in backup: name={newObjectType['name']}, "
+                                            f"id={oldOjbectTypeId} (expected file to exist: {jsonfile}). Skipping")
+                            continue
+
+                        attributes = assets.loadJson(jsonfile)
+                        with ThreadPoolExecutor(myAssets.concurrency.maxLimit) as executor:
+                            futures = [executor.submit(updateAttributeType, newObjectType, attribute, attributeIdTranslate) for attribute in attributes]
+                            # process task results as they are available
+                            for future in as_completed(futures):
+                                updatedAttribute = future.result()
+                                logging.info(f"Attribute {updatedAttribute.get('name')} updated")
+
+    except KeyboardInterrupt:
+        # handle Ctrl-C
+        logging.warn("Cancelled by user")
+    except Exception as ex:
+        # handle unexpected script errors
+        logging.exception("Unhandled error\n{}".format(ex))
+        raise
+    finally:
+        if createdObjectsJournal:
+            createdObjectsJournal.close()
+        if folder:
+            assets.saveAsJson(objectIdTranslate, "createdObjects",folder)
+        if myAsyncAssets:
+            eventLoop.run_until_complete(myAsyncAssets.close())
+            eventLoop.close()
+        if myAssets:
+            logging.info(f"Requests: {myAssets.getRequestStats()}")
+            myAssets.close()
+        logging.info("------------End of Run------------")
+        logging.shutdown()
\ No newline at end of file
@@ -0,0 +1,63 @@
+import os, sys, optparse, assets, logging, logging.handlers
+from assetsQuery import backupQuery
+
+# Script settings 
+logFileKeep = 10 # Number of days to keep the logfiles, before being rotated
+logFile = os.path.dirname(os.path.abspath(__file__))+"/query.log"
+
+# Debug level
+fileFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+handler = logging.handlers.TimedRotatingFileHandler(logFile, when="midnight", backupCount=logFileKeep)
+handler.setFormatter(fileFormatter)
+fileLogger = logging.getLogger()
+fileLogger.addHandler(handler)
+fileLogger.setLevel(logging.INFO)
+
+# define a Handler which writes INFO messages or higher to the sys.stderr
+consoleLogger = logging.StreamHandler()
+consoleLogger.setLevel(logging.INFO)
+consoleFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+# tell the handler to use this format
+consoleLogger.setFormatter(consoleFormatter)
+# add the handler to the root logger
+logging.getLogger().addHandler(consoleLogger)
+logging.info("-----------Start of Run-----------")    
+
+# Run an IQL query on a backup folder or zip file, without connecting to the site
+# Usage: python queryBackup.py -b <backup folder or zip file> -q "<iql>" [-o <result file>]
+parser = optparse.OptionParser(usage='%prog -b backup -q "iql" [-o result.json]')
+parser.add_option("-b",
+                dest = "backup",
+                help = "Backup folder or zip file")
+parser.add_option("-q",
+                dest = "iql",
+                help = "IQL query, e.g. objectType = Laptops and Owner.Name like john")
+parser.add_option("-o",
+                dest = "output",
+                help = "Save the objects and their data in this JSON file")
+commandlineOptions, args = parser.parse_args()
+if not commandlineOptions.backup or not commandlineOptions.iql:
+    parser.print_help()
+    sys.exit(1)
+if not os.path.exists(commandlineOptions.backup):
+    logging.error(f"ERROR: the backup '{commandlineOptions.backup}' doesn't exist!")
+    sys.exit(1)
+
+query = backupQuery(commandlineOptions.backup)
+try:
+    objects = query.getObjects(commandlineOptions.iql)
+except ValueError as e:
+    logging.error(f"ERROR: {e}")
+    sys.exit(1)
+
+for object in objects:
+    print(f"{object.get('objectKey', '')}\t{object.get('objectType', {}).get('name', '')}\t{object.get('label', '')}")
+logging.info(f"{len(objects)} objects found")
+
+if commandlineOptions.output:
+    result = [{'object': object, 'data': query.getObjectData(object['id'])} for object in objects]
+    output = os.path.abspath(commandlineOptions.output)
+    assets.saveAsJson(result, os.path.splitext(os.path.basename(output))[0], os.path.dirname(output))
+
+logging.info("------------End of Run------------")
+logging.shutdown()
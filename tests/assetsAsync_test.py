@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import asyncio
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import assets
+import assetsAsync
+
+# Mock calls to atlassian API so we can test without side-effects
+assets.assetsConnect.getWorkspaceId = MagicMock(
+    return_value="fake-workspace-id")
+
+
+class fakeResult():
+    # The parts of an aiohttp response that assetsAsyncConnect uses, as an async context manager like session.request
+    def __init__(self, status, text='{}', headers=None, delay=0):
+        self.status = status
+        self.headers = headers or {}
+        self.body = text
+        self.delay = delay
+
+    async def text(self):
+        await asyncio.sleep(self.delay)
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class asyncClientTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.connect = assets.assetsConnect("jiraUrl", "username", "apiToken", backoffBase=0.01, maxRetries=3,
+                                            minConcurrency=2, maxConcurrency=2)
+
+    async def asyncSetUp(self):
+        self.client = await assetsAsync.assetsAsyncConnect(self.connect, maxInFlight=10).open()
+        await self.client.session.close()
+        self.client.session = MagicMock(close=AsyncMock())
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+
+class TestAsyncRetry(asyncClientTest):
+
+    async def test_retry_on_throttle(self):
+        self.client.session.request = MagicMock(side_effect=[
+            fakeResult(429, headers={'Retry-After': '0.05'}),
+            fakeResult(503),
+            fakeResult(200, '{"id": "1"}')])
+        self.assertEqual({'id': '1'}, await self.client.assetsGet("url"))
+        stats = self.connect.getRequestStats()
+        self.assertEqual(3, stats['requests'])
+        self.assertEqual(2, stats['retries'])
+        self.assertEqual(1, stats['retries_429'])
+        self.assertEqual(1, stats['retries_503'])
+        self.assertEqual(0, self.client.concurrency.inFlight)
+
+    async def test_post_not_retried(self):
+        self.client.session.request = MagicMock(return_value=fakeResult(500, ''))
+        self.assertIsNone(await self.client.assetsPost("url", {}))
+        # A POST may have been processed already when the response was cut off
+        self.client.session.request = MagicMock(side_effect=assetsAsync.aiohttp.ClientPayloadError("cut off"))
+        self.assertIsNone(await self.client.assetsPost("url", {}))
+        self.assertEqual(1, self.client.session.request.call_count)
+        self.assertEqual(0, self.client.concurrency.inFlight)
+
+    async def test_retry_on_payload_error(self):
+        self.client.session.request = MagicMock(side_effect=[
+            assetsAsync.aiohttp.ClientPayloadError("cut off"),
+            fakeResult(200, '{"id": "1"}')])
+        self.assertEqual({'id': '1'}, await self.client.assetsGet("url"))
+        self.assertEqual(0, self.client.concurrency.inFlight)
+
+    async def test_give_up_after_max_retries(self):
+        self.client.session.request = MagicMock(return_value=fakeResult(502))
+        self.assertIsNone(await self.client.assetsGet("url"))
+        self.assertEqual(4, self.client.session.request.call_count)
+        self.assertEqual(1, self.connect.getRequestStats()['failed'])
+
+    async def test_throttle_decreases_limit(self):
+        self.client.concurrency.limit = 8.0
+        self.client.session.request = MagicMock(side_effect=[fakeResult(429), fakeResult(200, '{"id": "1"}')])
+        self.assertEqual({'id': '1'}, await self.client.assetsGet("url"))
+        self.assertEqual(4, self.client.concurrency.getLimit())
+
+    async def record(self, count):
+        # Send count requests at once, returns the number of requests in flight seen by each of them
+        inFlight = []
+
+        def request(method, query, **kwargs):
+            inFlight.append(self.client.concurrency.inFlight)
+            return fakeResult(200, '{"id": "1"}', delay=0.01)
+        self.client.session.request = MagicMock(side_effect=request)
+        results = await asyncio.gather(*[self.client.assetsGet("url") for _ in range(count)])
+        self.assertEqual([{'id': '1'}]*count, results)
+        self.assertEqual(0, self.client.concurrency.inFlight)
+        return inFlight
+
+    async def test_in_flight_limited_by_controller(self):
+        self.client.concurrency.maxLimit = 2
+        self.assertEqual(2, max(await self.record(10)))
+
+    async def test_more_in_flight_than_sync_connection(self):
+        # The limit of the async client goes up to maxInFlight, not to the maxConcurrency of the connection
+        self.assertEqual(10, self.client.concurrency.maxLimit)
+        self.client.concurrency.limit = 10.0
+        self.assertEqual(10, max(await self.record(20)))
+        self.assertGreater(10, self.connect.concurrency.maxLimit)
+        self.assertEqual(0, self.connect.concurrency.inFlight)
+
+class TestAsyncPagination(asyncClientTest):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.client.assetsUrl = "url"
+
+        def request(method, query, **kwargs):
+            number = int(query.split('&page=')[1]) if '&page=' in query else 1
+            page = {'iqlSearchResult': True, 'pageNumber': number, 'pageSize': 3, 'totalFilterCount': 5,
+                    'pageObjectSize': 2, 'objectEntries': [{'id': f'{number}-{i}'} for i in range(2 if number < 3 else 1)]}
+            # Later pages answer first
+            return fakeResult(200, json.dumps(page), delay=0.01*(4-number))
+        self.client.session.request = MagicMock(side_effect=request)
+
+    async def test_all_pages_in_order(self):
+        objects = await self.client.getObjects("objectTypeId=1")
+        self.assertEqual(['1-0', '1-1', '2-0', '2-1', '3-0'], [object['id'] for object in objects])
+        self.assertEqual(3, self.client.session.request.call_count)
+
+    async def test_failed_page(self):
+        first = {'iqlSearchResult': True, 'pageNumber': 1, 'pageSize': 2, 'objectEntries': []}
+        self.client.session.request = MagicMock(side_effect=[fakeResult(200, json.dumps(first)), fakeResult(400, '')])
+        self.assertIsNone(await self.client.getObjects("objectTypeId=1"))
+        self.assertEqual(0, self.client.concurrency.inFlight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import assets
+from assetsQuery import backupQuery, iqlParser
+
+
+def entry(id, label, objectType):
+    return {'id': id, 'label': label, 'objectKey': f'IT-{id}', 'objectType': {'id': objectType[0], 'name': objectType[1]},
+            'created': '2022-01-01T10:00:00.000Z', 'updated': f'2022-0{id}-01T10:00:00.000Z'}
+
+
+class TestBackupQuery(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.saveBackup(cls.folder)
+        cls.query = backupQuery(cls.folder)
+
+    @classmethod
+    def saveBackup(cls, folder, store=None):
+        laptops, people = ('1', 'Laptops'), ('2', 'People')
+        assets.saveAsJson([entry('1', 'Laptop 1', laptops), entry('2', 'Laptop 2', laptops), entry('3', 'Laptop 3', laptops)], "Laptops_1", folder+"/IT/objectsmeta", store=store)
+        assets.saveAsJson([entry('4', 'John', people), entry('5', 'Mary', people)], "People_2", folder+"/IT/objectsmeta", store=store)
+        assets.saveAsJson({
+            '1': {'Name': 'Laptop 1', 'Price': 900, 'Owner': {'displayValue': 'John', 'searchValue': 'IT-4'}},
+            '2': {'Name': 'Laptop 2', 'Price': 1500, 'Owner': [{'displayValue': 'Mary', 'searchValue': 'IT-5'}]},
+            '3': {'Name': 'Laptop 3'}}, "Laptops_1", folder+"/IT/objects", store=store)
+        assets.saveAsJson({
+            '4': {'Name': 'John', 'Department': 'Sales'},
+            '5': {'Name': 'Mary', 'Department': 'IT'}}, "People_2", folder+"/IT/objects", store=store)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def ids(self, iql):
+        return [object['id'] for object in self.query.getObjects(iql)]
+
+    def test_equality(self):
+        self.assertEqual(['1'], self.ids('Name = "laptop 1"'))
+        self.assertEqual([], self.ids('Name == "laptop 1"'))
+        self.assertEqual(['4'], self.ids('objectType = People and label != Mary'))
+        self.assertEqual(['2'], self.ids('Key = IT-2'))
+
+    def test_ranges_in_and_like(self):
+        self.assertEqual(['2'], self.ids('Price > 1000'))
+        self.assertEqual(['1', '2'], self.ids('Price >= 900 and Price <= 1500'))
+        self.assertEqual(['4', '5'], self.ids('updated >= "2022-04-01"'))
+        self.assertEqual(['1', '3'], self.ids('Name in ("Laptop 1", "Laptop 3")'))
+        self.assertEqual(['4'], self.ids('objectTypeId = 2 and Name not in (Mary)'))
+        self.assertEqual(['1', '2', '3'], self.ids('Name like LAPTOP'))
+        self.assertEqual(['3'], self.ids('objectType = Laptops and Owner is empty'))
+
+    def test_references(self):
+        self.assertEqual(['1'], self.ids('Owner = John'))
+        self.assertEqual(['2'], self.ids('Owner = IT-5'))
+        self.assertEqual(['1'], self.ids('Owner.Department = Sales'))
+        self.assertEqual(['1', '2'], self.ids('(Owner.Name = John or Owner.Name = Mary) and not Name = "Laptop 3"'))
+
+    def test_referenced_objects(self):
+        self.assertEqual({'4', '5'}, self.query.getReferencedObjects({'1', '2', '3'}))
+        self.assertEqual(set(), self.query.getReferencedObjects({'4'}))
+        self.assertEqual('IT', self.query.getObjectSchemaKey('4'))
+
+    def test_order_by(self):
+        self.assertEqual(['2', '1', '3'], self.ids('objectType = Laptops order by Price desc'))
+
+    def test_syntax_error(self):
+        with self.assertRaises(ValueError):
+            iqlParser('Name = ').parse()
+        with self.assertRaises(ValueError):
+            iqlParser('Name in (a, b').parse()
+
+
+class TestDatabaseQuery(TestBackupQuery):
+    # The same queries on the SQLite database of the backup, without the files
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        database = assets.backupDatabase(cls.folder+"/backup.sqlite", cls.folder)
+        cls.saveBackup(cls.folder+"/run", database)
+        database.commit("run")
+        database.close()
+        shutil.rmtree(cls.folder+"/run")
+        cls.query = backupQuery(cls.folder+"/backup.sqlite")
@@ -0,0 +1,638 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+import threading
+from unittest.mock import patch, MagicMock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import assets
+
+# Mock calls to atlassian API so we can test without side-effects
+assets.assetsConnect.getWorkspaceId = MagicMock(
+    return_value="fake-workspace-id")
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_burst_is_free(self):
+        limiter = assets.rateLimiter(60, 5)
+        for _ in range(5):
+            self.assertEqual(0.0, limiter.reserve())
+
+    def test_requests_are_spread(self):
+        # 600 requests per minute = 1 token every 0.1s
+        limiter = assets.rateLimiter(600, 1)
+        self.assertEqual(0.0, limiter.reserve())
+        self.assertAlmostEqual(0.1, limiter.reserve(), delta=0.01)
+        self.assertAlmostEqual(0.2, limiter.reserve(), delta=0.01)
+
+    def test_thread_safe(self):
+        limiter = assets.rateLimiter(60000, 100)
+        waits = []
+
+        def worker():
+            for _ in range(50):
+                waits.append(limiter.reserve())
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 500 tokens taken, 100 from the burst: the last caller waits for ~400 refills
+        self.assertAlmostEqual(400/1000, max(waits), delta=0.05)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            assets.rateLimiter(0, 1)
+
+
+def fakeResponse(status, body='{}', headers=None):
+    response = MagicMock()
+    response.status_code = status
+    response.text = body
+    response.headers = headers or {}
+    response.json.side_effect = lambda: json.loads(body)
+    return response
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(assets.time, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken", backoffBase=0.01, maxRetries=3)
+
+    def test_retry_on_throttle(self):
+        self.client.session.request = MagicMock(side_effect=[
+            fakeResponse(429, headers={'Retry-After': '2'}),
+            fakeResponse(503),
+            fakeResponse(200, '{"id": "1"}')])
+        self.assertEqual({'id': '1'}, self.client.assetsGet("url"))
+        stats = self.client.getRequestStats()
+        self.assertEqual(3, stats['requests'])
+        self.assertEqual(2, stats['retries'])
+        self.assertEqual(1, stats['retries_429'])
+        self.assertEqual(1, stats['retries_503'])
+
+    def test_retry_after_header(self):
+        delay = self.client.retryDelay(0, fakeResponse(429, headers={'Retry-After': '2'}))
+        self.assertGreaterEqual(delay, 2)
+        self.assertLessEqual(delay, 2.01)
+
+    def test_fatal_status_is_not_retried(self):
+        self.client.session.request = MagicMock(return_value=fakeResponse(400, '{"errorMessages": ["bad"]}'))
+        self.assertEqual({'errorMessages': ['bad']}, self.client.assetsPost("url", {}))
+        self.assertEqual(1, self.client.session.request.call_count)
+
+    def test_post_not_retried_on_server_error(self):
+        self.client.session.request = MagicMock(return_value=fakeResponse(500, ''))
+        self.assertIsNone(self.client.assetsPost("url", {}))
+        self.assertEqual(1, self.client.session.request.call_count)
+
+    def test_give_up_after_max_retries(self):
+        self.client.session.request = MagicMock(return_value=fakeResponse(502))
+        self.assertIsNone(self.client.assetsGet("url"))
+        self.assertEqual(4, self.client.session.request.call_count)
+        self.assertEqual(1, self.client.getRequestStats()['failed'])
+
+    def test_slot_given_back_on_request_error(self):
+        client = assets.assetsConnect("jiraUrl", "username", "apiToken", minConcurrency=2, maxConcurrency=2)
+        client.session.request = MagicMock(side_effect=assets.requests.exceptions.TooManyRedirects("loop"))
+        for _ in range(3):
+            self.assertIsNone(client.assetsGet("url"))
+        self.assertEqual(0, client.concurrency.inFlight)
+        # Not retried, sending it again would fail the same way
+        self.assertEqual(3, client.session.request.call_count)
+
+    def test_retry_on_chunked_encoding_error(self):
+        self.client.session.request = MagicMock(side_effect=[
+            assets.requests.exceptions.ChunkedEncodingError("cut off"),
+            fakeResponse(200, '{"id": "1"}')])
+        self.assertEqual({'id': '1'}, self.client.assetsGet("url"))
+        self.assertEqual(0, self.client.concurrency.inFlight)
+        # A POST may have been processed already
+        self.client.session.request = MagicMock(side_effect=assets.requests.exceptions.ChunkedEncodingError("cut off"))
+        self.assertIsNone(self.client.assetsPost("url", {}))
+        self.assertEqual(1, self.client.session.request.call_count)
+        self.assertEqual(0, self.client.concurrency.inFlight)
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+    def test_additive_increase(self):
+        controller = assets.concurrencyController(2, 4)
+        for _ in range(20):
+            controller.acquire()
+            controller.release(0.1)
+        self.assertEqual(4, controller.getLimit())
+
+    def test_decrease_when_throttled(self):
+        controller = assets.concurrencyController(2, 32)
+        controller.limit = 16.0
+        controller.acquire()
+        controller.release(0.1, throttled=True)
+        self.assertEqual(8, controller.getLimit())
+        # Only one decrease per cooldown period
+        controller.acquire()
+        controller.release(0.1, throttled=True)
+        self.assertEqual(8, controller.getLimit())
+
+    def test_no_increase_without_rate_budget(self):
+        limiter = assets.rateLimiter(60, 1)
+        limiter.reserve()
+        controller = assets.concurrencyController(2, 32, limiter)
+        controller.acquire()
+        controller.release(0.1)
+        self.assertEqual(2, controller.getLimit())
+
+
+class TestObjectData(unittest.TestCase):
+
+    def test_object_data_from_iql_entry(self):
+        entry = {'id': '1', 'attributes': [
+            {'objectTypeAttributeId': '10', 'objectAttributeValues': [{'value': 'a', 'displayValue': 'a', 'referencedType': False}]},
+            {'objectTypeAttributeId': '11', 'objectAttributeValues': [
+                {'displayValue': 'Laptop 1', 'searchValue': 'IT-5', 'referencedType': True},
+                {'displayValue': 'Laptop 2', 'searchValue': 'IT-6', 'referencedType': True}]}]}
+        expected = {'Name': 'a', 'Laptops': [{'displayValue': 'Laptop 1', 'searchValue': 'IT-5'},
+                                             {'displayValue': 'Laptop 2', 'searchValue': 'IT-6'}]}
+        self.assertEqual(expected, assets.objectDataFromEntry(entry, {'10': 'Name', '11': 'Laptops'}))
+
+    def test_incomplete_iql_entry(self):
+        entry = {'id': '1', 'attributes': [{'objectTypeAttributeId': '12', 'objectAttributeValues': []}]}
+        self.assertIsNone(assets.objectDataFromEntry(entry, {'10': 'Name'}))
+        self.assertIsNone(assets.objectDataFromEntry({'id': '1'}, {'10': 'Name'}))
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken")
+        self.client.assetsUrl = "url"
+
+        def page(query):
+            number = int(query.split('&page=')[1]) if '&page=' in query else 1
+            return {'iqlSearchResult': True, 'pageNumber': number, 'pageSize': 3, 'totalFilterCount': 5,
+                    'pageObjectSize': 2, 'objectEntries': [{'id': f'{number}-{i}'} for i in range(2 if number < 3 else 1)]}
+        self.client.assetsGet = MagicMock(side_effect=page)
+
+    def test_all_pages_in_order(self):
+        objects = self.client.getObjects("objectTypeId=1")
+        self.assertEqual(['1-0', '1-1', '2-0', '2-1', '3-0'], [object['id'] for object in objects])
+
+    def test_iter_objects(self):
+        iterator = self.client.iterObjects("objectTypeId=1")
+        self.assertEqual({'id': '1-0'}, next(iterator))
+        self.assertEqual(5, 1+len(list(iterator)))
+
+    def test_failed_page(self):
+        self.client.assetsGet.side_effect = [{'iqlSearchResult': True, 'pageNumber': 1, 'pageSize': 2, 'objectEntries': []}, None]
+        self.assertIsNone(self.client.getObjects("objectTypeId=1"))
+
+
+class TestJiraDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken")
+        users = [{'accountId': str(i), 'displayName': f'User {i}', 'emailAddress': f'user{i}@example.com'} for i in range(2500)]
+        users.append({'accountId': 'x', 'displayName': '7'})
+        users.append({'accountId': 'y', 'displayName': 'User 1'})
+        groups = [{'name': f'group{i}', 'groupId': f'g-{i}'} for i in range(120)]
+
+        def page(query):
+            startAt = int(query.split('startAt=')[1].split('&')[0])
+            maxResults = int(query.split('maxResults=')[1])
+            if '/users/search' in query:
+                return users[startAt:startAt+maxResults]
+            return {'values': groups[startAt:startAt+maxResults], 'isLast': startAt+maxResults >= len(groups)}
+        self.client.assetsGet = MagicMock(side_effect=page)
+
+    def test_all_pages(self):
+        self.assertEqual(2502, len(self.client.getAllJiraUserAccounts()))
+        self.assertEqual(120, len(self.client.getAllJiraUserGroups()))
+        self.assertEqual('2400', self.client.getJiraUserAccount('User 2400')['accountId'])
+        self.assertEqual('g-110', self.client.getJiraGroup('group110')['groupId'])
+
+    def test_precedence(self):
+        # accountId before emailAddress before displayName, the first user with a display name wins
+        self.assertEqual('7', self.client.getJiraUserAccount('7')['accountId'])
+        self.assertEqual('1', self.client.getJiraUserAccount('User 1')['accountId'])
+        self.assertEqual('12', self.client.getJiraUserAccount('USER12@example.com')['accountId'])
+        self.assertIsNone(self.client.getJiraUserAccount('nobody'))
+
+    def test_loaded_once(self):
+        threads = [threading.Thread(target=self.client.getJiraUserAccount, args=(f'User {i}',)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.client.getJiraUserAccount('User 3')
+        self.assertEqual(3, self.client.assetsGet.call_count)
+
+
+class TestMetadataIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken")
+        self.client.assetsUrl = "url"
+        self.attributes = [{'id': '11', 'name': 'Name', 'type': 0, 'defaultType': {'id': 0}, 'label': True},
+                           {'id': '12', 'name': 'Serial', 'type': 0, 'defaultType': {'id': 0}}]
+        objectTypes = [{'id': '1', 'name': 'Laptops'}, {'id': '2', 'name': 'Parts', 'parentObjectTypeId': '1'},
+                       {'id': '3', 'name': 'Parts', 'parentObjectTypeId': '5'}]
+
+        def get(query):
+            if query.endswith('/attributes'):
+                return list(self.attributes)
+            if '/objecttypes/flat' in query:
+                return objectTypes
+            return {'total': 2, 'isLast': True, 'maxResults': 50, 'values': [{'id': '7', 'name': 'Assets', 'objectSchemaKey': 'AS'},
+                                                                           {'id': '8', 'name': 'Users', 'objectSchemaKey': 'US'}]}
+        self.client.assetsGet = MagicMock(side_effect=get)
+        self.client.assetsPost = MagicMock(return_value={'id': '13'})
+
+    def test_payload_without_requests(self):
+        self.client.constructObjectPayload({'Name': 'Laptop 1', 'Serial': 'A1'}, '1')
+        self.client.constructObjectPayload({'Name': 'Laptop 2', 'Serial': 'A2'}, '1')
+        self.assertEqual(1, self.client.assetsGet.call_count)
+
+    def test_references_resolved_at_once(self):
+        self.attributes.append({'id': '13', 'name': 'Parts', 'type': 1})
+        self.client.cacheObjectKey({'id': '101', 'objectKey': 'AS-101'})
+        self.client.getObjects = MagicMock(return_value=[{'id': '102', 'objectKey': 'AS-102'}, {'id': '103', 'objectKey': 'AS-103'}])
+        payload = json.loads(self.client.constructObjectPayload({'Name': 'Laptop 1', 'Parts': ['101', '102', '103']}, '1'))
+        self.client.getObjects.assert_called_once_with("objectId in (102,103)", includeAttributes=False)
+        values = [value['value'] for attribute in payload['attributes'] if attribute['objectTypeAttributeId'] == '13' for value in attribute['objectAttributeValues']]
+        self.assertEqual(['AS-101', 'AS-102', 'AS-103'], values)
+        # The keys are cached for the next payloads
+        self.assertEqual({'102': 'AS-102'}, self.client.resolveObjectKeys(['102']))
+        self.client.getObjects.assert_called_once()
+
+    def test_failed_fetch_not_cached(self):
+        get = self.client.assetsGet.side_effect
+        self.client.assetsGet.side_effect = [None, get('/attributes')]
+        self.assertIsNone(self.client.getAttributeByName('1', 'Name'))
+        self.assertEqual('11', self.client.getAttributeByName('1', 'Name')['id'])
+        self.assertEqual(2, self.client.assetsGet.call_count)
+
+    def test_invalidated_by_create(self):
+        self.assertIsNone(self.client.getAttributeByName('1', 'Owner'))
+        self.attributes.append({'id': '13', 'name': 'Owner', 'type': 0, 'defaultType': {'id': 0}})
+        self.client.createObjectTypeAttribute('1', {'name': 'Owner'})
+        self.assertEqual('13', self.client.getAttributeByName('1', 'Owner')['id'])
+        self.assertEqual(2, self.client.assetsGet.call_count)
+
+    def test_object_types_and_schemas(self):
+        self.assertEqual('3', self.client.getObjectTypeByName('Parts', '7', '5')['id'])
+        self.assertEqual('2', self.client.getObjectTypeByName('Parts', '7')['id'])
+        self.assertIsNone(self.client.getObjectTypeByName('Parts', '7', '9'))
+        self.assertEqual('8', self.client.getObjectSchemaByKey('US')['id'])
+        self.assertEqual('7', self.client.getObjectSchemaByName('Assets')['id'])
+        self.assertEqual(2, self.client.assetsGet.call_count)
+
+    def test_object_types_reloaded_for_counts(self):
+        self.client.getObjectTypes('7')
+        self.client.assetsGet.side_effect = [[{'id': '1', 'name': 'Laptops', 'objectCount': 3}]]
+        self.assertEqual(3, self.client.getObjectTypes('7', includeObjectCounts=True)[0]['objectCount'])
+        self.assertTrue(self.client.assetsGet.call_args[0][0].endswith('includeObjectCounts=True'))
+        # The object types with counts are cached for both
+        self.assertEqual(3, self.client.getObjectTypes('7', includeObjectCounts=True)[0]['objectCount'])
+        self.assertEqual(3, self.client.getObjectTypes('7')[0]['objectCount'])
+        self.assertEqual(2, self.client.assetsGet.call_count)
+
+
+class TestPayloadEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken")
+        self.client.assetsUrl = "url"
+        self.attributes = [{'id': '11', 'name': 'Name', 'type': 0, 'defaultType': {'id': 0}},
+                           {'id': '12', 'name': 'Purchased', 'type': 0, 'defaultType': {'id': 4}},
+                           {'id': '13', 'name': 'Owner', 'type': 2}]
+        self.client.assetsGet = MagicMock(side_effect=lambda query: list(self.attributes))
+        self.client.getJiraUserAccount = MagicMock(return_value=None)
+
+    def values(self, payload):
+        return {attribute['objectTypeAttributeId']: [value['value'] for value in attribute['objectAttributeValues']] for attribute in payload['attributes']}
+
+    def test_values(self):
+        myDict = {'Name': 'Laptop "1"\n\tback\\slash||Spare', 'Purchased': '16-06-2022', 'Owner': 'Nobody', 'Colour': 'red'}
+        payload = self.client.buildObjectPayload(myDict, '1')
+        self.assertEqual('1', payload['objectTypeId'])
+        # Text is sent as it is, json escapes it. A user that is not found leaves the attribute out
+        self.assertEqual({'11': ['Laptop "1"\n\tback\\slash', 'Spare'], '12': ['2022-06-16']}, self.values(payload))
+        self.assertEqual(payload, json.loads(self.client.constructObjectPayload(myDict, '1')))
+
+    def test_dates(self):
+        self.assertEqual('2022-06-16', assets.toDate('2022-06-16'))
+        self.assertEqual('2022-06-16', assets.toDate('June 16 2022'))
+        self.assertTrue(assets.toDateTime('2022-06-16T10:41:30').startswith('2022-06-16T10:41:30.000'))
+        self.assertEqual(assets.toDateTime('2022-06-16 10:41:30'), assets.toDateTime('June 16 2022 10:41:30'))
+
+    def test_failed_fetch_not_cached(self):
+        self.client.assetsGet.side_effect = [None, list(self.attributes)]
+        self.assertEqual([], self.client.buildObjectPayload({'Name': 'Laptop 1'}, '1')['attributes'])
+        self.assertEqual({'11': ['Laptop 1']}, self.values(self.client.buildObjectPayload({'Name': 'Laptop 1'}, '1')))
+        self.assertEqual(2, self.client.assetsGet.call_count)
+
+    def test_compiled_once(self):
+        encoder = self.client.getPayloadEncoder('1')
+        self.client.buildObjectPayload({'Name': 'Laptop 1'}, '1')
+        self.assertIs(encoder, self.client.getPayloadEncoder('1'))
+        self.assertEqual(1, self.client.assetsGet.call_count)
+        # A changed attribute makes a new encoder
+        self.attributes.append({'id': '14', 'name': 'Serial', 'type': 0, 'defaultType': {'id': 0}})
+        self.client.invalidateAttributes('1')
+        self.assertEqual({'14': ['A1']}, self.values(self.client.buildObjectPayload({'Serial': 'A1'}, '1')))
+
+
+class TestTypeRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken")
+        self.client.assetsUrl = "url"
+
+        def get(query):
+            if '/objectschema/list' in query:
+                return {'total': 2, 'isLast': True, 'maxResults': 50, 'values': [{'id': '7', 'name': 'Assets', 'objectSchemaKey': 'AS'},
+                                                                               {'id': '8', 'name': 'Users', 'objectSchemaKey': 'US'}]}
+            if 'objectSchemaId=7' in query:
+                return [{'id': '70', 'name': 'Running'}]
+            if 'objectSchemaId=8' in query:
+                return [{'id': '80', 'name': 'Running'}, {'id': '81', 'name': 'Retired'}]
+            return [{'id': '1', 'name': 'Active'}]
+        self.client.assetsGet = MagicMock(side_effect=get)
+        self.client.assetsPost = MagicMock(return_value={'id': '82', 'name': 'Lost'})
+        self.client.assetsDelete = MagicMock(return_value={})
+
+    def test_one_request_per_scope(self):
+        self.assertEqual(4, len(self.client.getAllStatusTypes()))
+        self.assertEqual(4, len(self.client.getAllStatusTypes()))
+        self.assertEqual(1, len(self.client.getGlobalStatusTypes()))
+        self.assertEqual('81', self.client.getStatusTypeByName('Retired')['id'])
+        self.assertEqual(4, self.client.assetsGet.call_count)
+
+    def test_scoped_lookup(self):
+        self.assertEqual('70', self.client.getStatusTypeByName('Running')['id'])
+        self.assertEqual('80', self.client.getStatusTypeByName('Running', objectSchemaId='8')['id'])
+        self.assertEqual('1', self.client.getStatusTypeByName('Active', objectSchemaId='8')['id'])
+        self.assertIsNone(self.client.getStatusTypeByName('Retired', objectSchemaId='7'))
+
+    def test_created_type_is_added(self):
+        self.client.getStatusTypes('8')
+        self.client.createStatusType('Lost', 0, '', '8')
+        self.assertEqual('82', self.client.getStatusTypeByName('Lost', objectSchemaId='8')['id'])
+        self.assertEqual(['80', '81', '82'], [statusType['id'] for statusType in self.client.getStatusTypes('8')])
+        self.client.deleteStatusType('82')
+        self.assertEqual(['80', '81'], [statusType['id'] for statusType in self.client.getStatusTypes('8')])
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.client = assets.assetsConnect("jiraUrl", "username", "apiToken", maxConcurrency=8)
+
+    def test_small_result_is_not_sharded(self):
+        self.client.getObjectIdRange = MagicMock()
+        self.assertEqual(["objectTypeId=1"], self.client.getObjectShards("objectTypeId=1", 100, 5000))
+        self.client.getObjectIdRange.assert_not_called()
+
+    def test_shards_cover_id_range(self):
+        self.client.getObjectIdRange = MagicMock(return_value=(1000, 1999))
+        shards = self.client.getObjectShards("objectTypeId=1", 12000, 5000)
+        self.assertEqual(["objectTypeId=1 and objectId < 1333",
+                          "objectTypeId=1 and objectId >= 1333 and objectId < 1666",
+                          "objectTypeId=1 and objectId >= 1666"], shards)
+
+    def test_shards_are_merged_in_id_order(self):
+        self.client.getObjectShards = MagicMock(return_value=["a", "b"])
+        results = {"a": [{'id': '3'}, {'id': '1'}], "b": [{'id': '10'}, {'id': '7'}]}
+        self.client.getObjects = MagicMock(side_effect=lambda iql, *args: results[iql])
+        objects = list(self.client.iterObjectsSharded("objectTypeId=1", 20000))
+        self.assertEqual(['1', '3', '7', '10'], [object['id'] for object in objects])
+
+    def test_shards_are_scanned_in_a_bounded_window(self):
+        shards = [f"shard {i}" for i in range(20)]
+        self.client.getObjectShards = MagicMock(return_value=shards)
+        self.client.getObjects = MagicMock(side_effect=lambda iql, *args: [{'id': iql.split()[1]}])
+        iterator = self.client.iterObjectsSharded("objectTypeId=1", 100000)
+        self.assertEqual({'id': '0'}, next(iterator))
+        # Only maxConcurrency (8) shards are submitted ahead of the caller, with one page at a time each
+        self.assertLessEqual(self.client.getObjects.call_count, 8)
+        self.assertEqual(1, self.client.getObjects.call_args[0][4])
+        self.assertEqual([str(i) for i in range(1, 20)], [object['id'] for object in iterator])
+        self.assertEqual(20, self.client.getObjects.call_count)
+
+
+class TestContentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.store = assets.contentStore(self.folder+"/store", self.folder)
+
+    def test_same_content_is_stored_once(self):
+        assets.saveAsJson({'id': '1'}, "1", self.folder+"/run1/objects/history", store=self.store)
+        assets.saveAsJson({'id': '1'}, "1", self.folder+"/run2/objects/history", store=self.store)
+        self.store.commit("run1")
+        self.store.commit("run2")
+        blobs = [file for root, dirs, files in os.walk(self.folder+"/store/blobs") for file in files]
+        self.assertEqual(1, len(blobs))
+        self.assertEqual({'id': '1'}, assets.loadJson(self.folder+"/run2/objects/history/1.json", self.store))
+        self.assertTrue(self.store.exists(self.folder+"/run1/objects"))
+        self.assertFalse(self.store.exists(self.folder+"/run3"))
+
+    def test_prune_keeps_shared_blobs(self):
+        assets.saveAsJson({'id': '1'}, "1", self.folder+"/run1", store=self.store)
+        assets.saveAsJson({'id': '2'}, "2", self.folder+"/run1", store=self.store)
+        self.store.commit("run1")
+        self.store.link(self.folder+"/run1/1.json", self.folder+"/run2/1.json")
+        self.store.commit("run2")
+        os.utime(self.store.manifestFile("run1"), (0, 0))
+        self.assertEqual((1, 1), self.store.prune(90))
+        self.assertEqual(["run2"], self.store.getRuns())
+        self.store.checkout("run2", self.folder+"/restore")
+        self.assertEqual({'id': '1'}, assets.loadJson(self.folder+"/restore/1.json"))
+
+
+class TestZipStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def zipStore(self, run):
+        return assets.zipStore(self.folder, self.folder+"/backup-{run}.zip", 'deflate', 9).open(run)
+
+    def test_files_are_streamed_into_the_archive(self):
+        store = self.zipStore("run1")
+        for i in range(20):
+            assets.saveAsJson({'id': str(i)}, str(i), self.folder+"/run1/objects/history", store=store)
+        store.commit("run1")
+        archive = zipfile.ZipFile(self.folder+"/backup-run1.zip")
+        self.assertEqual(20, len(archive.namelist()))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual({'id': '3'}, json.loads(archive.read("run1/objects/history/3.json")))
+        self.assertFalse(os.path.exists(self.folder+"/run1"))
+
+    def test_previous_run_is_read_from_its_archive(self):
+        store = self.zipStore("run1")
+        assets.saveAsJson({'id': '1'}, "1", self.folder+"/run1/objects", store=store)
+        store.commit("run1")
+        store = self.zipStore("run2")
+        self.assertTrue(store.exists(self.folder+"/run1/objects"))
+        self.assertFalse(store.exists(self.folder+"/run1/objectsmeta"))
+        self.assertEqual({'id': '1'}, assets.loadJson(self.folder+"/run1/objects/1.json", store))
+        store.link(self.folder+"/run1/objects/1.json", self.folder+"/run2/objects/1.json")
+        store.commit("run2")
+        self.assertEqual(["run2/objects/1.json"], zipfile.ZipFile(self.folder+"/backup-run2.zip").namelist())
+
+
+class TestZipDir(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        for i in range(30):
+            assets.saveAsJson({'id': str(i), 'name': 'x'*i}, str(i), self.folder+"/run/objects")
+
+    def test_parallel_compression(self):
+        for codec in ['deflate', 'bzip2', 'lzma', 'store']:
+            zipname = f"{self.folder}/{codec}.zip"
+            assets.zipDir(self.folder+"/run", zipname, codec, workers=4)
+            archive = zipfile.ZipFile(zipname)
+            self.assertIsNone(archive.testzip())
+            self.assertEqual({'id': '7', 'name': 'xxxxxxx'}, json.loads(archive.read("run/objects/7.json")))
+            self.assertEqual([], assets.verifyZip(zipname, workers=4))
+
+    def test_zip64_member_count(self):
+        # More files than fit in the end of central directory record of a zip file without ZIP64
+        count = zipfile.ZIP_FILECOUNT_LIMIT+10
+        os.makedirs(self.folder+"/many/objects")
+        for i in range(count):
+            with open(f"{self.folder}/many/objects/{i}.json", 'w') as f:
+                f.write(str(i))
+        zipname = self.folder+"/many.zip"
+        assets.zipDir(self.folder+"/many", zipname, 'deflate', workers=4)
+        archive = zipfile.ZipFile(zipname)
+        self.assertEqual(count, len(archive.namelist()))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(str(count-1).encode(), archive.read(f"many/objects/{count-1}.json"))
+        self.assertEqual([], assets.verifyZip(zipname, workers=4))
+
+    def test_verify_detects_changed_file(self):
+        zipname = self.folder+"/backup.zip"
+        assets.zipDir(self.folder+"/run", zipname)
+        manifest = assets.loadJson(zipname+".manifest.json")
+        manifest["run/objects/3.json"]['sha256'] = "0"*64
+        manifest["run/objects/missing.json"] = manifest["run/objects/4.json"]
+        assets.saveAsJson(manifest, "backup.zip.manifest", self.folder)
+        self.assertEqual(["run/objects/missing.json: missing in the zip file", "run/objects/3.json: SHA-256 differs from the manifest"],
+                         assets.verifyZip(zipname, workers=2))
+
+
+class TestJsonLines(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_append_from_threads(self):
+        writer = assets.jsonLinesWriter("Laptops_1", self.folder+"/objects/history")
+        threads = [threading.Thread(target=lambda i=i: writer.append([{'objectId': str(i)}])) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        records = list(assets.iterJsonLines(self.folder+"/objects/history/Laptops_1.jsonl"))
+        self.assertEqual(set(str(i) for i in range(20)), set(records[0]['objectId'] for records in records))
+
+    def test_store(self):
+        store = assets.contentStore(self.folder+"/store", self.folder)
+        writer = assets.jsonLinesWriter("Laptops_1", self.folder+"/run/objects/comments", store)
+        writer.append([{'objectId': '1'}])
+        writer.append([{'objectId': '2'}])
+        writer.close()
+        self.assertFalse(os.path.exists(self.folder+"/run"))
+        self.assertEqual([[{'objectId': '1'}], [{'objectId': '2'}]],
+                         list(assets.iterJsonLines(self.folder+"/run/objects/comments/Laptops_1.jsonl", store)))
+
+
+class TestJournalFile(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_reopen_after_crash(self):
+        journal = assets.journalFile(self.folder+"/run.checkpoint.jsonl", syncEvery=2)
+        journal.append({'objectId': '1'})
+        journal.append({'objectId': '2'})
+        journal.close()
+        # A line that was cut off by a crash is dropped
+        with open(self.folder+"/run.checkpoint.jsonl", "a") as f:
+            f.write('{"objectId": "3"')
+        journal = assets.journalFile(self.folder+"/run.checkpoint.jsonl")
+        self.assertEqual([{'objectId': '1'}, {'objectId': '2'}], journal.entries)
+        journal.append({'objectId': '4'})
+        journal.close()
+        self.assertEqual(['1', '2', '4'], [entry['objectId'] for entry in assets.journalFile(self.folder+"/run.checkpoint.jsonl").entries])
+
+    def test_remove(self):
+        journal = assets.journalFile(self.folder+"/run.checkpoint.jsonl")
+        journal.append({'run': 'run'})
+        journal.remove()
+        self.assertFalse(os.path.exists(self.folder+"/run.checkpoint.jsonl"))
+
+
+class TestBackupDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.database = assets.backupDatabase(self.folder+"/backup.sqlite", self.folder)
+        self.addCleanup(self.database.close)
+        run = self.folder+"/run/S"
+        assets.saveAsJson([{'id': '1', 'name': 'Laptops'}], "objecttypes", run+"/config", store=self.database)
+        assets.saveAsJson([{'id': '10', 'name': 'Name', 'label': True}], "Laptops_1", run+"/config/attributes", store=self.database)
+        assets.saveAsJson({'2': {'Name': 'Laptop 2'}}, "Laptops_1", run+"/objects", store=self.database)
+        assets.saveAsJson([{'id': '2', 'label': 'Laptop 2', 'objectKey': 'S-2', 'objectType': {'id': '1'}, 'attributes': [
+            {'objectTypeAttributeId': '10', 'objectAttributeValues': [{'value': 'Laptop 2', 'displayValue': 'Laptop 2'}]},
+            {'objectTypeAttributeId': '11', 'objectAttributeValues': [{'referencedType': True, 'searchValue': 'S-3', 'referencedObject': {'id': '3', 'objectKey': 'S-3'}}]}]}],
+            "Laptops_1", run+"/objectsmeta", store=self.database)
+        writer = assets.jsonLinesWriter("Laptops_1", run+"/objects/history", self.database)
+        writer.append([{'objectId': '2', 'created': '2022-01-01', 'type': 0, 'actor': {'displayName': 'x'}}])
+        writer.close()
+        self.database.commit("run")
+
+    def test_indexed_lookups(self):
+        self.assertEqual([{'id': '2', 'data': '{"Name": "Laptop 2"}'}], self.database.query("SELECT id, data FROM objects WHERE label=?", ('Laptop 2',)))
+        self.assertEqual([{'objectId': '2'}], self.database.query("SELECT objectId FROM objectreferences WHERE referencedObjectId='3'"))
+        self.assertEqual([{'type': 0}], self.database.query("SELECT type FROM history WHERE objectId='2'"))
+
+    def test_checkout(self):
+        self.database.checkout(self.folder+"/restore")
+        for path in ["S/config/objecttypes.json", "S/config/attributes/Laptops_1.json", "S/objects/Laptops_1.json", "S/objectsmeta/Laptops_1.json"]:
+            with open(f"{self.folder}/run/{path}") as original, open(f"{self.folder}/restore/{path}") as restored:
+                self.assertEqual(original.read(), restored.read())
+        self.assertEqual(1, len(list(assets.iterJsonLines(self.folder+"/restore/S/objects/history/Laptops_1.jsonl"))))
+
+    def test_partial_checkout(self):
+        assets.saveAsJson({'4': {'Name': 'Laptop 4'}}, "Laptops_1", self.folder+"/run/S/objects", store=self.database)
+        assets.saveAsJson([{'id': '4', 'label': 'Laptop 4', 'objectType': {'id': '1'}}], "Laptops_1", self.folder+"/run/S/objectsmeta", store=self.database)
+        self.database.checkout(self.folder+"/restore", ['4'])
+        self.assertEqual({'4': {'Name': 'Laptop 4'}}, assets.loadJson(self.folder+"/restore/S/objects/Laptops_1.json"))
+        self.assertEqual(['4'], [object['id'] for object in assets.loadJson(self.folder+"/restore/S/objectsmeta/Laptops_1.json")])
+        self.assertFalse(os.path.exists(self.folder+"/restore/S/objects/history/Laptops_1.jsonl"))
+        self.assertTrue(os.path.exists(self.folder+"/restore/partialCheckout.json"))
+        # A full checkout writes all objects again
+        self.database.checkout(self.folder+"/restore")
+        self.assertEqual(['2', '4'], sorted(assets.loadJson(self.folder+"/restore/S/objects/Laptops_1.json")))
+        self.assertFalse(os.path.exists(self.folder+"/restore/partialCheckout.json"))
@@ -0,0 +1,156 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import datetime as dt, timedelta, timezone
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import assets
+import backupAssets
+
+
+class syncPool():
+    # Runs the object tasks at once, instead of in the threads of a workPool
+    errors = 0
+
+    def submit(self, function, *args):
+        function(*args)
+
+
+def entry(id, name):
+    return {'id': id, 'objectKey': f'AS-{id}', 'attributes': [
+        {'objectTypeAttributeId': '10', 'objectAttributeValues': [{'value': name, 'displayValue': name, 'referencedType': False}]}]}
+
+
+class TestIncrementalBackup(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.previous = self.folder+"/previous/AS"
+        self.current = self.folder+"/current/AS"
+        # The previous backup has objects 1, 2 and 3
+        assets.saveAsJson([entry('1', 'one'), entry('2', 'two'), entry('3', 'three')], "Laptops_5", self.previous+"/objectsmeta")
+        assets.saveAsJson({'1': {'Name': 'one'}, '2': {'Name': 'two'}, '3': {'Name': 'three'}}, "Laptops_5", self.previous+"/objects")
+        writer = assets.jsonLinesWriter("Laptops_5", self.previous+"/objects/history")
+        for id in ['1', '2', '3']:
+            writer.append([{'objectId': id, 'created': 'before'}])
+        writer.close()
+
+        # Object 2 was updated, 3 was deleted and 4 was moved to this object type
+        backupAssets.myAssets = MagicMock()
+        backupAssets.myAssets.iterObjects.return_value = [entry('2', 'two v2')]
+        backupAssets.myAssets.iterObjectsSharded.return_value = [{'id': '1'}, {'id': '2'}, {'id': '4'}]
+        backupAssets.myAssets.getObjects.return_value = [entry('4', 'four')]
+        backupAssets.myAssets.getObjectHistory.side_effect = lambda id: [{'objectId': id, 'created': 'now'}]
+        backupAssets.myAssets.getObjectComment.return_value = []
+        backupAssets.pool = syncPool()
+        backupAssets.store = None
+        backupAssets.checkpoint = None
+        backupAssets.packedHistory = True
+        backupAssets.asyncMode = False
+        backupAssets.shardSize = 5000
+
+    def scan(self):
+        backupAssets.scanObjectTypeIncremental({'id': '5', 'name': 'Laptops', 'objectCount': 3}, [{'id': '10', 'name': 'Name'}], self.current, self.previous, 60)
+        objects = assets.loadJson(self.current+"/objectsmeta/Laptops_5.json")
+        data = assets.loadJson(self.current+"/objects/Laptops_5.json")
+        history = {records[0]['objectId']: records for records in assets.iterJsonLines(self.current+"/objects/history/Laptops_5.jsonl")}
+        return objects, data, history
+
+    def test_changed_objects_are_fetched(self):
+        objects, data, history = self.scan()
+        backupAssets.myAssets.iterObjects.assert_called_once_with("objectTypeId=5 and updated >= now(-60m)")
+        backupAssets.myAssets.getObjects.assert_called_once_with("objectTypeId=5 and objectId in (4)")
+        self.assertEqual({'Name': 'two v2'}, data['2'])
+        self.assertEqual({'Name': 'four'}, data['4'])
+        self.assertEqual([{'objectId': '2', 'created': 'now'}], history['2'])
+        self.assertEqual(2, backupAssets.myAssets.getObjectHistory.call_count)
+
+    def test_deleted_objects_are_left_out(self):
+        objects, data, history = self.scan()
+        self.assertEqual(['1', '2', '4'], [object['id'] for object in objects])
+        self.assertNotIn('3', data)
+        self.assertNotIn('3', history)
+
+    def test_unchanged_objects_are_carried_forward(self):
+        objects, data, history = self.scan()
+        self.assertEqual(entry('1', 'one'), objects[0])
+        self.assertEqual({'Name': 'one'}, data['1'])
+        self.assertEqual([{'objectId': '1', 'created': 'before'}], history['1'])
+
+
+class TestBackupState(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        os.makedirs(self.folder+"/2022-06-16_10-41-30/AS")
+        backupAssets.store = None
+        backupAssets.incremental = True
+        backupAssets.fullBackupDays = 7
+        backupAssets.stateFile = self.folder+"/backupState.json"
+        backupAssets.runStarted = dt(2022, 6, 17, 10, 0, tzinfo=timezone.utc)
+        lastRun = backupAssets.runStarted-timedelta(hours=2)
+        backupAssets.backupState = {'AS': {'lastRun': lastRun.isoformat(), 'lastFullRun': (lastRun-timedelta(days=3)).isoformat(), 'folder': self.folder+"/2022-06-16_10-41-30"}}
+
+    def test_previous_backup(self):
+        self.assertEqual((self.folder+"/2022-06-16_10-41-30/AS", 130), backupAssets.getPreviousBackup('AS'))
+        self.assertIsNone(backupAssets.getPreviousBackup('IT'))
+
+    def test_full_backup_when_due_or_missing(self):
+        backupAssets.runStarted += timedelta(days=5)
+        self.assertIsNone(backupAssets.getPreviousBackup('AS'))
+        backupAssets.runStarted -= timedelta(days=5)
+        shutil.rmtree(self.folder+"/2022-06-16_10-41-30")
+        self.assertIsNone(backupAssets.getPreviousBackup('AS'))
+
+    def test_state_after_run(self):
+        lastFullRun = backupAssets.backupState['AS']['lastFullRun']
+        backupAssets.updateBackupState([{'objectSchemaKey': 'AS'}], {'AS': ('folder', 130)}, "current", False)
+        state = assets.loadJson(backupAssets.stateFile)
+        self.assertEqual({'lastRun': backupAssets.runStarted.isoformat(), 'lastFullRun': lastFullRun, 'folder': "current"}, state['AS'])
+
+    def test_full_backup_after_failed_run(self):
+        backupAssets.updateBackupState([{'objectSchemaKey': 'AS'}], {'AS': ('folder', 130)}, "current", 2)
+        self.assertEqual({}, assets.loadJson(backupAssets.stateFile))
+        self.assertIsNone(backupAssets.getPreviousBackup('AS'))
+
+
+class TestBackupObject(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        backupAssets.myAssets = MagicMock()
+        backupAssets.myAssets.getObjectHistory.return_value = [{'objectId': '1', 'created': 'now'}]
+        backupAssets.myAssets.getObjectComment.return_value = []
+        backupAssets.store = None
+        backupAssets.packedHistory = True
+        backupAssets.finishedObjects.clear()
+        backupAssets.checkpoint = assets.journalFile(self.folder+"/checkpoint.jsonl")
+        self.addCleanup(backupAssets.checkpoint.close)
+        self.typeBackup = backupAssets.objectTypeBackup({'id': '5', 'name': 'Laptops'}, self.folder+"/AS")
+        self.typeBackup.start()
+
+    def checkpointed(self):
+        backupAssets.checkpoint.sync()
+        return [entry['objectId'] for entry, position in assets.iterJournal(self.folder+"/checkpoint.jsonl") if 'objectId' in entry]
+
+    def test_object_without_comments_is_checkpointed(self):
+        backupAssets.backupObject({'id': '1'}, {'Name': 'one'}, self.typeBackup)
+        self.assertEqual(['1'], self.checkpointed())
+        self.assertEqual(0, self.typeBackup.failed)
+
+    def test_failed_request_is_not_checkpointed(self):
+        for failing in ['getObjectData', 'getObjectHistory', 'getObjectComment']:
+            with self.subTest(failing):
+                getattr(backupAssets.myAssets, failing).return_value = None
+                self.typeBackup.start()
+                backupAssets.backupObject({'id': '1'}, None, self.typeBackup)
+                getattr(backupAssets.myAssets, failing).return_value = {'Name': 'one'} if failing == 'getObjectData' else []
+        self.assertEqual([], self.checkpointed())
+        self.assertEqual(3, self.typeBackup.failed)
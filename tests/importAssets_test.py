@@ -0,0 +1,80 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import assets
+import importAssets
+
+
+class TestCreatedObjectsJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        importAssets.myAssets = MagicMock(workspaceId="ws")
+        importAssets.createdObjects.clear()
+        importAssets.objectIdTranslate.clear()
+        self.schemaInfo = {'oldObjectSchemaKey': 'AS', 'newObjectSchemaKey': 'NEW'}
+
+    def load(self, objectSchemasInfo=None):
+        importAssets.createdObjectsJournal = importAssets.loadCreatedObjects(self.folder, objectSchemasInfo or [self.schemaInfo])
+        self.addCleanup(importAssets.createdObjectsJournal.close)
+        return importAssets.createdObjectsJournal
+
+    def test_write(self):
+        self.load()
+        importAssets.journalCreatedObject({'id': '1'}, {'id': '101', 'objectKey': 'NEW-1'}, '7', self.schemaInfo)
+        importAssets.createdObjectsJournal.close()
+        entries = [entry for entry, position in assets.iterJournal(self.folder+"/createdObjects.jsonl")]
+        self.assertEqual([{'oldObjectId': '1', 'objectId': '101', 'objectTypeId': '7', 'objectKey': 'NEW-1',
+                           'site': 'ws', 'oldObjectSchemaKey': 'AS', 'objectSchemaKey': 'NEW'}], entries)
+
+    def test_synced_in_batches(self):
+        self.load()
+        with patch.object(assets.os, 'fsync') as fsync:
+            for i in range(250):
+                importAssets.journalCreatedObject({'id': str(i)}, {'id': str(1000+i)}, '7', self.schemaInfo)
+            # Forced to disk every 100 objects and when the journal is closed
+            self.assertEqual(2, fsync.call_count)
+            importAssets.createdObjectsJournal.close()
+            self.assertEqual(3, fsync.call_count)
+
+    def test_replay_of_same_target(self):
+        self.load()
+        importAssets.journalCreatedObject({'id': '1'}, {'id': '101', 'objectKey': 'NEW-1'}, '7', self.schemaInfo)
+        importAssets.journalCreatedObject({'id': '2'}, {'id': '102'}, '8', {'oldObjectSchemaKey': 'AS', 'newObjectSchemaKey': 'OTHER'})
+        importAssets.createdObjectsJournal.append({'oldObjectId': '3', 'objectId': '103', 'objectTypeId': '7'})
+        importAssets.myAssets.workspaceId = "other-site"
+        importAssets.journalCreatedObject({'id': '4'}, {'id': '104'}, '7', self.schemaInfo)
+        importAssets.createdObjectsJournal.close()
+
+        importAssets.myAssets.workspaceId = "ws"
+        self.load()
+        self.assertEqual({'1': {'id': '101', 'objectType': {'id': '7'}, 'objectKey': 'NEW-1'}}, importAssets.createdObjects)
+        self.assertEqual({'1': '101'}, importAssets.objectIdTranslate)
+        importAssets.myAssets.cacheObjectKey.assert_called_once()
+
+    def test_journaled_object_is_not_created_again(self):
+        self.load()
+        importAssets.journalCreatedObject({'id': '1'}, {'id': '101', 'objectKey': 'NEW-1'}, '7', self.schemaInfo)
+        importAssets.createdObjectsJournal.close()
+        self.load()
+        object = {'id': '1', 'label': 'Laptop 1', 'name': 'Laptop 1', 'objectType': {'name': 'Laptops'}}
+        oldObject, newObject = importAssets.createObject('7', object)
+        self.assertEqual('101', newObject['id'])
+        importAssets.myAssets.createObjectById.assert_not_called()
+        # Not journaled twice
+        importAssets.journalCreatedObject(oldObject, newObject, '7', self.schemaInfo)
+        importAssets.createdObjectsJournal.close()
+        self.assertEqual(1, len(list(assets.iterJournal(self.folder+"/createdObjects.jsonl"))))
+
+        # As an object of another object type it is looked up and created
+        importAssets.myAssets.getObjects.return_value = []
+        importAssets.myAssets.createObjectById.return_value = {'id': '201'}
+        self.assertEqual('201', importAssets.createObject('9', object)[1]['id'])
+        importAssets.myAssets.getObjects.assert_called_once_with('objectTypeId=9 and objectId="101"')
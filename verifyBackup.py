@@ -0,0 +1,52 @@
+import os, sys, optparse, assets, logging, logging.handlers
+
+# Script settings 
+logFileKeep = 10 # Number of days to keep the logfiles, before being rotated
+logFile = os.path.dirname(os.path.abspath(__file__))+"/verify.log"
+
+# Debug level
+fileFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+handler = logging.handlers.TimedRotatingFileHandler(logFile, when="midnight", backupCount=logFileKeep)
+handler.setFormatter(fileFormatter)
+fileLogger = logging.getLogger()
+fileLogger.addHandler(handler)
+fileLogger.setLevel(logging.INFO)
+
+# define a Handler which writes INFO messages or higher to the sys.stderr
+consoleLogger = logging.StreamHandler()
+consoleLogger.setLevel(logging.INFO)
+consoleFormatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s [%(lineno)d] %(message)s')
+# tell the handler to use this format
+consoleLogger.setFormatter(consoleFormatter)
+# add the handler to the root logger
+logging.getLogger().addHandler(consoleLogger)
+logging.info("-----------Start of Run-----------")    
+
+# Check backup zip files against their CRCs and the SHA-256 manifest that is saved next to them
+# Usage: python verifyBackup.py [-w <number of threads>] <zip file> [<zip file> ...]
+parser = optparse.OptionParser(usage="%prog [-w workers] zipfile [zipfile ...]")
+parser.add_option("-w",
+                dest = "workers",
+                type = "int",
+                help = "Number of threads, default is the number of cores")
+commandlineOptions, zipFiles = parser.parse_args()
+if not zipFiles:
+    parser.print_help()
+    exit(1)
+
+failed = 0
+for zipFile in zipFiles:
+    if not os.path.isfile(zipFile):
+        logging.error(f"ERROR: '{zipFile}' is not a file!")
+        failed += 1
+        continue
+    errors = assets.verifyZip(zipFile, commandlineOptions.workers)
+    for error in errors:
+        logging.error(f"{zipFile}: {error}")
+    if errors:
+        failed += 1
+
+logging.info(f"{len(zipFiles)-failed} of {len(zipFiles)} zip files are OK")
+logging.info("------------End of Run------------")
+logging.shutdown()
+sys.exit(1 if failed else 0)